@@ -1,7 +1,8 @@
 # Area calculator for 2D TREAT lattice cells
 
 
-import openmc
+import geometry_snapshot
+import profiling
 from math import sqrt, pi
 
 rt = sqrt(2)/2  # "root two" (useful shorthand)
@@ -33,6 +34,7 @@ def __setup(geom):
 	return surfs, key_list, n, xpitch, ypitch
 
 
+@profiling.timed
 def fuel_cell_by_material(geom, display = False):
 	"""Calculate the area of each material a fuel lattice cell
 	
@@ -147,6 +149,7 @@ def fuel_cell_by_material(geom, display = False):
 	return fuel_area, gap_area, clad_area, outer_area
 
 
+@profiling.timed
 def control_cell_by_material(geom, display = False):
 	"""Calculate the area of each material a control lattice cell.
 	The control cells are the same as the fuel cells, but with 5 concentric
@@ -210,6 +213,7 @@ def control_cell_by_material(geom, display = False):
 	       fuel_area, gap_area, clad_area, outer_area
 
 
+@profiling.timed
 def reflector_cell_by_material(geom, display = False):
 	"""Calculate the area of each material a graphite reflector lattice cell
 
@@ -307,8 +311,8 @@ def reflector_cell_by_material(geom, display = False):
 
 
 if __name__ == "__main__":
-	# Extract the geometry from an existing summary
-	geometry = openmc.Summary("summary.h5").geometry
+	# Extract the geometry from an existing summary (cached after the first load)
+	geometry = geometry_snapshot.load_geometry("summary.h5")
 	
 	# Test
 	print("Fuel Cell:")
@@ -0,0 +1,220 @@
+# Asynchronous pipeline
+#
+# Launch OpenMC as a subprocess and post-process every statepoint as soon
+# as it is written (see the statepoint batches of infinite_fuel.py),
+# while transport carries on. Each new statepoint is handed to a process
+# pool for the eigenvalue check, MGXS extraction and a diffusion preview;
+# a callback may kill the run early when the results look wrong.
+
+import os
+import re
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+OPENMC = "openmc"
+POLL_INTERVAL = 5.0  # seconds
+STATEPOINT_PATTERN = re.compile(r"^statepoint\.(\d+)\.h5$")
+
+
+def keff_check(statepoint):
+	"""Read the batch number and combined eigenvalue of a statepoint"""
+	import openmc
+	sp = openmc.StatePoint(statepoint, autolink = False)
+	keff, std = sp.k_combined
+	return {"statepoint": statepoint, "batch": sp.current_batch,
+	        "keff": float(keff), "keff_std": float(std)}
+
+
+def extract_arrays(statepoint, library = "treat_mesh_lib", library_directory = None, mesh = None):
+	"""Load a dumped mesh library from a statepoint and save its mesh arrays
+
+	The arrays are written next to the statepoint, as
+	statepoint.<batch>.arrays.npz, and the filename is returned. `mesh`
+	is the library's mesh domain (e.g. build_mesh.mesh); by default, the
+	only mesh of the statepoint.
+
+	"""
+	import openmc
+	import mesh_arrays
+	if library_directory is None:
+		library_directory = os.path.dirname(statepoint) or "."
+	sp = openmc.StatePoint(statepoint)
+	if mesh is None:
+		if len(sp.meshes) != 1:
+			raise ValueError("{} has {} meshes; give the mesh of the library".format(
+				statepoint, len(sp.meshes)))
+		mesh = list(sp.meshes.values())[0]
+	mesh_lib = mesh_arrays.load_mesh_library(sp, mesh, library, library_directory)
+	filename = statepoint[:-len(".h5")] + ".arrays.npz"
+	mesh_arrays.save_arrays(filename, mesh_arrays.get_mesh_arrays(mesh_lib, mesh),
+	                        lower_left = mesh.lower_left, upper_right = mesh.upper_right)
+	return filename
+
+
+def diffusion_preview(arrays_file, boundary = "reflective"):
+	"""Diffusion eigenvalue of the mesh arrays written by extract_arrays()"""
+	import numpy
+	import mesh_arrays
+	from diffusion import DiffusionSolver
+	arrays = mesh_arrays.load_arrays(arrays_file)
+	lower_left = numpy.asarray(arrays.pop("lower_left"), dtype = float)
+	upper_right = numpy.asarray(arrays.pop("upper_right"), dtype = float)
+	nx, ny = arrays["total"].shape[:2]
+	dx = (upper_right[0] - lower_left[0])/nx
+	dy = (upper_right[1] - lower_left[1])/ny
+	result = DiffusionSolver(arrays, dx, dy, boundary).solve()
+	return {"arrays": arrays_file, "keff": result.keff, "iterations": result.iterations}
+
+
+def statepoint_task(statepoint, library = None, preview = False, boundary = "reflective", mesh = None):
+	"""Everything done for one statepoint, run in a worker process"""
+	result = keff_check(statepoint)
+	if library:
+		result["arrays"] = extract_arrays(statepoint, library, mesh = mesh)
+		if preview:
+			result["diffusion"] = diffusion_preview(result["arrays"], boundary)
+	return result
+
+
+def keff_guard(k_min = 0.5, k_max = 2.5, max_std = None):
+	"""Make a callback that kills runs whose eigenvalue is unphysical
+
+	Parameters
+	----------
+	k_min, k_max : float, optional
+		Acceptable range of the combined eigenvalue
+	max_std : float, optional
+		Kill the run if the eigenvalue uncertainty is still larger than
+		this at a statepoint [Default: None]
+
+	Returns
+	-------
+	callback : function
+		callback(result) -> True to kill the run
+
+	"""
+	def callback(result):
+		keff, std = result["keff"], result["keff_std"]
+		if not k_min <= keff <= k_max:
+			return True
+		return max_std is not None and std > max_std
+	return callback
+
+
+class AsyncRun(object):
+	"""An OpenMC run whose statepoints are processed while it runs
+
+	Parameters
+	----------
+	directory : str
+		Directory with the input files, where the statepoints appear
+	task : function, optional
+		Picklable function of the statepoint path, run in the pool
+		[Default: statepoint_task]
+	on_result : function, optional
+		Called in the event loop with each task's result; returning True
+		kills the run [Default: None]
+	processes : int, optional
+		Size of the process pool [Default: 2]
+	threads : int, optional
+		OpenMP threads for OpenMC [Default: None -- OpenMC's default]
+	executable : str, optional
+		[Default: OPENMC]
+	poll_interval : float, optional
+		Seconds between directory scans [Default: POLL_INTERVAL]
+
+	Attributes
+	----------
+	results : dict
+		{statepoint path: result of `task`}
+	killed : bool
+		Whether the run was stopped by `on_result`
+
+	"""
+	def __init__(self, directory, task = statepoint_task, on_result = None, processes = 2,
+	             threads = None, executable = OPENMC, poll_interval = POLL_INTERVAL, **task_kwargs):
+		self.directory = directory
+		self.task = task
+		self.task_kwargs = task_kwargs
+		self.on_result = on_result
+		self.processes = processes
+		self.threads = threads
+		self.executable = executable
+		self.poll_interval = poll_interval
+		self.results = {}
+		self.killed = False
+		self.returncode = None
+		self._sizes = {}
+		self._seen = set()
+
+	def _new_statepoints(self):
+		"""Statepoints whose size has not changed since the last scan"""
+		ready = []
+		for name in sorted(os.listdir(self.directory)):
+			if not STATEPOINT_PATTERN.match(name):
+				continue
+			path = os.path.join(self.directory, name)
+			if path in self._seen:
+				continue
+			size = os.path.getsize(path)
+			if self._sizes.get(path) == size:
+				self._seen.add(path)
+				ready.append(path)
+			self._sizes[path] = size
+		return ready
+
+	def _existing_statepoints(self):
+		return set(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+		           if STATEPOINT_PATTERN.match(name))
+
+	async def _handle(self, loop, pool, statepoint, process):
+		result = await loop.run_in_executor(pool, _call, self.task, statepoint, self.task_kwargs)
+		self.results[statepoint] = result
+		if self.on_result is not None and self.on_result(result) and process.returncode is None:
+			self.killed = True
+			process.terminate()
+		return result
+
+	async def run(self):
+		"""Run OpenMC and process its statepoints; return the results"""
+		# Statepoints left over from an earlier run are not ours
+		self._seen = self._existing_statepoints()
+		command = [self.executable]
+		if self.threads:
+			command += ["-s", str(self.threads)]
+		loop = asyncio.get_running_loop()
+		log = open(os.path.join(self.directory, "openmc.log"), "w")
+		pending = []
+		try:
+			process = await asyncio.create_subprocess_exec(
+				*command, cwd = self.directory, stdout = log, stderr = asyncio.subprocess.STDOUT)
+			with ProcessPoolExecutor(self.processes) as pool:
+				waiter = asyncio.ensure_future(process.wait())
+				while not waiter.done():
+					await asyncio.wait([waiter], timeout = self.poll_interval)
+					for statepoint in self._new_statepoints():
+						pending.append(asyncio.ensure_future(
+							self._handle(loop, pool, statepoint, process)))
+				# The final statepoints are complete once OpenMC has exited
+				if not self.killed:
+					for statepoint in sorted(self._existing_statepoints() - self._seen):
+						self._seen.add(statepoint)
+						pending.append(asyncio.ensure_future(
+							self._handle(loop, pool, statepoint, process)))
+				if pending:
+					await asyncio.gather(*pending)
+			self.returncode = process.returncode
+		finally:
+			log.close()
+		return self.results
+
+
+def _call(task, statepoint, kwargs):
+	return task(statepoint, **kwargs)
+
+
+def run_and_process(directory, **kwargs):
+	"""Blocking wrapper: run OpenMC in `directory` and process its statepoints"""
+	run = AsyncRun(directory, **kwargs)
+	asyncio.run(run.run())
+	return run
@@ -0,0 +1,224 @@
+# Batch plots
+#
+# Render MGXS maps and MC vs. MOC comparison maps straight to image files
+# with a non-interactive backend, spreading the work over a process pool.
+# Each worker builds a single figure and colorbar once and reuses them
+# for every plot it is handed, so hundreds of maps can be written on a
+# headless machine in one go.
+
+import os
+import matplotlib
+matplotlib.use("Agg")
+import pylab
+import mesh_arrays
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+DIRECTORY = "plots/batch/"
+STATEPOINT_LIB = "treat_mesh_lib"
+EPS = 1E-6
+FIGSIZE = (8, 6.5)
+DPI = 100
+CMAP = "jet"
+
+PlotJob = namedtuple("PlotJob", ("filename", "data", "title", "clim"))
+
+# Per-process state, created once by _init_worker()
+_figure = None
+_axes = None
+_image = None
+_colorbar = None
+
+
+def _init_worker(figsize = FIGSIZE, dpi = DPI, cmap = CMAP):
+	"""Create the figure, image and colorbar reused by this worker"""
+	global _figure, _axes, _image, _colorbar
+	_figure = pylab.figure(figsize = figsize, dpi = dpi)
+	_axes = _figure.add_subplot(111)
+	_image = _axes.imshow(pylab.zeros((2, 2)), interpolation = 'none', cmap = cmap)
+	_colorbar = _figure.colorbar(_image, ax = _axes)
+
+
+def _render(job):
+	"""Draw a single PlotJob onto the worker's figure and save it
+
+	Parameters
+	----------
+	job : PlotJob
+		The array to plot, its title, the color limits (or None to
+		autoscale on the finite values), and the output filename.
+
+	Returns
+	-------
+	filename : str
+		Path of the image that was written
+
+	"""
+	if _figure is None:
+		_init_worker()
+	data = pylab.asarray(job.data, dtype = float).squeeze()
+	ny, nx = data.shape
+	_image.set_data(data)
+	_image.set_extent((-0.5, nx - 0.5, ny - 0.5, -0.5))
+	_axes.set_xlim(-0.5, nx - 0.5)
+	_axes.set_ylim(ny - 0.5, -0.5)
+
+	if job.clim is not None:
+		vmin, vmax = job.clim
+	elif pylab.isfinite(data).any():
+		vmin, vmax = pylab.nanmin(data), pylab.nanmax(data)
+	else:
+		vmin, vmax = 0.0, 1.0
+	if vmin == vmax:
+		vmax = vmin + 1.0
+	_image.set_clim(vmin, vmax)
+	_colorbar.update_normal(_image)
+	_axes.set_title(job.title)
+
+	dirname = os.path.dirname(job.filename)
+	if dirname:
+		os.makedirs(dirname, exist_ok = True)
+	_figure.savefig(job.filename)
+	return job.filename
+
+
+def _blank_zeros(array, eps = EPS):
+	"""Return a float copy of `array` with values <= eps set to NaN"""
+	array = pylab.array(array, dtype = float)
+	array[array <= eps] = pylab.nan
+	return array
+
+
+def comparison_jobs(mc_rates, moc_rates, directory = DIRECTORY, eps = EPS, prefix = "fission"):
+	"""Build the jobs for the OpenMC/OpenMOC reaction rate comparison
+
+	This mirrors plot_moc_results.plot_reaction_rates(): zero rates are
+	blanked, both maps are normalized by their nanmean, and the percent
+	error of MOC relative to MC is plotted between -100 and 100.
+
+	Parameters
+	----------
+	mc_rates : numpy.ndarray
+		Monte Carlo reaction rates on the mesh
+	moc_rates : numpy.ndarray
+		OpenMOC reaction rates on the same mesh
+	directory : str, optional
+		Directory to write the images to [Default: DIRECTORY]
+	eps : float, optional
+		Rates at or below this value are treated as zero [Default: EPS]
+	prefix : str, optional
+		Prefix of the image filenames [Default: "fission"]
+
+	Returns
+	-------
+	jobs : list of PlotJob
+
+	"""
+	mc = _blank_zeros(mc_rates, eps)
+	moc = pylab.array(moc_rates, dtype = float)
+	moc[pylab.isnan(mc)] = pylab.nan
+	mc /= pylab.nanmean(mc)
+	moc /= pylab.nanmean(moc)
+	errors = (moc - mc)/(mc/100.0)
+
+	return [PlotJob(os.path.join(directory, prefix + "_openmc.png"), mc,
+	                "OpenMC Fission Rates", None),
+	        PlotJob(os.path.join(directory, prefix + "_openmoc.png"), moc,
+	                "OpenMOC Fission Rates", None),
+	        PlotJob(os.path.join(directory, prefix + "_error.png"), errors,
+	                "Percent error", (-100, 100))]
+
+
+def mgxs_jobs(mesh_lib, mesh, mgxs_types = None, directory = DIRECTORY,
+              nuclides = "sum", eps = EPS):
+	"""Build one job per MGXS type and energy group of a mesh library
+
+	Scattering matrices are plotted as the total out-scatter of each
+	incoming group (the matrix summed over outgoing groups).
+
+	Parameters
+	----------
+	mesh_lib : openmc.mgxs.Library
+		Library that has already been loaded from a statepoint
+	mesh : openmc.Mesh
+		The mesh domain of `mesh_lib`
+	mgxs_types : iterable of str, optional
+		MGXS types to plot [Default: all of mesh_lib.mgxs_types]
+	directory : str, optional
+		Directory to write the images to [Default: DIRECTORY]
+	nuclides : str, optional
+		Passed on to MGXS.get_xs(); "sum" reads the "total" bin of a
+		pruned library (see mesh_arrays.nuclide_selection()) [Default: "sum"]
+	eps : float, optional
+		Cross sections at or below this value are blanked [Default: EPS]
+
+	Returns
+	-------
+	jobs : list of PlotJob
+
+	"""
+	if mgxs_types is None:
+		mgxs_types = mesh_lib.mgxs_types
+	shape = tuple(d for d in mesh.dimension if d > 1)
+	ncells = int(pylab.prod(shape))
+	jobs = []
+	for xstype in mgxs_types:
+		mg = mesh_lib.get_mgxs(mesh, xstype)
+		num_groups = mg.energy_groups.num_groups
+		xs = pylab.asarray(mg.get_xs(nuclides = mesh_arrays.nuclide_selection(mg, nuclides),
+		                             xs_type = "macro"))
+		xs = xs.reshape(ncells, num_groups, -1).sum(axis = 2)
+		name = xstype.replace(" ", "_")
+		for g in range(num_groups):
+			values = _blank_zeros(xs[:, g], eps)
+			values.shape = shape
+			filename = os.path.join(directory, "{}_g{:02d}.png".format(name, g + 1))
+			title = "{} macro xs, group {} of {}".format(xstype, g + 1, num_groups)
+			jobs.append(PlotJob(filename, values, title, None))
+	return jobs
+
+
+def render_all(jobs, processes = None, chunksize = 4, figsize = FIGSIZE, dpi = DPI, cmap = CMAP):
+	"""Render a batch of PlotJobs with a pool of worker processes
+
+	Parameters
+	----------
+	jobs : iterable of PlotJob
+	processes : int, optional
+		Number of worker processes [Default: os.cpu_count()]
+	chunksize : int, optional
+		Number of jobs sent to a worker at a time [Default: 4]
+	figsize, dpi, cmap : optional
+		Figure size (inches), resolution, and colormap of every image
+
+	Returns
+	-------
+	filenames : list of str
+		Paths of the images written, in the order of `jobs`
+
+	"""
+	jobs = list(jobs)
+	if not jobs:
+		return []
+	if processes is None:
+		processes = os.cpu_count() or 1
+	processes = min(processes, len(jobs))
+	with ProcessPoolExecutor(processes, initializer = _init_worker,
+	                         initargs = (figsize, dpi, cmap)) as pool:
+		return list(pool.map(_render, jobs, chunksize = chunksize))
+
+
+if __name__ == "__main__":
+	all_jobs = comparison_jobs(pylab.loadtxt("moc_data/montecarlo_fission_rates"),
+	                           pylab.loadtxt("moc_data/moc_fission_rates"))
+
+	if os.path.exists(STATEPOINT_LIB):
+		import openmc
+		from build_mesh import mesh, STATEPOINT
+
+		sp = openmc.StatePoint(STATEPOINT)
+		mesh_lib = mesh_arrays.load_mesh_library(sp, mesh, STATEPOINT_LIB)
+		all_jobs += mgxs_jobs(mesh_lib, mesh)
+
+	written = render_all(all_jobs)
+	print("Wrote {} plots to {}".format(len(written), DIRECTORY))
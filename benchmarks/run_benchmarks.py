@@ -0,0 +1,267 @@
+# Run benchmarks
+#
+# Time the hot paths of the project on synthetic TREAT-shaped data (see
+# synthetic.py) and compare them with the stored baselines. Times are
+# stored relative to a fixed NumPy calibration workload, so the baselines
+# carry over between machines reasonably well. A benchmark that is more
+# than REGRESSION_FACTOR slower than its baseline is a regression and
+# makes the script exit with status 1.
+#
+# Usage:
+#   python benchmarks/run_benchmarks.py            compare with the baselines
+#   python benchmarks/run_benchmarks.py --update   store new baselines
+#   python benchmarks/run_benchmarks.py -k arrays  only benchmarks matching "arrays"
+
+import os
+import sys
+import json
+import timeit
+import argparse
+from collections import OrderedDict
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIRECTORY))
+sys.path.insert(0, BENCHMARK_DIRECTORY)
+
+import numpy
+import synthetic
+
+BASELINES = os.path.join(BENCHMARK_DIRECTORY, "baselines.json")
+REGRESSION_FACTOR = 1.5
+REPEAT = 5
+GROUP_CASES = ((4, 11), (4, 25), (2, 70))
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+	"""Register a setup function that returns the callable to time"""
+	def register(setup):
+		BENCHMARKS[name] = setup
+		return setup
+	return register
+
+
+class Skip(Exception):
+	"""Raised by a setup function whose dependencies are missing"""
+
+
+def calibrate(repeat = REPEAT):
+	"""Time a fixed NumPy workload, the unit of the stored baselines"""
+	rng = numpy.random.default_rng(0)
+	a = rng.random((200, 200))
+	v = rng.random((100000, 11))
+
+	def work():
+		a.dot(a)
+		numpy.sort(v, axis = 0)
+		(v*v).sum(axis = 1)
+	return min(timeit.repeat(work, number = 5, repeat = repeat))/5
+
+
+#######################################
+# Benchmarks
+#######################################
+
+@benchmark("area_calculator")
+def _area_calculator():
+	import xml_geometry
+	import area_calculator
+	xml = os.path.join(os.path.dirname(BENCHMARK_DIRECTORY), "treat2d")
+	geom = xml_geometry.read_model(os.path.join(xml, "geometry.xml"),
+	                               os.path.join(xml, "materials.xml"))
+
+	def run():
+		for _ in range(200):
+			area_calculator.fuel_cell_by_material(geom)
+			area_calculator.control_cell_by_material(geom)
+			area_calculator.reflector_cell_by_material(geom)
+	return run
+
+
+@benchmark("nuclide_densities.merge_nuclide_densities")
+def _merge_nuclide_densities():
+	import nuclide_densities
+	cells = synthetic.synthetic_cells(8)
+	vfracs = [1.0/len(cells)]*len(cells)
+
+	def run():
+		for _ in range(100):
+			nuclide_densities.merge_nuclide_densities_by_cell(cells, vfracs)
+	return run
+
+
+# The next two need OpenMC or OpenMOC. They skip without them and have
+# no stored baseline until one is made, with --update -k, where they are
+# installed.
+
+@benchmark("lattice_clone.clone_lattice[19x19]")
+def _clone_lattice():
+	try:
+		import openmc
+		import lattice_clone
+	except ImportError as error:
+		raise Skip(str(error))
+	layout = synthetic.core_layout()
+	fill = openmc.Material(name = "shared")
+	cylinder = openmc.ZCylinder(R = 4.0)
+	universes = {}
+	for u in numpy.unique(layout):
+		universes[u] = openmc.Universe(name = str(u))
+		universes[u].add_cells([openmc.Cell(fill = fill, region = -cylinder),
+		                        openmc.Cell(fill = fill, region = +cylinder)])
+
+	def run():
+		lattice = openmc.RectLattice()
+		lattice.lower_left = [synthetic.LOWER_LEFT]*2
+		lattice.pitch = [synthetic.PITCH]*2
+		lattice.universes = [[universes[u] for u in row] for row in layout]
+		lattice_clone.clone_lattice(lattice)
+	return run
+
+
+def _mesh_arrays_case(k, num_groups):
+	def setup():
+		import mesh_arrays
+		library = synthetic.SyntheticLibrary(k, num_groups)
+
+		def run():
+			mesh_arrays.get_mesh_arrays(library, library.mesh)
+		return run
+	return setup
+
+
+for _k, _G in GROUP_CASES:
+	benchmark("mesh_arrays.get_mesh_arrays[{}x{}, {}g]".format(19*_k, 19*_k, _G))(
+		_mesh_arrays_case(_k, _G))
+
+
+@benchmark("moc_builder.build_materials[76x76, 11g]")
+def _build_materials():
+	try:
+		import moc_builder
+	except ImportError as error:
+		raise Skip(str(error))
+	from scatter_storage import BandedScatter
+	arrays, _ = synthetic.synthetic_mesh_xs(4, 11)
+	arrays["nu-scatter"] = BandedScatter.from_dense(arrays["nu-scatter"])
+
+	def run():
+		moc_builder.build_materials(arrays, 11)
+	return run
+
+
+@benchmark("branch_tables.evaluate[76x76, 11g, 3x3 states]")
+def _branch_table():
+	import itertools
+	import branch_tables
+	arrays, _ = synthetic.synthetic_mesh_xs(4, 11)
+	parameters = OrderedDict([("rod", [0.0, 50.0, 100.0]), ("tfuel", [300.0, 750.0, 1200.0])])
+	branches = {(rod, tfuel): {key: values*(1 + 1E-4*rod - 1E-5*tfuel)
+	                           for key, values in arrays.items()}
+	            for rod, tfuel in itertools.product(*parameters.values())}
+	table = branch_tables.BranchTable.from_branches(parameters, branches, {"tfuel": "sqrt"})
+
+	def run():
+		table.evaluate(rod = 37.0, tfuel = 640.0)
+	return run
+
+
+@benchmark("kinetics.PointKinetics[$3 pulse, 8x2000 steps]")
+def _point_kinetics():
+	import kinetics
+	parameters = kinetics.KineticsParameters()
+	point = kinetics.PointKinetics(parameters, feedback = numpy.linspace(5E-6, 2E-5, 8))
+
+	def run():
+		point.solve(parameters.from_dollars(3.0), 0.4, dt = 2E-4)
+	return run
+
+
+@benchmark("compare_results.RateComparison[76x76]")
+def _compare_rates():
+	import compare_results
+	mc, moc, mc_std = synthetic.synthetic_rates(4)
+
+	def run():
+		for _ in range(50):
+			compare_results.RateComparison(mc, moc, mc_std, assemblies = (19, 19))
+	return run
+
+
+#######################################
+# Runner
+#######################################
+
+def run_benchmarks(pattern = None, repeat = REPEAT):
+	"""Time each benchmark; return {name: seconds or None if skipped}"""
+	times = OrderedDict()
+	for name, setup in BENCHMARKS.items():
+		if pattern and pattern not in name:
+			continue
+		try:
+			func = setup()
+		except Skip as reason:
+			print("{:<48} skipped ({})".format(name, reason))
+			times[name] = None
+			continue
+		func()  # warm up caches and imports
+		times[name] = min(timeit.repeat(func, number = 1, repeat = repeat))
+	return times
+
+
+def load_baselines(filename = BASELINES):
+	if not os.path.exists(filename):
+		return {}
+	with open(filename) as f:
+		return json.load(f)
+
+
+def save_baselines(normalized, filename = BASELINES):
+	baselines = load_baselines(filename)
+	baselines.update((name, value) for name, value in normalized.items() if value is not None)
+	with open(filename, "w") as f:
+		json.dump(OrderedDict(sorted(baselines.items())), f, indent = 1)
+
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = "Benchmark the hot paths on synthetic data")
+	parser.add_argument("--update", action = "store_true", help = "store the results as baselines")
+	parser.add_argument("-k", dest = "pattern", help = "only run benchmarks containing this")
+	parser.add_argument("--repeat", type = int, default = REPEAT)
+	args = parser.parse_args(argv)
+
+	unit = calibrate(args.repeat)
+	times = run_benchmarks(args.pattern, args.repeat)
+	normalized = OrderedDict((name, None if t is None else t/unit) for name, t in times.items())
+	baselines = load_baselines()
+
+	regressions = []
+	print("{:<48} {:>10} {:>10} {:>10}".format("Benchmark", "Time (ms)", "Relative", "Baseline"))
+	for name, value in normalized.items():
+		if value is None:
+			continue
+		base = baselines.get(name)
+		flag = ""
+		if base is not None and not args.update and value > REGRESSION_FACTOR*base:
+			flag = "  REGRESSION"
+			regressions.append(name)
+		print("{:<48} {:>10.2f} {:>10.1f} {:>10}{}".format(
+			name, 1E3*times[name], value, "-" if base is None else "{:.1f}".format(base), flag))
+
+	unchecked = [name for name, value in normalized.items() if value is None or name not in baselines]
+	if unchecked and not args.update:
+		print("Not checked (skipped or no baseline):", ", ".join(unchecked))
+
+	if args.update:
+		save_baselines(normalized)
+		print("Baselines written to", BASELINES)
+	elif regressions:
+		print("{} regression(s): more than {}x slower than the baseline".format(
+			len(regressions), REGRESSION_FACTOR))
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
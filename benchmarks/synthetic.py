@@ -0,0 +1,221 @@
+# Synthetic TREAT data
+#
+# Generate TREAT-shaped inputs for the benchmarks without any summary.h5
+# or statepoint: the 19x19 core map (fuel, control, Zr and Al dummies),
+# mesh cross sections on a 19*k mesh with a realistic group structure,
+# by-nuclide MGXS with the sparsity of the real materials (most nuclides
+# only exist in one kind of assembly), cell nuclide densities, and pairs
+# of MC/MOC fission rate maps.
+
+import numpy
+from collections import OrderedDict
+
+FUEL = 9
+CONTROL = 5
+ZR_DUMMY = 3
+AL_DUMMY = 4
+PITCH = 10.16
+LOWER_LEFT = -96.52
+
+# Nuclides in each kind of assembly; traces are added by the generator
+NUCLIDES = OrderedDict([
+	(FUEL,     ["U234", "U235", "U236", "U238", "C0", "B10", "B11", "Zr90", "Zr91", "Zr92",
+	            "Zr94", "Fe54", "Fe56", "Fe57", "Cr52", "Ni58", "O16", "N14"]),
+	(CONTROL,  ["B10", "B11", "C0", "Fe54", "Fe56", "Fe57", "Cr52", "Ni58", "Mn55"]),
+	(ZR_DUMMY, ["Zr90", "Zr91", "Zr92", "Zr94", "Zr96", "Sn118", "Sn120", "Fe56", "C0"]),
+	(AL_DUMMY, ["Al27", "Mg24", "Si28", "Fe56", "Cu63", "Zn64", "Ti48", "Mn55", "C0"])])
+NUM_TRACES = 12
+
+
+def core_layout():
+	"""A 19x19 TREAT-like universe map, (x, y) indexed"""
+	layout = numpy.full((19, 19), AL_DUMMY, dtype = int)
+	layout[2:17, 2:17] = ZR_DUMMY
+	layout[3:16, 3:16] = FUEL
+	for i, j in ((5, 7), (5, 11), (13, 7), (13, 11), (7, 5), (11, 5), (7, 13), (11, 13)):
+		layout[i, j] = CONTROL
+	return layout
+
+
+def mesh_layout(k):
+	"""The core layout refined to a 19*k mesh"""
+	return numpy.kron(core_layout(), numpy.ones((k, k), dtype = int))
+
+
+class SyntheticMesh(object):
+	"""Stand-in for Treat_Mesh: just the attributes the post-processing reads"""
+	def __init__(self, k):
+		n = 19*k
+		self.dimension = [n, n, 1]
+		self.lower_left = numpy.array([LOWER_LEFT, LOWER_LEFT, -2.5])
+		self.upper_right = numpy.array([-LOWER_LEFT, -LOWER_LEFT, 2.5])
+		self.width = (self.upper_right - self.lower_left)/self.dimension
+
+
+def universe_xs(num_groups, universe):
+	"""Macroscopic total, scatter matrix, nu-fission and chi of one assembly type"""
+	energy = numpy.linspace(0.0, 1.0, num_groups)
+	fission, absorption = {FUEL: (1.0, 1.0), CONTROL: (0.0, 3.0),
+	                       ZR_DUMMY: (0.0, 0.5), AL_DUMMY: (0.0, 0.3)}[universe]
+	total = 0.35 + 0.2*energy
+	sigma_a = 0.002*absorption*(1 + 20*energy**3)
+	scatter = numpy.zeros((num_groups, num_groups))
+	for g in range(num_groups):
+		out = total[g] - sigma_a[g]
+		below = num_groups - 1 - g
+		if below:
+			scatter[g, g] = 0.8*out
+			# Down-scatter only reaches a few groups below
+			reach = min(below, max(1, num_groups//4))
+			scatter[g, g + 1:g + 1 + reach] = 0.2*out/reach
+		else:
+			scatter[g, g] = out
+	# Up-scatter only in the thermal groups
+	thermal = max(1, num_groups//5)
+	for g in range(num_groups - thermal, num_groups):
+		scatter[g, g - 1] = 0.05*scatter[g, g]
+		scatter[g, g] *= 0.95
+	nu_fission = fission*0.004*(1 + 15*energy**3)
+	chi = numpy.zeros(num_groups)
+	chi[:max(1, num_groups//4)] = 1.0/max(1, num_groups//4)
+	return total, scatter, nu_fission, chi
+
+
+def synthetic_mesh_xs(k = 4, num_groups = 11, seed = 0):
+	"""Mesh arrays (as from mesh_arrays.get_mesh_arrays) on a 19*k mesh
+
+	Returns
+	-------
+	arrays : dict of numpy.ndarray
+		Dense "nu-scatter"; 1% noise on each cell
+	width : float
+		Mesh cell width, cm
+
+	"""
+	rng = numpy.random.default_rng(seed)
+	layout = mesh_layout(k)
+	n = layout.shape[0]
+	G = num_groups
+	arrays = {"total": numpy.empty((n, n, G)), "nu-scatter": numpy.empty((n, n, G, G)),
+	          "nu-fission": numpy.empty((n, n, G)), "chi": numpy.empty((n, n, G))}
+	for universe in NUCLIDES:
+		mask = layout == universe
+		total, scatter, nu_fission, chi = universe_xs(G, universe)
+		noise = 1 + 0.01*rng.standard_normal((mask.sum(), 1))
+		arrays["total"][mask] = total*noise
+		arrays["nu-scatter"][mask] = scatter*noise[:, :, None]
+		arrays["nu-fission"][mask] = nu_fission
+		arrays["chi"][mask] = chi
+	arrays["fission"] = arrays["nu-fission"]/2.43
+	return arrays, PITCH/k
+
+
+def nuclide_lists(seed = 0):
+	"""Nuclides of each assembly type, with unique trace impurities"""
+	rng = numpy.random.default_rng(seed)
+	traces = ["Tr{}".format(i) for i in range(NUM_TRACES*len(NUCLIDES))]
+	lists = OrderedDict()
+	for u, nuclides in NUCLIDES.items():
+		chosen = rng.choice(len(traces), NUM_TRACES, replace = False)
+		lists[u] = list(nuclides) + [traces[i] for i in sorted(chosen)]
+	return lists
+
+
+class SyntheticMGXS(object):
+	"""One by-nuclide mesh MGXS, answering get_xs() like openmc.mgxs.MGXS"""
+	def __init__(self, values, nuclides, num_groups):
+		# values: (cells, nuclides, G[, G]), zero where a nuclide is absent
+		self.values = values
+		self.nuclides = nuclides
+		self.by_nuclide = True
+		self.energy_groups = type("EnergyGroups", (), {"num_groups": num_groups})()
+
+	def get_nuclides(self):
+		return list(self.nuclides)
+
+	def get_xs(self, nuclides = "all", xs_type = "macro", value = "mean", **kwargs):
+		if nuclides == "sum":
+			return self.values.sum(axis = 1).ravel()
+		if nuclides == "all":
+			return self.values.ravel()
+		index = [self.nuclides.index(nuc) for nuc in nuclides]
+		return self.values[:, index].ravel()
+
+
+class SyntheticLibrary(object):
+	"""Stand-in for a loaded by-nuclide mesh mgxs.Library"""
+	def __init__(self, k = 4, num_groups = 11, seed = 0):
+		self.mesh = SyntheticMesh(k)
+		arrays, _ = synthetic_mesh_xs(k, num_groups, seed)
+		layout = mesh_layout(k).ravel()
+		lists = nuclide_lists(seed)
+		self.nuclides = sorted(set(n for nucs in lists.values() for n in nucs))
+		index = {nuc: i for i, nuc in enumerate(self.nuclides)}
+		# Share of each nuclide in the macroscopic cross sections of its cells
+		rng = numpy.random.default_rng(seed + 1)
+		shares = numpy.zeros((len(layout), len(self.nuclides)))
+		for u, nucs in lists.items():
+			cells = layout == u
+			weights = rng.random(len(nucs))**4
+			shares[numpy.ix_(cells, [index[n] for n in nucs])] = weights/weights.sum()
+		cells = len(layout)
+		G = num_groups
+		self.mgxs_types = ["total", "fission", "nu-fission", "chi", "consistent nu-scatter matrix"]
+		self._mgxs = {}
+		for name, xstype in (("total", "total"), ("fission", "fission"),
+		                     ("nu-fission", "nu-fission")):
+			values = arrays[name].reshape(cells, 1, G)*shares[:, :, None]
+			self._mgxs[xstype] = SyntheticMGXS(values, self.nuclides, G)
+		chi = SyntheticMGXS(arrays["chi"].reshape(cells, 1, G), ["total"], G)
+		chi.by_nuclide = False
+		scatter = SyntheticMGXS(arrays["nu-scatter"].reshape(cells, 1, G, G), ["total"], G)
+		scatter.by_nuclide = False
+		self._mgxs["chi"] = chi
+		self._mgxs["consistent nu-scatter matrix"] = scatter
+		self.domains = [self.mesh]
+
+	def get_mgxs(self, domain, mgxs_type):
+		return self._mgxs[mgxs_type]
+
+
+class SyntheticCell(object):
+	"""Anything with get_nuclide_densities(), for treat_mesh's merging"""
+	def __init__(self, densities):
+		self._densities = densities
+
+	def get_nuclide_densities(self):
+		return self._densities
+
+
+def synthetic_cells(num_cells = 8, seed = 0):
+	"""Cells of a fuel element, as {cell id: SyntheticCell}"""
+	rng = numpy.random.default_rng(seed)
+	lists = list(nuclide_lists(seed).values())
+	cells = OrderedDict()
+	for c in range(num_cells):
+		nuclides = lists[c % len(lists)]
+		densities = OrderedDict((nuc, (nuc, float(p), "ao"))
+		                        for nuc, p in zip(nuclides, rng.random(len(nuclides))))
+		cells[1000 + c] = SyntheticCell(densities)
+	return cells
+
+
+def synthetic_rates(k = 4, seed = 0, bias = 0.02):
+	"""MC and MOC fission rate maps on a 19*k mesh, with MC uncertainties
+
+	Returns
+	-------
+	mc, moc, mc_std : numpy.ndarray
+		(19k, 19k, 1); zero outside the fuel
+
+	"""
+	rng = numpy.random.default_rng(seed)
+	layout = mesh_layout(k)
+	n = layout.shape[0]
+	x = numpy.linspace(-1, 1, n)
+	shape = numpy.outer(numpy.cos(x*numpy.pi/2.4), numpy.cos(x*numpy.pi/2.4))
+	mc = numpy.where(layout == FUEL, shape, 0.0)
+	mc_std = 0.01*mc*(1 + rng.random(mc.shape))
+	mc = mc + mc_std*rng.standard_normal(mc.shape)
+	moc = mc*(1 + bias*rng.standard_normal(mc.shape))
+	return mc[:, :, None], moc[:, :, None], mc_std[:, :, None]
@@ -0,0 +1,234 @@
+# Branch tables
+#
+# Per-mesh-cell cross sections tabulated over a grid of state parameters
+# (control rod position, temperatures, ...), one OpenMC run per grid
+# point, and interpolated multilinearly for any state in between. The
+# result has the same form as mesh_arrays.get_mesh_arrays(), so it goes
+# straight to moc_builder, moc_update or the diffusion solver without
+# another transport run.
+#
+# A table is stored in one .npz file: the parameter names, their grids
+# and axis transforms, and for each array the values at every state,
+# with shape (*grid shape, nx, ny, G[, G]).
+
+import itertools
+import numpy
+from collections import OrderedDict
+import mesh_arrays
+from scatter_storage import BandedScatter
+
+# How each parameter axis may be interpolated; e.g. "sqrt" for the
+# Doppler effect of the fuel temperature
+TRANSFORMS = {"linear": lambda x: numpy.asarray(x, dtype = float),
+              "sqrt"  : numpy.sqrt,
+              "log"   : numpy.log}
+
+
+class BranchTable(object):
+	"""Mesh arrays tabulated on a grid of state parameters
+
+	Parameters
+	----------
+	parameters : OrderedDict
+		{parameter name: increasing grid values}
+	arrays : dict of numpy.ndarray
+		{array name: values}, each of shape (*grid shape, nx, ny, G[, G])
+	transforms : dict, optional
+		{parameter name: key of TRANSFORMS} [Default: "linear" for all]
+
+	"""
+	def __init__(self, parameters, arrays, transforms = None):
+		self.parameters = OrderedDict((name, numpy.asarray(grid, dtype = float))
+		                              for name, grid in parameters.items())
+		self.transforms = OrderedDict((name, "linear") for name in self.parameters)
+		self.transforms.update(transforms or {})
+		for name, grid in self.parameters.items():
+			if grid.ndim != 1 or (numpy.diff(grid) <= 0).any():
+				raise ValueError("The grid of '{}' must be 1-D and increasing".format(name))
+			if self.transforms[name] not in TRANSFORMS:
+				raise ValueError("Unknown transform: {}".format(self.transforms[name]))
+		self.arrays = {}
+		for key, values in arrays.items():
+			values = numpy.asarray(values, dtype = float)
+			if values.shape[:self.num_parameters] != self.grid_shape:
+				raise ValueError("'{}' has shape {}; expected the grid shape {} first".format(
+					key, values.shape, self.grid_shape))
+			self.arrays[key] = values
+		self._axes = [TRANSFORMS[self.transforms[name]](grid)
+		              for name, grid in self.parameters.items()]
+
+	@property
+	def num_parameters(self):
+		return len(self.parameters)
+
+	@property
+	def grid_shape(self):
+		return tuple(len(grid) for grid in self.parameters.values())
+
+	@property
+	def nbytes(self):
+		return sum(values.nbytes for values in self.arrays.values())
+
+	@classmethod
+	def from_branches(cls, parameters, branches, transforms = None):
+		"""Assemble a table from the mesh arrays of every branch
+
+		Parameters
+		----------
+		parameters : OrderedDict
+			{parameter name: grid values}
+		branches : dict
+			{state tuple (one value per parameter, in order): mesh arrays}.
+			Every point of the grid must be present; scattering matrices
+			may be BandedScatter.
+
+		"""
+		parameters = OrderedDict(parameters)
+		states = list(itertools.product(*parameters.values()))
+		lookup = {tuple(float(v) for v in state): arrays for state, arrays in branches.items()}
+		missing = [state for state in states if tuple(float(v) for v in state) not in lookup]
+		if missing:
+			raise ValueError("Missing branches for states {}".format(missing))
+		shape = tuple(len(grid) for grid in parameters.values())
+		first = lookup[tuple(float(v) for v in states[0])]
+		arrays = {}
+		for key in first:
+			stacked = [numpy.asarray(_dense(lookup[tuple(float(v) for v in state)][key]))
+			           for state in states]
+			arrays[key] = numpy.array(stacked).reshape(shape + stacked[0].shape)
+		return cls(parameters, arrays, transforms)
+
+	@classmethod
+	def from_files(cls, parameters, files, transforms = None):
+		"""A table from mesh array files: {state tuple: .npz from mesh_arrays.save_arrays()}"""
+		return cls.from_branches(parameters, {state: mesh_arrays.load_arrays(filename)
+		                                      for state, filename in files.items()}, transforms)
+
+	@classmethod
+	def from_statepoints(cls, parameters, statepoints, mesh, library = "treat_mesh_lib",
+	                     transforms = None, target = None):
+		"""A table from branch statepoints of build_mesh.py's mesh library
+
+		Parameters
+		----------
+		statepoints : dict
+			{state tuple: statepoint filename}
+		mesh : Treat_Mesh
+			The tally mesh
+		library : str, optional
+			Dumped mesh library [Default: "treat_mesh_lib"]
+		target : Rectilinear_Treat_Mesh, optional
+			See mesh_arrays.get_mesh_arrays()
+
+		"""
+		import openmc
+		branches = {}
+		for state, filename in statepoints.items():
+			mesh_lib = mesh_arrays.load_mesh_library(openmc.StatePoint(filename), mesh, library)
+			branches[state] = mesh_arrays.get_mesh_arrays(mesh_lib, mesh, banded = False,
+			                                              target = target)
+		return cls.from_branches(parameters, branches, transforms)
+
+	def save(self, filename):
+		flat = {"parameter_names": numpy.array(list(self.parameters)),
+		        "transforms": numpy.array([self.transforms[name] for name in self.parameters])}
+		for name, grid in self.parameters.items():
+			flat["grid_" + name] = grid
+		for key, values in self.arrays.items():
+			flat["xs_" + key] = values
+		numpy.savez(filename, **flat)
+
+	@classmethod
+	def load(cls, filename):
+		with numpy.load(filename) as data:
+			names = [str(name) for name in data["parameter_names"]]
+			parameters = OrderedDict((name, data["grid_" + name]) for name in names)
+			transforms = dict(zip(names, (str(t) for t in data["transforms"])))
+			arrays = {key[len("xs_"):]: data[key] for key in data.files if key.startswith("xs_")}
+		return cls(parameters, arrays, transforms)
+
+	def weights(self, states, extrapolate = False):
+		"""Lower grid indices and interpolation fractions of some states
+
+		Parameters
+		----------
+		states : array-like
+			(number of states, number of parameters), or one state
+		extrapolate : bool, optional
+			Extrapolate linearly from the last interval instead of
+			raising a ValueError outside the grid [Default: False]
+
+		Returns
+		-------
+		index : numpy.ndarray of int
+			(number of states, number of parameters)
+		fraction : numpy.ndarray
+			(number of states, number of parameters)
+
+		"""
+		states = numpy.atleast_2d(numpy.asarray(states, dtype = float))
+		if states.shape[1] != self.num_parameters:
+			raise ValueError("Expected states of {} parameters ({}), got {}".format(
+				self.num_parameters, ", ".join(self.parameters), states.shape[1]))
+		index = numpy.empty(states.shape, dtype = int)
+		fraction = numpy.empty(states.shape)
+		for p, (name, grid) in enumerate(self.parameters.items()):
+			values = states[:, p]
+			if not extrapolate and ((values < grid[0]) | (values > grid[-1])).any():
+				raise ValueError("'{}' outside of its grid [{}, {}]: {}".format(
+					name, grid[0], grid[-1], values))
+			axis = self._axes[p]
+			if len(grid) == 1:
+				index[:, p] = 0
+				fraction[:, p] = 0.0
+				continue
+			x = TRANSFORMS[self.transforms[name]](values)
+			i = numpy.clip(numpy.searchsorted(axis, x, side = "right") - 1, 0, len(grid) - 2)
+			index[:, p] = i
+			fraction[:, p] = (x - axis[i])/(axis[i + 1] - axis[i])
+		return index, fraction
+
+	def interpolate(self, states, keys = None, extrapolate = False):
+		"""Multilinear interpolation of the arrays at several states
+
+		Returns
+		-------
+		dict of numpy.ndarray
+			{array name: (number of states, nx, ny, G[, G])}
+
+		"""
+		index, fraction = self.weights(states, extrapolate)
+		num_states, d = index.shape
+		if keys is None:
+			keys = list(self.arrays)
+		result = {key: 0.0 for key in keys}
+		# Sum over the 2**d corners of each state's grid cell
+		for corner in itertools.product((0, 1), repeat = d):
+			corner = numpy.array(corner)
+			weight = numpy.prod(numpy.where(corner, fraction, 1 - fraction), axis = 1)
+			points = tuple(numpy.minimum(index + corner, numpy.array(self.grid_shape) - 1).T)
+			for key in keys:
+				values = self.arrays[key][points]
+				result[key] = result[key] + weight.reshape((num_states,) + (1,)*(values.ndim - 1))*values
+		return result
+
+	def evaluate(self, banded = True, extrapolate = False, **state):
+		"""Mesh arrays at one state, given by keyword, e.g. evaluate(rod = 30.0, tfuel = 600.)
+
+		Parameters left out take the first value of their grid. The
+		scattering matrices are returned as a BandedScatter if `banded`.
+
+		"""
+		unknown = set(state) - set(self.parameters)
+		if unknown:
+			raise ValueError("Unknown parameters: {}".format(", ".join(sorted(unknown))))
+		point = [state.get(name, grid[0]) for name, grid in self.parameters.items()]
+		arrays = {key: values[0] for key, values in self.interpolate(
+			[point], extrapolate = extrapolate).items()}
+		if banded and "nu-scatter" in arrays:
+			arrays["nu-scatter"] = BandedScatter.from_dense(arrays["nu-scatter"])
+		return arrays
+
+
+def _dense(values):
+	return values.to_dense() if isinstance(values, BandedScatter) else values
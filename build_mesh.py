@@ -5,8 +5,10 @@
 
 import openmc
 from openmc import mgxs
+import numpy
 import pylab
 import energy_groups
+import profiling
 from treat_mesh import Treat_Mesh
 from copy import deepcopy
 
@@ -14,14 +16,30 @@ from copy import deepcopy
 EXPORT = False
 PLOT = False
 MESH_DIVISIONS = 4
+# How to get the mesh cross sections:
+#   "mesh":     tally the by-nuclide MGXS library on every mesh cell
+#   "material": tally only the material MGXS and a coarse flux mesh,
+#               then homogenize them onto the mesh (mesh_homogenization.py)
+MESH_XS_MODE = "mesh"
+COARSE_DIVISIONS = 1  # coarse flux mesh cells per assembly
+# Mesh cells per assembly in the lattice rows and columns without fuel or
+# control rods, for a rectilinear mesh (treat_mesh.Rectilinear_Treat_Mesh);
+# None for MESH_DIVISIONS everywhere. Must divide MESH_DIVISIONS.
+REFLECTOR_DIVISIONS = None
+# Only tally the significant nuclides explicitly (nuclide_pruning.py)
+PRUNE_NUCLIDES = False
+# Directories of independent replica runs to merge (see replicas.py), or None
+REPLICA_DIRECTORIES = None
 
 num = MESH_DIVISIONS*19
 ROOT = 'treat2d/{0}x{0}/'.format(num)
 STATEPOINT = ROOT + 'statepoint_11groups.h5'
+MESH_XS_FILE = ROOT + 'mesh_xs.npz'
 
 # Extract the geometry from an existing summary
-summ = openmc.Summary("treat2d/summary.h5")
-geom = summ.geometry
+with profiling.span("openmc.Summary"):
+	summ = openmc.Summary("treat2d/summary.h5")
+	geom = summ.geometry
 mesh_lib = mgxs.Library(geom)
 mats = geom.get_all_materials()
 fuel = mats[90000]
@@ -47,7 +65,8 @@ material_lib.mgxs_types = mesh_lib.mgxs_types
 material_lib.domain_type = "material"
 material_lib.domains = mats.values()
 material_lib.by_nuclide = False
-material_lib.build_library()
+with profiling.span("material_lib.build_library"):
+	material_lib.build_library()
 
 # Define a mesh
 # Instantiate a tally Mesh
@@ -67,14 +86,42 @@ mesh.upper_right[-1] = ztop
 mesh.type = 'regular'
 mesh.dimension = deepcopy(core_lat.shape)
 
+# Mesh of the cross section arrays: the tally mesh itself, or a rectilinear
+# mesh that the "mesh" mode arrays are collapsed onto and that the
+# "material" mode homogenizes onto directly
+if REFLECTOR_DIVISIONS:
+	from treat_mesh import Rectilinear_Treat_Mesh
+	assert MESH_DIVISIONS % REFLECTOR_DIVISIONS == 0, \
+		"REFLECTOR_DIVISIONS must divide MESH_DIVISIONS"
+	xs_mesh = Rectilinear_Treat_Mesh.from_universes(geom, MESH_DIVISIONS, REFLECTOR_DIVISIONS,
+	                                                name = "rectilinear mesh")
+	print("Rectilinear mesh: {} of {} mesh cells".format(
+		numpy.prod(xs_mesh.dimension), numpy.prod(mesh.dimension)))
+else:
+	xs_mesh = mesh
+
+# Coarse flux mesh for the spectral shape in "material" mode
+coarse_mesh = openmc.Mesh(2, name = "coarse flux mesh")
+coarse_mesh.type = 'regular'
+coarse_mesh.lower_left = mesh.lower_left
+coarse_mesh.upper_right = mesh.upper_right
+coarse_mesh.dimension = [COARSE_DIVISIONS*n for n in core_lat.shape[:2]] + [1]
+
 mesh_lib.domains = [mesh]
-mesh_lib.build_library()
+with profiling.span("mesh_lib.build_library"):
+	mesh_lib.build_library()
 # Turn off by_nuclide for nu-scatter
 cnsm_mgxs = mesh_lib.get_mgxs(mesh, 'consistent nu-scatter matrix')
 cnsm_mgxs.by_nuclide = False
+if PRUNE_NUCLIDES:
+	import nuclide_pruning
+	pruning = nuclide_pruning.prune(mats.values())
+	nuclide_pruning.apply_to_library(mesh_lib, pruning)
+	print(pruning.summary())
 
-mesh_lib.dump_to_file("treat_mesh_lib")
-material_lib.dump_to_file("treat_material_lib")
+with profiling.span("dump_to_file"):
+	mesh_lib.dump_to_file("treat_mesh_lib")
+	material_lib.dump_to_file("treat_material_lib")
 
 def make_tallies():
 	# Instantiate tally Filter
@@ -94,11 +141,51 @@ def make_tallies():
 	tallies_file = openmc.Tallies()
 	tallies_file.extend([fission_tally, capture_tally])
 	
-	mesh_lib.add_to_tallies_file(tallies_file, merge = True)
+	if MESH_XS_MODE == "material":
+		coarse_tally = openmc.Tally(name = "coarse flux")
+		coarse_tally.filters = [openmc.MeshFilter(coarse_mesh), openmc.EnergyFilter(groups.group_edges)]
+		coarse_tally.scores = ["flux"]
+		tallies_file.append(coarse_tally)
+	else:
+		mesh_lib.add_to_tallies_file(tallies_file, merge = True)
 	material_lib.add_to_tallies_file(tallies_file, merge = True)
 	return tallies_file
 
 
+def homogenize_mesh_xs(sp, filename = MESH_XS_FILE):
+	"""Build the mesh cross sections from the material library ("material" mode)
+	
+	Inputs:
+		sp:         instance of openmc.StatePoint with the material MGXS
+		            and the coarse flux tally
+		filename:   str, optional; where to save the mesh arrays
+		            [Default: MESH_XS_FILE]
+	
+	Outputs:
+		arrays:     dict of the mesh arrays, as in mesh_arrays.py
+	"""
+	import geometry_snapshot
+	import mesh_arrays
+	import mesh_homogenization
+	from point_classifier import PointClassifier
+	
+	with profiling.span("material_lib.load_from_statepoint"):
+		material_lib.load_from_statepoint(sp)
+	classifier = PointClassifier(geometry_snapshot.load_geometry("treat2d/summary.h5"))
+	material_ids, fractions = mesh_homogenization.volume_fractions(classifier, xs_mesh)
+	coarse_flux = mesh_homogenization.load_coarse_flux(sp, coarse_mesh.dimension)
+	if xs_mesh is mesh:
+		arrays = mesh_homogenization.homogenize(material_lib, material_ids, fractions,
+		                                        coarse_flux = coarse_flux)
+	else:
+		arrays = mesh_homogenization.homogenize(
+			material_lib, material_ids, fractions, coarse_flux = coarse_flux,
+			cell_volumes = xs_mesh.cell_volumes,
+			coarse_index = mesh_homogenization.coarse_index(xs_mesh, coarse_mesh))
+	mesh_arrays.save_arrays(filename, arrays)
+	return arrays
+
+
 def plot_mgxs(nuc, xstype, xs_df, g, groups, x0 = -xdist, x1 = xdist, n = mesh.dimension[1]):
 	"""Plotting a single energy group as a function of space
 	
@@ -169,23 +256,33 @@ if __name__ == "__main__":
 		print("Tallies exported to XML.")
 	
 	# Examine the data after the run
-	sp = openmc.StatePoint(STATEPOINT)
-	
-	mesh_lib.load_from_statepoint(sp)
-	mesh_lib.domains = [mesh]
-	# Reassign the loaded data to be on the Treat_Mesh
-	for domain in mesh_lib.domains:
-		for mgxs_type in mesh_lib.mgxs_types:
-			xs = mesh_lib.get_mgxs(domain, mgxs_type)
-			xs.domain = mesh
+	if REPLICA_DIRECTORIES:
+		import replicas
+		sp = replicas.merge_statepoints(replicas.find_statepoints(REPLICA_DIRECTORIES))
+	else:
+		with profiling.span("openmc.StatePoint"):
+			sp = openmc.StatePoint(STATEPOINT)
+	if MESH_XS_MODE == "material":
+		homogenize_mesh_xs(sp)
+		print("Mesh cross sections saved to", MESH_XS_FILE)
+	else:
+		with profiling.span("mesh_lib.load_from_statepoint"):
+			mesh_lib.load_from_statepoint(sp)
+		mesh_lib.domains = [mesh]
+		# Reassign the loaded data to be on the Treat_Mesh
+		for domain in mesh_lib.domains:
+			for mgxs_type in mesh_lib.mgxs_types:
+				xs = mesh_lib.get_mgxs(domain, mgxs_type)
+				xs.domain = mesh
 	
-	#nuc = "C0"
-	#xstype = "capture"
-	nuc = "U235"
-	xstype = "nu-fission"
-	fission_mgxs = mesh_lib.get_mgxs(mesh, xstype)
-	fission_df = fission_mgxs.get_pandas_dataframe(nuclides = [nuc])
+		#nuc = "C0"
+		#xstype = "capture"
+		nuc = "U235"
+		xstype = "nu-fission"
+		fission_mgxs = mesh_lib.get_mgxs(mesh, xstype)
+		with profiling.span("get_pandas_dataframe"):
+			fission_df = fission_mgxs.get_pandas_dataframe(nuclides = [nuc])
 	
-	if PLOT:
-		# Plot stuff
-		plot_mgxs(nuc, xstype, fission_df, 11, groups)
+		if PLOT:
+			# Plot stuff
+			plot_mgxs(nuc, xstype, fission_df, 11, groups)
@@ -10,68 +10,66 @@ import openmoc.plotter as plt
 import openmc.mgxs as mgxs
 import numpy as np
 import energy_groups
-from build_mesh import mesh, STATEPOINT
+import mesh_arrays
+import moc_builder
+import profiling
+import warm_start
+import moc_update
+import mgxs_store
+from build_mesh import mesh, xs_mesh, STATEPOINT, MESH_XS_MODE, MESH_XS_FILE
 
 PLOT = True
 RUN = True
 CMFD = False
+# Start OpenMOC from the MC fission rates instead of a flat flux. Off until
+# its iteration savings have been measured on an OpenMOC run; needs a build
+# with Solver.setRestartStatus()
+WARM_START = False
+# Mesh array files (mesh_arrays.save_arrays) of perturbed cases, e.g. with a
+# control rod moved, re-solved by only updating the materials that changed
+PERTURBED_XS_FILES = []
+# HDF5 store of the loaded mesh library (see mgxs_store.py), read instead
+# of unpickling the library and reloading the statepoint; rewritten
+# whenever the statepoint changes
+MGXS_STORE = "treat_mesh_lib.h5"
 
 # Load the Monte Carlo results
-sp = openmc.StatePoint(STATEPOINT)
-mesh_lib = mgxs.Library.load_from_file(filename = "treat_mesh_lib")
-
-# Set the domain of the MGXS objects and the MeshFilter to use the Treat_Mesh instance!
-# This must be done before loading the statepoint
-for xstype in mesh_lib.mgxs_types:
-	for domain in mesh_lib.domains:
-		mg = mesh_lib.get_mgxs(domain, xstype)
-		mg.domain = mesh
-		for tally in mg.tallies.values():
-			for filt in tally.filters:
-				if isinstance(filt, openmc.MeshFilter):
-					filt.mesh = mesh
-					
-mesh_lib.load_from_statepoint(sp)
-
-'''
-# Optional: condense energy groups
-# 2 group example
-two_groups = energy_groups.casmo['2-group']
-two_groups.group_edges *= 1E6
-mesh_lib = mesh_lib.get_condensed_library(two_groups)
-'''
-
-# Loading from the statepoint overrides the domain
-# Set the MGXS domains to the Treat_Mesh again.
-for xstype in mesh_lib.mgxs_types:
-	for domain in mesh_lib.domains:
-		mg = mesh_lib.get_mgxs(domain, xstype)
-		mg.domain = mesh
-
-mesh_lib.domains = [mesh]
-
-x_width, y_width, z_width = (mesh.upper_right - mesh.lower_left)/mesh.dimension
-
+with profiling.span("openmc.StatePoint"):
+	sp = openmc.StatePoint(STATEPOINT)
 
 #######################################
-# Dataframes
+# Mesh arrays
 #######################################
 
-
-total = mesh_lib.get_mgxs(domain=mesh, mgxs_type="total")
-chi = mesh_lib.get_mgxs(domain=mesh, mgxs_type="chi")
-scatter = mesh_lib.get_mgxs(domain=mesh, mgxs_type="consistent nu-scatter matrix")
-nu_fission = mesh_lib.get_mgxs(domain=mesh, mgxs_type="nu-fission")
-fission = mesh_lib.get_mgxs(domain=mesh, mgxs_type="fission")
-
-# Get the dataframes
-mgxs_dfs = {}
-mgxs_dfs['total'] = total.get_pandas_dataframe(nuclides='sum')
-# Warning: memory error on nu-scatter is possible!
-mgxs_dfs['nu-scatter'] = scatter.get_pandas_dataframe(nuclides='sum')
-mgxs_dfs['chi'] = chi.get_pandas_dataframe(nuclides='sum')
-mgxs_dfs['nu-fission'] = nu_fission.get_pandas_dataframe(nuclides='sum')
-mgxs_dfs['fission'] = fission.get_pandas_dataframe(nuclides='sum')
+# Per-cell cross sections as (nx, ny, G) arrays; the scattering matrices
+# are kept as a BandedScatter, which only stores each group's nonzero band.
+# They are on xs_mesh, which is coarser than the tally mesh in the
+# reflector when build_mesh.REFLECTOR_DIVISIONS is set.
+if MESH_XS_MODE == "material":
+	# Homogenized from the material library by build_mesh.py
+	with profiling.span("load_arrays"):
+		xs_arrays = mesh_arrays.load_arrays(MESH_XS_FILE)
+elif mgxs_store.is_current(MGXS_STORE, STATEPOINT):
+	with profiling.span("MGXSStore"):
+		with mgxs_store.MGXSStore(MGXS_STORE) as store:
+			xs_arrays = store.get_mesh_arrays(mesh, target = xs_mesh)
+else:
+	with profiling.span("load_from_statepoint"):
+		mesh_lib = mesh_arrays.load_mesh_library(sp, mesh, "treat_mesh_lib")
+	with profiling.span("write_library"):
+		mgxs_store.write_library(mesh_lib, MGXS_STORE, source = STATEPOINT)
+	
+	'''
+	# Optional: condense energy groups
+	# 2 group example
+	two_groups = energy_groups.casmo['2-group']
+	two_groups.group_edges *= 1E6
+	mesh_lib = mesh_lib.get_condensed_library(two_groups)
+	'''
+	
+	with profiling.span("get_mesh_arrays"):
+		xs_arrays = mesh_arrays.get_mesh_arrays(mesh_lib, mesh, target = xs_mesh)
+num_groups = xs_arrays["total"].shape[-1]
 
 
 # TODO: New! Get the capture rate mesh tally data
@@ -79,6 +77,7 @@ mgxs_dfs['fission'] = fission.get_pandas_dataframe(nuclides='sum')
 capture_tally = sp.get_tally(name = "mesh tally")
 vals = capture_tally.get_values(scores = ["fission"])
 fission_rates = vals[:, 0, 0]
+fission_std = capture_tally.get_values(scores = ["fission"], value = "std_dev")[:, 0, 0]
 
 #capture_rates = absorption_rates - fission_rates
 #capture_rates[capture_rates == 0] = np.nan
@@ -87,6 +86,8 @@ fission_rates = vals[:, 0, 0]
 
 fission_rates[fission_rates == 0] = np.nan
 fission_rates.shape = mesh.dimension
+fission_std.shape = mesh.dimension
+fission_std /= np.nanmean(fission_rates)
 fission_rates /= np.nanmean(fission_rates)
 
 #######################################
@@ -94,68 +95,10 @@ fission_rates /= np.nanmean(fission_rates)
 #######################################
 
 # Build a checkerboard geometry in OpenMOC
-lattice = openmoc.Lattice(name = 'TREAT lattice')
-lattice.setWidth(x_width, y_width)
-
-nx, ny = mesh.dimension[:2]
-universes = [[None for i in range(nx)] for j in range(ny)]
-
-for i in range(nx):
-	for j in range(ny):
-		
-		c = openmoc.Cell()
-		m = openmoc.Material()
-		m.setNumEnergyGroups(mesh_lib.num_groups)
-		
-		for key in mgxs_dfs:
-			df = mgxs_dfs[key]
-			x_df = df[df[('mesh 1', 'x')] == i + 1]
-			y_at_x = x_df[x_df[("mesh 1", "y")] == j + 1]
-			
-			if key == "total":
-				m.setSigmaT(y_at_x['mean'].values)
-			elif key == "chi":
-				m.setChi(y_at_x['mean'].values)
-			elif key == "nu-fission":
-				m.setNuSigmaF(y_at_x['mean'].values)
-			elif key == "fission":
-				m.setSigmaF(y_at_x['mean'].values)
-			elif key == "nu-scatter":
-				m.setSigmaS(y_at_x['mean'].values)
-				
-		
-		c.setFill(m)
-		u = openmoc.Universe()
-		u.addCell(c)
-		universes[j][i] = u
-
-lattice.setUniverses([universes])
-
-root_universe = openmoc.Universe(name="root universe")
-root_cell = openmoc.Cell(name="root cell")
-root_cell.setFill(lattice)
-
-# Make some boundaries
-min_x = openmoc.XPlane(x=mesh.lower_left[0])
-max_x = openmoc.XPlane(x=mesh.upper_right[0])
-min_y = openmoc.YPlane(y=mesh.lower_left[1])
-max_y = openmoc.YPlane(y=mesh.upper_right[1])
-surfs = [min_x, max_x, min_y, max_y]
-for s in surfs:
-	s.setBoundaryType(openmoc.VACUUM)
-root_cell.addSurface(+1, min_x)
-root_cell.addSurface(-1, max_x)
-root_cell.addSurface(+1, min_y)
-root_cell.addSurface(-1, max_y)
-
-root_universe.addCell(root_cell)
-geom = openmoc.Geometry()
-geom.setRootUniverse(root_universe)
-
-# Spatial discretization
-cells = geom.getAllMaterialCells()
-for c in cells:
-	cells[c].setNumSectors(8)
+with profiling.span("build_materials"):
+	materials = moc_builder.build_materials(xs_arrays, num_groups)
+with profiling.span("build_geometry"):
+	geom = moc_builder.build_mesh_geometry(materials, xs_mesh)
 
 
 if PLOT:
@@ -178,13 +121,28 @@ if RUN:
 	#track_generator = openmoc.TrackGenerator(geom, num_azim = 128, azim_spacing = 0.01)
 	# quick run:
 	track_generator = openmoc.TrackGenerator(geom, num_azim = 16, azim_spacing = 1)
-	track_generator.generateTracks()
+	with profiling.span("generateTracks"):
+		track_generator.generateTracks()
 	print("Tracks generated!")
 	
 	plt.plot_flat_source_regions(geom)
 	# Run OpenMOC
 	solver = openmoc.CPUSolver(track_generator)
-	solver.computeEigenvalue()
+	if WARM_START:
+		with profiling.span("warm_start"):
+			rates = warm_start.rates_on_mesh(fission_rates, mesh, xs_mesh)
+			cell_flux = warm_start.initial_flux(xs_arrays, rates)
+			warm_start.set_initial_flux(solver, geom, xs_mesh, cell_flux)
+	with profiling.span("computeEigenvalue"):
+		warm_start.compute_eigenvalue(solver, "OpenMOC" + (" (warm start)" if WARM_START else ""))
+	
+	if PERTURBED_XS_FILES:
+		updater = moc_update.IncrementalSolver.from_solver(solver, materials, xs_arrays)
+		for filename in PERTURBED_XS_FILES:
+			with profiling.span("perturbed case", file = filename):
+				updater.run_case(mesh_arrays.load_arrays(filename), filename)
+		# Leave the solver on the base case for the comparisons below
+		updater.run_case(xs_arrays, "OpenMOC (base case)")
 	
 	# Compute eigenvalue bias with OpenMC
 	keff_mc = sp.k_combined[0]
@@ -207,12 +165,14 @@ if RUN:
 	moc_mesh.width = moc_mesh.upper_right - moc_mesh.lower_left
 	moc_mesh.width /= moc_mesh.dimension
 	# Tally OpenMOC fission rates on the Mesh
-	moc_fission_rates = np.array(moc_mesh.tally_fission_rates(solver))
+	with profiling.span("tally_fission_rates"):
+		moc_fission_rates = np.array(moc_mesh.tally_fission_rates(solver))
 	moc_fission_rates.shape = mesh.dimension
 	moc_fission_rates = np.fliplr(moc_fission_rates)
 	
 	np.savetxt("moc_data/moc_fission_rates", moc_fission_rates)
 	np.savetxt("moc_data/montecarlo_fission_rates", fission_rates)
+	np.savetxt("moc_data/montecarlo_fission_uncertainties", fission_std)
 	
 	if PLOT:
 		import plot_moc_results
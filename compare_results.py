@@ -0,0 +1,222 @@
+# Compare results
+#
+# Vectorized comparison of OpenMOC reaction rates against the OpenMC
+# reference, including the Monte Carlo uncertainties. Both the loaded
+# rate files and the comparisons themselves are cached, so repeated calls
+# on the same runs (e.g. while exploring many runs interactively) do not
+# reload or recompute anything.
+
+import os
+import hashlib
+import numpy
+from collections import OrderedDict
+
+EPS = 1E-6
+CACHE_SIZE = 32
+MC_RATES = "moc_data/montecarlo_fission_rates"
+MC_UNCERTAINTIES = "moc_data/montecarlo_fission_uncertainties"
+MOC_RATES = "moc_data/moc_fission_rates"
+
+_file_cache = OrderedDict()
+_comparison_cache = OrderedDict()
+
+
+def _remember(cache, key, value):
+	cache[key] = value
+	cache.move_to_end(key)
+	while len(cache) > CACHE_SIZE:
+		cache.popitem(last = False)
+	return value
+
+
+def _digest(array):
+	"""Return a hashable fingerprint of an array's shape and contents"""
+	if array is None:
+		return None
+	array = numpy.ascontiguousarray(array, dtype = float)
+	return array.shape, hashlib.sha1(array.view(numpy.uint8)).hexdigest()
+
+
+def load_rates(filename):
+	"""Load a reaction rate array saved with numpy.savetxt()
+
+	The array is only read again when the file's size or modification
+	time changes. A copy is returned so callers may modify it freely.
+
+	Parameters
+	----------
+	filename : str
+		Path to the text file
+
+	Returns
+	-------
+	rates : numpy.ndarray
+
+	"""
+	stat = os.stat(filename)
+	key = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+	if key in _file_cache:
+		_file_cache.move_to_end(key)
+		return _file_cache[key].copy()
+	return _remember(_file_cache, key, numpy.loadtxt(filename)).copy()
+
+
+def clear_cache():
+	"""Forget all the loaded files and computed comparisons"""
+	_file_cache.clear()
+	_comparison_cache.clear()
+
+
+class RateComparison(object):
+	"""Comparison of a deterministic reaction rate map to a Monte Carlo one
+
+	All maps are normalized to a mean of 1 over the mesh cells whose
+	Monte Carlo rate exceeds `eps`; every other cell is NaN.
+
+	Attributes
+	----------
+	mask : numpy.ndarray of bool
+		Mesh cells included in the comparison
+	mc : numpy.ndarray
+		Normalized Monte Carlo rates
+	mc_std : numpy.ndarray or None
+		Normalized Monte Carlo standard deviations, if they were given
+	moc : numpy.ndarray
+		Normalized deterministic rates
+	rel_error : numpy.ndarray
+		(moc - mc)/mc
+	pct_error : numpy.ndarray
+		100*rel_error
+	zscore : numpy.ndarray or None
+		(moc - mc)/mc_std: the error in units of the MC uncertainty
+	rms_error : float
+		Root mean square of rel_error
+	max_error : float
+		Largest absolute value of rel_error
+	mean_abs_error : float
+		Mean absolute value of rel_error
+	rms_zscore : float or None
+		Root mean square of zscore
+	assembly_mc, assembly_moc, assembly_rel_error, assembly_zscore :
+		The same quantities after integrating the rates over each
+		assembly, or None when no assembly shape was requested.
+
+	"""
+	def __init__(self, mc_rates, moc_rates, mc_std = None, eps = EPS, assemblies = None):
+		mc = numpy.array(mc_rates, dtype = float)
+		moc = numpy.array(moc_rates, dtype = float)
+		assert mc.shape == moc.shape, \
+			"Rate maps have different shapes: {} and {}".format(mc.shape, moc.shape)
+		self.mask = numpy.isfinite(mc) & (mc > eps) & numpy.isfinite(moc)
+
+		mc_norm = mc[self.mask].mean()
+		moc_norm = moc[self.mask].mean()
+		self.mc = numpy.where(self.mask, mc/mc_norm, numpy.nan)
+		self.moc = numpy.where(self.mask, moc/moc_norm, numpy.nan)
+		self.rel_error = (self.moc - self.mc)/self.mc
+		self.pct_error = 100*self.rel_error
+
+		valid = self.rel_error[self.mask]
+		self.rms_error = numpy.sqrt(numpy.mean(valid**2))
+		self.max_error = numpy.abs(valid).max()
+		self.mean_abs_error = numpy.abs(valid).mean()
+
+		if mc_std is None:
+			self.mc_std = None
+			self.zscore = None
+			self.rms_zscore = None
+		else:
+			std = numpy.array(mc_std, dtype = float)
+			assert std.shape == mc.shape, "Uncertainty map does not match the rates."
+			self.mc_std = numpy.where(self.mask, std/mc_norm, numpy.nan)
+			with numpy.errstate(divide = "ignore", invalid = "ignore"):
+				self.zscore = (self.moc - self.mc)/self.mc_std
+			self.zscore[~numpy.isfinite(self.zscore)] = numpy.nan
+			self.rms_zscore = numpy.sqrt(numpy.nanmean(self.zscore**2))
+
+		self.assembly_mc = None
+		self.assembly_moc = None
+		self.assembly_rel_error = None
+		self.assembly_zscore = None
+		if assemblies is not None:
+			self._aggregate(assemblies)
+
+	def _aggregate(self, assemblies):
+		"""Integrate the normalized maps over each assembly"""
+		ax, ay = assemblies
+		nx, ny = self.mc.shape[:2]
+		assert nx % ax == 0 and ny % ay == 0, \
+			"A {}x{} mesh cannot be split into {}x{} assemblies.".format(nx, ny, ax, ay)
+
+		def integrate(array):
+			blocks = numpy.where(self.mask, array, 0.0)
+			blocks = blocks.reshape(ax, nx//ax, ay, ny//ay, -1)
+			return blocks.sum(axis = (1, 3)).squeeze(-1)
+
+		counts = integrate(numpy.ones_like(self.mc))
+		with numpy.errstate(divide = "ignore", invalid = "ignore"):
+			mc = numpy.where(counts > 0, integrate(self.mc), numpy.nan)
+			moc = numpy.where(counts > 0, integrate(self.moc), numpy.nan)
+			self.assembly_mc = mc
+			self.assembly_moc = moc
+			self.assembly_rel_error = (moc - mc)/mc
+			if self.mc_std is not None:
+				std = numpy.sqrt(integrate(numpy.nan_to_num(self.mc_std)**2))
+				self.assembly_zscore = numpy.where(std > 0, (moc - mc)/std, numpy.nan)
+
+
+def compare_rates(mc_rates, moc_rates, mc_std = None, eps = EPS, assemblies = None):
+	"""Compare two rate maps, reusing the result for identical inputs
+
+	Parameters
+	----------
+	mc_rates : numpy.ndarray
+		Monte Carlo reaction rates on the mesh
+	moc_rates : numpy.ndarray
+		Deterministic reaction rates on the same mesh
+	mc_std : numpy.ndarray, optional
+		Standard deviations of `mc_rates`, on the same scale
+	eps : float, optional
+		Monte Carlo rates at or below this are ignored [Default: EPS]
+	assemblies : tuple of int, optional
+		Number of assemblies (x, y) to aggregate the mesh into, e.g. (19, 19).
+		[Default: None; no aggregation]
+
+	Returns
+	-------
+	RateComparison
+		Shared between calls with identical inputs; do not modify it.
+
+	"""
+	key = (_digest(mc_rates), _digest(moc_rates), _digest(mc_std), eps,
+	       None if assemblies is None else tuple(assemblies))
+	if key in _comparison_cache:
+		_comparison_cache.move_to_end(key)
+		return _comparison_cache[key]
+	comparison = RateComparison(mc_rates, moc_rates, mc_std, eps, assemblies)
+	return _remember(_comparison_cache, key, comparison)
+
+
+def compare_files(mc_file = MC_RATES, moc_file = MOC_RATES, std_file = MC_UNCERTAINTIES,
+                  eps = EPS, assemblies = None):
+	"""Compare rate maps saved by build_moc_checkerboard.py
+
+	The uncertainty file is optional: if it does not exist, the
+	comparison is made without z-scores.
+
+	Returns
+	-------
+	RateComparison
+
+	"""
+	mc_std = load_rates(std_file) if std_file and os.path.exists(std_file) else None
+	return compare_rates(load_rates(mc_file), load_rates(moc_file), mc_std, eps, assemblies)
+
+
+if __name__ == "__main__":
+	result = compare_files(assemblies = (19, 19))
+	print("RMS error:      {:.3%}".format(result.rms_error))
+	print("Max error:      {:.3%}".format(result.max_error))
+	print("Mean abs error: {:.3%}".format(result.mean_abs_error))
+	if result.rms_zscore is not None:
+		print("RMS z-score:    {:.3f}".format(result.rms_zscore))
@@ -0,0 +1,380 @@
+# Diffusion
+#
+# Coarse-mesh finite-difference multigroup diffusion eigenvalue solver.
+# It takes the same per-mesh-cell total, nu-fission, chi and scattering
+# arrays as the OpenMOC checkerboard (see mesh_arrays.py) and returns
+# keff and the fission rate map in seconds, with no track generation,
+# as a quick preview before spending time on MOC.
+#
+# The outer iterations use a Wielandt shift that follows the eigenvalue
+# estimate once a few plain power iterations have settled it. Each inner
+# solve is GMRES preconditioned by the within-group five-point blocks.
+
+import warnings
+import numpy
+import scipy.sparse as sparse
+import scipy.sparse.linalg as sla
+from mesh_arrays import mesh_grids
+
+VACUUM = "vacuum"
+REFLECTIVE = "reflective"
+ZERO_FLUX = "zero flux"
+
+MIN_TOTAL = 1E-6  # floor on the total xs (cm^-1) used for diffusion coefficients
+
+
+def _widths(width, n):
+	width = numpy.asarray(width, dtype = float)
+	if width.ndim == 0:
+		return numpy.full(n, float(width))
+	assert len(width) == n, "Expected {} widths, got {}".format(n, len(width))
+	return width
+
+
+def _boundary_coupling(D, h, boundary):
+	"""Coupling coefficient between a cell center and the outer boundary"""
+	if boundary == VACUUM:
+		# Marshak condition: no incoming partial current
+		return D/(h + 2*D)
+	elif boundary == REFLECTIVE:
+		return numpy.zeros_like(D)
+	elif boundary == ZERO_FLUX:
+		return D/h
+	raise ValueError("Unknown boundary condition: " + str(boundary))
+
+
+class DiffusionResult(object):
+	"""Solution of a DiffusionSolver
+
+	Attributes
+	----------
+	keff : float
+	flux : numpy.ndarray
+		(nx, ny, G) scalar flux, normalized to a mean fission rate of 1
+	fission_rates : numpy.ndarray
+		(nx, ny) fission rates (or nu-fission rates, if no fission xs)
+	iterations : int
+		Number of outer iterations
+	converged : bool
+
+	"""
+	def __init__(self, keff, flux, fission_rates, iterations, converged):
+		self.keff = keff
+		self.flux = flux
+		self.fission_rates = fission_rates
+		self.iterations = iterations
+		self.converged = converged
+
+	def __repr__(self):
+		return "DiffusionResult(keff={:.6f}, iterations={})".format(self.keff, self.iterations)
+
+
+class DiffusionSolver(object):
+	"""Multigroup finite-difference diffusion on a rectangular 2-D mesh
+
+	Parameters
+	----------
+	arrays : dict of numpy.ndarray
+		"total", "nu-fission", "chi": (nx, ny, G)
+		"nu-scatter": (nx, ny, G in, G out), dense, or a
+			scatter_storage.BandedScatter
+		Optional "transport" (nx, ny, G) is used for the diffusion
+		coefficients instead of "total"; optional "fission" for the
+		fission rates.
+	dx, dy : float or iterable of float
+		Mesh widths in cm; scalars, or one per column/row
+	boundary : str or dict, optional
+		VACUUM, REFLECTIVE or ZERO_FLUX; either one for every side or a
+		dict with keys "xmin", "xmax", "ymin", "ymax" [Default: VACUUM]
+
+	"""
+	def __init__(self, arrays, dx, dy, boundary = VACUUM):
+		self.arrays = arrays
+		self.total = numpy.asarray(arrays["total"], dtype = float)
+		self.nx, self.ny, self.num_groups = self.total.shape
+		self.dx = _widths(dx, self.nx)
+		self.dy = _widths(dy, self.ny)
+		if isinstance(boundary, str):
+			boundary = dict.fromkeys(("xmin", "xmax", "ymin", "ymax"), boundary)
+		self.boundary = boundary
+		self._M = None
+		self._F = None
+
+	@property
+	def num_cells(self):
+		return self.nx*self.ny
+
+	def _index(self, g):
+		"""Unknown indices of every cell in group g (group-major)"""
+		return g*self.num_cells + numpy.arange(self.num_cells).reshape(self.nx, self.ny)
+
+	def _scatter_entries(self):
+		"""(cell, group in, group out, value) of every nonzero scattering entry"""
+		scatter = self.arrays["nu-scatter"]
+		if hasattr(scatter, "coo_entries"):
+			return scatter.coo_entries()
+		scatter = numpy.asarray(scatter, dtype = float).reshape(self.num_cells, self.num_groups, -1)
+		cell, gin, gout = numpy.nonzero(scatter)
+		return cell, gin, gout, scatter[cell, gin, gout]
+
+	def build(self):
+		"""Assemble the loss (M) and fission (F) operators: M phi = F phi / k"""
+		nx, ny, G, N = self.nx, self.ny, self.num_groups, self.num_cells
+		sigma_tr = numpy.asarray(self.arrays.get("transport", self.total), dtype = float)
+		D = 1.0/(3.0*numpy.maximum(sigma_tr, MIN_TOTAL))
+		hx = self.dx[:, None, None]/2.0
+		hy = self.dy[None, :, None]/2.0
+		area = (self.dx[:, None]*self.dy[None, :])[:, :, None]
+
+		rows = []
+		cols = []
+		vals = []
+		diagonal = self.total*area
+
+		# Interior couplings between neighbours, harmonic-mean diffusion coefficients
+		dx_coupling = 1.0/(hx[:-1]/D[:-1] + hx[1:]/D[1:])*self.dy[None, :, None]
+		dy_coupling = 1.0/(hy[:, :-1]/D[:, :-1] + hy[:, 1:]/D[:, 1:])*self.dx[:, None, None]
+		diagonal[:-1] += dx_coupling
+		diagonal[1:] += dx_coupling
+		diagonal[:, :-1] += dy_coupling
+		diagonal[:, 1:] += dy_coupling
+		for g in range(G):
+			idx = self._index(g)
+			for a, b, d in ((idx[:-1], idx[1:], dx_coupling[..., g]),
+			                (idx[:, :-1], idx[:, 1:], dy_coupling[..., g])):
+				rows += [a.ravel(), b.ravel()]
+				cols += [b.ravel(), a.ravel()]
+				vals += [-d.ravel(), -d.ravel()]
+
+		# Outer boundaries
+		b = self.boundary
+		diagonal[0] += _boundary_coupling(D[0], hx[0], b["xmin"])*self.dy[:, None]
+		diagonal[-1] += _boundary_coupling(D[-1], hx[-1], b["xmax"])*self.dy[:, None]
+		diagonal[:, 0] += _boundary_coupling(D[:, 0], hy[:, 0], b["ymin"])*self.dx[:, None]
+		diagonal[:, -1] += _boundary_coupling(D[:, -1], hy[:, -1], b["ymax"])*self.dx[:, None]
+		all_idx = numpy.arange(N*G)
+		rows.append(all_idx)
+		cols.append(all_idx)
+		vals.append(diagonal.transpose(2, 0, 1).ravel())
+
+		# In-scatter (including within-group) from g_in to g_out
+		cell, gin, gout, svals = self._scatter_entries()
+		cell_area = area.ravel()
+		rows.append(gout*N + cell)
+		cols.append(gin*N + cell)
+		vals.append(-svals*cell_area[cell])
+
+		self._M = sparse.csc_matrix((numpy.concatenate(vals),
+		                             (numpy.concatenate(rows), numpy.concatenate(cols))),
+		                            shape = (N*G, N*G))
+
+		# Fission: chi(g_out) * nu-fission(g_in), cell by cell
+		chi = numpy.asarray(self.arrays["chi"], dtype = float).reshape(N, G)
+		nuf = numpy.asarray(self.arrays["nu-fission"], dtype = float).reshape(N, G)*cell_area[:, None]
+		cell = numpy.repeat(numpy.arange(N), G*G)
+		gout = numpy.tile(numpy.repeat(numpy.arange(G), G), N)
+		gin = numpy.tile(numpy.arange(G), N*G)
+		fvals = chi[cell, gout]*nuf[cell, gin]
+		keep = fvals != 0
+		self._F = sparse.csc_matrix((fvals[keep], (gout[keep]*N + cell[keep], gin[keep]*N + cell[keep])),
+		                            shape = (N*G, N*G))
+		return self._M, self._F
+
+	@property
+	def loss_operator(self):
+		if self._M is None:
+			self.build()
+		return self._M
+
+	@property
+	def fission_operator(self):
+		if self._F is None:
+			self.build()
+		return self._F
+
+	def _to_mesh(self, vector):
+		return vector.reshape(self.num_groups, self.nx, self.ny).transpose(1, 2, 0)
+
+	def _from_mesh(self, array):
+		return numpy.asarray(array, dtype = float).transpose(2, 0, 1).ravel()
+
+	def solve(self, k_guess = 1.0, flux_guess = None, tolerance = 1E-6, max_iterations = 500,
+	          wielandt_shift = 0.05, power_iterations = 3, adjoint = False):
+		"""Solve the k-eigenvalue problem
+
+		Parameters
+		----------
+		k_guess : float, optional
+			Initial eigenvalue estimate [Default: 1.0]
+		flux_guess : numpy.ndarray, optional
+			(nx, ny, G) initial flux [Default: flat]
+		tolerance : float, optional
+			Convergence criterion on both keff and the pointwise fission
+			source [Default: 1E-6]
+		max_iterations : int, optional
+			[Default: 500]
+		wielandt_shift : float or None, optional
+			After `power_iterations` plain iterations, the outer
+			iterations invert M - F/k_s instead of M, where
+			k_s = k*(1 + wielandt_shift) follows the current estimate k.
+			None disables the shift. [Default: 0.05]
+		power_iterations : int, optional
+			Number of unshifted iterations before the shift [Default: 3]
+		adjoint : bool, optional
+			Solve the adjoint problem instead [Default: False]
+
+		Returns
+		-------
+		DiffusionResult
+
+		"""
+		M = self.loss_operator
+		F = self.fission_operator
+		if adjoint:
+			M = M.T.tocsr()
+			F = F.T.tocsr()
+		if flux_guess is None:
+			phi = numpy.ones(M.shape[0])
+		else:
+			phi = self._from_mesh(flux_guess)
+		k = float(k_guess)
+		phi /= numpy.abs(F @ phi).sum()
+		source = F @ phi
+		inner_tolerance = min(1E-8, tolerance*1E-2)
+
+		inner = _GroupBlockSolver(M, self.num_groups, inner_tolerance)
+		shift = 0.0
+		k_shift = None
+		converged = False
+		for iteration in range(1, max_iterations + 1):
+			if wielandt_shift is not None and iteration > power_iterations:
+				# Follow the eigenvalue, refactoring only when it has moved
+				if k_shift is None or abs(k - k_shift) > 0.1*wielandt_shift*k:
+					k_shift = k
+					shift = 1.0/(k*(1 + wielandt_shift))
+					inner = _GroupBlockSolver(M - shift*F, self.num_groups, inner_tolerance)
+			phi_new = inner.solve(source, phi)
+			source_new = F @ phi_new
+			ratio = source_new.sum()
+			if ratio <= 0:
+				# The shift passed the eigenvalue: widen it
+				wielandt_shift *= 2
+				k_shift = None
+				continue
+			# Eigenvalue of the (shifted) inverse operator
+			k_new = 1.0/(shift + 1.0/ratio)
+			source_new /= ratio
+			phi = phi_new/ratio
+
+			active = source_new > 1E-12*source_new.max()
+			change = numpy.max(numpy.abs(source_new[active] - source[active])/source_new[active]) \
+				if active.any() else 0.0
+			dk = abs(k_new - k)
+			k = k_new
+			source = source_new
+			if dk < tolerance and change < tolerance:
+				converged = True
+				break
+
+		flux = self._to_mesh(phi)
+		sigma_f = numpy.asarray(self.arrays.get("fission", self.arrays["nu-fission"]), dtype = float)
+		fission_rates = (sigma_f*flux).sum(axis = 2)
+		mean = fission_rates[fission_rates > 0].mean() if (fission_rates > 0).any() else 1.0
+		return DiffusionResult(k, flux/mean, fission_rates/mean, iteration, converged)
+
+
+class _GroupBlockSolver(object):
+	"""Solve A x = b with GMRES, preconditioned by a block Gauss-Seidel sweep
+
+	One sweep solves the within-group five-point blocks from the fastest
+	group down, carrying the down-scatter along, so it is exact for a
+	down-scatter-only loss operator; GMRES takes care of up-scatter and
+	of the fission coupling in the shifted operator. Factoring the small
+	group blocks is much cheaper than factoring the whole multigroup system,
+	which fills in badly.
+
+	"""
+	def __init__(self, A, num_groups, tolerance):
+		self.A = A.tocsr()
+		self.tolerance = tolerance
+		n = A.shape[0]//num_groups
+		self._slices = [slice(g*n, (g + 1)*n) for g in range(num_groups)]
+		self._lus = []
+		self._lower = []
+		for g, sl in enumerate(self._slices):
+			rows = self.A[sl]
+			self._lus.append(sla.splu(rows[:, sl].tocsc()))
+			self._lower.append(rows[:, :g*n] if g else None)
+		self.preconditioner = sla.LinearOperator(A.shape, matvec = self._sweep, dtype = float)
+
+	def _sweep(self, r):
+		r = numpy.asarray(r, dtype = float).ravel()
+		out = numpy.empty_like(r)
+		for g, sl in enumerate(self._slices):
+			rhs = r[sl]
+			if self._lower[g] is not None:
+				rhs = rhs - self._lower[g] @ out[:sl.start]
+			out[sl] = self._lus[g].solve(rhs)
+		return out
+
+	def solve(self, b, x0 = None):
+		try:
+			x, info = sla.gmres(self.A, b, x0 = x0, M = self.preconditioner,
+			                    rtol = self.tolerance, atol = 0.0, restart = 30)
+		except TypeError:
+			# scipy < 1.12
+			x, info = sla.gmres(self.A, b, x0 = x0, M = self.preconditioner,
+			                    tol = self.tolerance, atol = 0.0, restart = 30)
+		if info < 0:
+			raise ValueError("GMRES failed on an illegal input or breakdown (info = {})".format(info))
+		elif info > 0:
+			warnings.warn("GMRES did not reach a tolerance of {:.1e} in {} iterations; "
+			              "the outer iteration goes on with an inexact flux".format(self.tolerance, info),
+			              RuntimeWarning)
+		return x
+
+
+def solve_mesh(arrays, mesh, **kwargs):
+	"""Preview keff and fission rates for mesh arrays on an openmc.Mesh
+
+	Parameters
+	----------
+	arrays : dict of numpy.ndarray
+		see DiffusionSolver
+	mesh : openmc.Mesh, Treat_Mesh or Rectilinear_Treat_Mesh
+		Mesh the arrays are on
+	kwargs :
+		Passed on to DiffusionSolver.solve(); "boundary" is passed on to
+		the DiffusionSolver
+
+	Returns
+	-------
+	DiffusionResult
+
+	"""
+	x_grid, y_grid = mesh_grids(mesh)
+	boundary = kwargs.pop("boundary", VACUUM)
+	solver = DiffusionSolver(arrays, numpy.diff(x_grid), numpy.diff(y_grid), boundary)
+	return solver.solve(**kwargs)
+
+
+if __name__ == "__main__":
+	from time import time
+	import openmc
+	import mesh_arrays
+	from build_mesh import mesh, xs_mesh, STATEPOINT, MESH_XS_MODE, MESH_XS_FILE
+
+	sp = openmc.StatePoint(STATEPOINT)
+	if MESH_XS_MODE == "material":
+		arrays = mesh_arrays.load_arrays(MESH_XS_FILE)
+	else:
+		mesh_lib = mesh_arrays.load_mesh_library(sp, mesh)
+		arrays = mesh_arrays.get_mesh_arrays(mesh_lib, mesh, target = xs_mesh)
+
+	t0 = time()
+	result = solve_mesh(arrays, xs_mesh)
+	keff_mc = sp.k_combined[0]
+	print('OpenMC keff:    {:1.6f} +/- {:1.6f}'.format(keff_mc, sp.k_combined[1]))
+	print('Diffusion keff: {:1.6f} ({} iterations, {:.2f} s)'.format(
+		result.keff, result.iterations, time() - t0))
+	print('Diffusion bias: {:.0f} [pcm]'.format((result.keff - keff_mc)*1e5))
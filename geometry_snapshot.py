@@ -0,0 +1,421 @@
+# Geometry snapshot
+#
+# A lightweight, array-backed copy of the parts of the TREAT geometry that
+# the analysis scripts actually use: surface coefficients, the cell ->
+# region/fill/universe tables, the rectangular lattices (such as lattice
+# 100), and the nuclide densities of the materials.
+#
+# Building openmc.Summary(...).geometry recreates the full Python object
+# tree of the model, which is slow. load_geometry() does that once and
+# caches the snapshot in an .npz file next to the summary; later loads
+# read the arrays back in milliseconds, until summary.h5 changes.
+#
+# The snapshot mimics the openmc.Geometry accessors (get_all_surfaces(),
+# get_all_cells(), get_all_universes(), get_all_lattices(),
+# get_all_materials()), so it can be handed to area_calculator and
+# Treat_Mesh in place of the real geometry.
+
+import os
+import numpy
+from collections import OrderedDict
+
+SNAPSHOT_VERSION = 1
+CACHE_SUFFIX = ".geom.npz"
+
+# Coefficient names of the OpenMC surface types, in the order of geometry.xml
+COEFFICIENT_NAMES = {"x-plane"   : ("x0",),
+                     "y-plane"   : ("y0",),
+                     "z-plane"   : ("z0",),
+                     "plane"     : ("A", "B", "C", "D"),
+                     "x-cylinder": ("y0", "z0", "R"),
+                     "y-cylinder": ("x0", "z0", "R"),
+                     "z-cylinder": ("x0", "y0", "R"),
+                     "sphere"    : ("x0", "y0", "z0", "R")}
+MAX_COEFFICIENTS = 10
+
+
+class LightSurface(object):
+	"""Read-only view of one surface of a GeometrySnapshot
+
+	Coefficients are available both through the `coefficients`
+	dictionary and as attributes, as on openmc.Surface: e.g. `surf.x0`,
+	`surf.coefficients['D']`, or `surf.r` for a cylinder radius.
+
+	"""
+	def __init__(self, surface_id, surface_type, coefficients, boundary_type = "transmission"):
+		self.id = surface_id
+		self.type = surface_type
+		self.coefficients = coefficients
+		self.boundary_type = boundary_type
+
+	def __getattr__(self, name):
+		coefficients = self.__dict__.get("coefficients", {})
+		if name in coefficients:
+			return coefficients[name]
+		elif name.upper() in coefficients:
+			return coefficients[name.upper()]
+		raise AttributeError("Surface {} has no attribute '{}'".format(self.__dict__.get("id"), name))
+
+	def __repr__(self):
+		return "LightSurface({}, '{}', {})".format(self.id, self.type, dict(self.coefficients))
+
+
+class LightMaterial(object):
+	"""Read-only view of one material of a GeometrySnapshot"""
+	def __init__(self, material_id, name, density, density_units, nuclides):
+		self.id = material_id
+		self.name = name
+		self.density = density
+		self.density_units = density_units
+		# list of (nuclide name, percent, percent type)
+		self.nuclides = nuclides
+
+	def get_nuclides(self):
+		return [nuc[0] for nuc in self.nuclides]
+
+	def get_nuclide_densities(self):
+		"""Return {nuclide name: (nuclide name, percent, percent type)}"""
+		return OrderedDict((nuc[0], nuc) for nuc in self.nuclides)
+
+	def __deepcopy__(self, memo):
+		return self
+
+	def __repr__(self):
+		return "LightMaterial({}, '{}')".format(self.id, self.name)
+
+
+class LightCell(object):
+	"""Read-only view of one cell of a GeometrySnapshot
+
+	The region is kept as its geometry.xml expression. Because the views
+	are immutable, copying a cell returns the cell itself; this keeps
+	Treat_Mesh's deepcopies of whole universes cheap.
+
+	"""
+	def __init__(self, snapshot, cell_id, name, universe, fill_type, fill_id, region):
+		self._snapshot = snapshot
+		self.id = cell_id
+		self.name = name
+		self.universe = universe
+		self.fill_type = fill_type
+		self.fill_id = fill_id
+		self.region = region
+
+	@property
+	def fill(self):
+		if self.fill_type == "material":
+			return self._snapshot.get_all_materials()[self.fill_id]
+		elif self.fill_type == "universe":
+			return self._snapshot.get_all_universes()[self.fill_id]
+		elif self.fill_type == "lattice":
+			return self._snapshot.get_all_lattices()[self.fill_id]
+		return None
+
+	def get_nuclides(self):
+		if self.fill_type == "material":
+			return self.fill.get_nuclides()
+		return []
+
+	def get_nuclide_densities(self):
+		if self.fill_type == "material":
+			return self.fill.get_nuclide_densities()
+		return OrderedDict()
+
+	def __copy__(self):
+		return self
+
+	def __deepcopy__(self, memo):
+		return self
+
+	def __repr__(self):
+		return "LightCell({}, {} {})".format(self.id, self.fill_type, self.fill_id)
+
+
+class LightUniverse(object):
+	"""Read-only view of one universe of a GeometrySnapshot"""
+	def __init__(self, universe_id, cells):
+		self.id = universe_id
+		self.cells = cells
+
+	def __deepcopy__(self, memo):
+		return self
+
+	def __repr__(self):
+		return "LightUniverse({}, {} cells)".format(self.id, len(self.cells))
+
+
+class LightLattice(object):
+	"""Read-only view of one rectangular lattice of a GeometrySnapshot
+
+	`universes` holds universe IDs with the same layout as
+	openmc.RectLattice.universes: (z, y, x) or (y, x), with the top row first.
+
+	"""
+	def __init__(self, lattice_id, pitch, lower_left, universes, outer = None):
+		self.id = lattice_id
+		self.pitch = numpy.asarray(pitch, dtype = float)
+		self.lower_left = numpy.asarray(lower_left, dtype = float)
+		self.universes = numpy.asarray(universes, dtype = int)
+		self.outer = outer
+
+	@property
+	def shape(self):
+		return self.universes.shape[::-1]
+
+	def __deepcopy__(self, memo):
+		return self
+
+	def __repr__(self):
+		return "LightLattice({}, shape={})".format(self.id, self.shape)
+
+
+class GeometrySnapshot(object):
+	"""Array-backed tables describing an OpenMC geometry
+
+	Parameters
+	----------
+	arrays : dict
+		Dictionary of numpy arrays, as written by save(). Use one of
+		from_geometry(), load() or load_geometry() instead of calling
+		this directly.
+
+	Attributes
+	----------
+	surface_ids : numpy.ndarray of int
+	surface_types : numpy.ndarray of str
+	surface_coefficients : numpy.ndarray of float
+		(num_surfaces, MAX_COEFFICIENTS), padded with NaN, ordered as in
+		COEFFICIENT_NAMES for each surface type.
+	cell_ids, cell_universes, cell_fills : numpy.ndarray of int
+		Fill is -1 for void cells
+	cell_fill_types, cell_regions, cell_names : numpy.ndarray of str
+	material_ids : numpy.ndarray of int
+	nuclide_material, nuclide_names, nuclide_percents, nuclide_types :
+		Flat nuclide table; nuclide_material is the index of the row's
+		material in material_ids.
+
+	"""
+	def __init__(self, arrays):
+		self._arrays = arrays
+		for key, value in arrays.items():
+			# Per-lattice arrays are only reached through get_all_lattices()
+			if key == "lattice_ids" or not key.startswith("lattice_"):
+				setattr(self, key, value)
+		self._surfaces = None
+		self._cells = None
+		self._universes = None
+		self._lattices = None
+		self._materials = None
+
+	@classmethod
+	def from_geometry(cls, geometry):
+		"""Build the snapshot from an openmc.Geometry"""
+		arrays = {}
+
+		surfaces = geometry.get_all_surfaces()
+		n = len(surfaces)
+		arrays["surface_ids"] = numpy.array(list(surfaces.keys()), dtype = int)
+		arrays["surface_types"] = numpy.array([s.type for s in surfaces.values()], dtype = str)
+		arrays["surface_boundaries"] = numpy.array(
+			[s.boundary_type for s in surfaces.values()], dtype = str)
+		coefficients = numpy.full((n, MAX_COEFFICIENTS), numpy.nan)
+		coefficient_names = [None]*n
+		for i, surf in enumerate(surfaces.values()):
+			names = COEFFICIENT_NAMES.get(surf.type, tuple(surf.coefficients))
+			coefficient_names[i] = " ".join(names)
+			for j, name in enumerate(names):
+				coefficients[i, j] = surf.coefficients[name]
+		arrays["surface_coefficients"] = coefficients
+		arrays["surface_coefficient_names"] = numpy.array(coefficient_names, dtype = str)
+
+		cells = geometry.get_all_cells()
+		cell_universe = {}
+		for universe in geometry.get_all_universes().values():
+			for cell_id in universe.cells:
+				cell_universe[cell_id] = universe.id
+		root = geometry.root_universe
+		for cell_id in root.cells:
+			cell_universe[cell_id] = root.id
+		arrays["cell_ids"] = numpy.array(list(cells.keys()), dtype = int)
+		arrays["cell_names"] = numpy.array([c.name for c in cells.values()], dtype = str)
+		arrays["cell_universes"] = numpy.array([cell_universe.get(i, -1) for i in cells], dtype = int)
+		arrays["cell_fill_types"] = numpy.array([c.fill_type for c in cells.values()], dtype = str)
+		arrays["cell_fills"] = numpy.array(
+			[-1 if c.fill is None else c.fill.id for c in cells.values()], dtype = int)
+		arrays["cell_regions"] = numpy.array(
+			["" if c.region is None else str(c.region) for c in cells.values()], dtype = str)
+
+		lattice_ids = []
+		for lat in geometry.get_all_lattices().values():
+			if not hasattr(lat, "lower_left") or not hasattr(lat, "pitch"):
+				continue
+			ids = numpy.vectorize(lambda u: u.id, otypes = [int])(lat.universes)
+			key = "lattice_{}_".format(lat.id)
+			arrays[key + "pitch"] = numpy.asarray(lat.pitch, dtype = float)
+			arrays[key + "lower_left"] = numpy.asarray(lat.lower_left, dtype = float)
+			arrays[key + "universes"] = ids
+			arrays[key + "outer"] = numpy.array(-1 if lat.outer is None else lat.outer.id)
+			lattice_ids.append(lat.id)
+		arrays["lattice_ids"] = numpy.array(lattice_ids, dtype = int)
+
+		materials = geometry.get_all_materials()
+		rows = []
+		for i, mat in enumerate(materials.values()):
+			for name, (nuclide, percent, percent_type) in mat.get_nuclide_densities().items():
+				rows.append((i, name, percent, percent_type))
+		arrays.update(_material_arrays(materials.values(), rows))
+		return cls(arrays)
+
+	def save(self, filename):
+		"""Write the snapshot to an uncompressed .npz file"""
+		with open(filename, "wb") as fh:
+			numpy.savez(fh, **self._arrays)
+
+	@classmethod
+	def load(cls, filename):
+		"""Read a snapshot written by save()"""
+		with numpy.load(filename, allow_pickle = False) as data:
+			return cls({key: data[key] for key in data.files})
+
+	def get_all_surfaces(self):
+		"""Return an OrderedDict of {surface_id: LightSurface}"""
+		if self._surfaces is None:
+			self._surfaces = OrderedDict()
+			for i, sid in enumerate(self.surface_ids.tolist()):
+				names = str(self.surface_coefficient_names[i]).split()
+				coefficients = OrderedDict(
+					(name, float(self.surface_coefficients[i, j])) for j, name in enumerate(names))
+				self._surfaces[sid] = LightSurface(
+					sid, str(self.surface_types[i]), coefficients, str(self.surface_boundaries[i]))
+		return self._surfaces
+
+	def get_all_cells(self):
+		"""Return an OrderedDict of {cell_id: LightCell}"""
+		if self._cells is None:
+			self._cells = OrderedDict()
+			for i, cid in enumerate(self.cell_ids.tolist()):
+				self._cells[cid] = LightCell(self, cid, str(self.cell_names[i]),
+				                             int(self.cell_universes[i]), str(self.cell_fill_types[i]),
+				                             int(self.cell_fills[i]), str(self.cell_regions[i]))
+		return self._cells
+
+	def get_all_universes(self):
+		"""Return an OrderedDict of {universe_id: LightUniverse}"""
+		if self._universes is None:
+			members = OrderedDict()
+			for cell in self.get_all_cells().values():
+				members.setdefault(cell.universe, OrderedDict())[cell.id] = cell
+			self._universes = OrderedDict(
+				(uid, LightUniverse(uid, cells)) for uid, cells in members.items())
+		return self._universes
+
+	def get_all_lattices(self):
+		"""Return an OrderedDict of {lattice_id: LightLattice}"""
+		if self._lattices is None:
+			self._lattices = OrderedDict()
+			for lid in self.lattice_ids.tolist():
+				key = "lattice_{}_".format(lid)
+				outer = int(self._arrays[key + "outer"])
+				self._lattices[lid] = LightLattice(lid, self._arrays[key + "pitch"],
+				                                   self._arrays[key + "lower_left"],
+				                                   self._arrays[key + "universes"],
+				                                   None if outer < 0 else outer)
+		return self._lattices
+
+	def get_all_materials(self):
+		"""Return an OrderedDict of {material_id: LightMaterial}"""
+		if self._materials is None:
+			self._materials = OrderedDict()
+			order = numpy.argsort(self.nuclide_material, kind = "stable")
+			bounds = numpy.searchsorted(self.nuclide_material[order],
+			                            numpy.arange(len(self.material_ids) + 1))
+			for i, mid in enumerate(self.material_ids.tolist()):
+				rows = order[bounds[i]:bounds[i + 1]]
+				nuclides = [(str(self.nuclide_names[r]), float(self.nuclide_percents[r]),
+				             str(self.nuclide_types[r])) for r in rows]
+				self._materials[mid] = LightMaterial(mid, str(self.material_names[i]),
+				                                     float(self.material_densities[i]),
+				                                     str(self.material_density_units[i]), nuclides)
+		return self._materials
+
+
+def _material_arrays(materials, rows):
+	"""Build the material and flat nuclide tables
+
+	Parameters
+	----------
+	materials : iterable
+		Objects with `id`, `name`, `density` and `density_units`
+	rows : list of tuple
+		(material index, nuclide name, percent, percent type)
+
+	Returns
+	-------
+	arrays : dict of numpy.ndarray
+
+	"""
+	materials = list(materials)
+	arrays = {}
+	arrays["material_ids"] = numpy.array([m.id for m in materials], dtype = int)
+	arrays["material_names"] = numpy.array([m.name or "" for m in materials], dtype = str)
+	arrays["material_densities"] = numpy.array(
+		[numpy.nan if m.density is None else m.density for m in materials], dtype = float)
+	arrays["material_density_units"] = numpy.array(
+		[m.density_units or "" for m in materials], dtype = str)
+	if rows:
+		index, names, percents, types = zip(*rows)
+	else:
+		index, names, percents, types = (), (), (), ()
+	arrays["nuclide_material"] = numpy.array(index, dtype = int)
+	arrays["nuclide_names"] = numpy.array(names, dtype = str)
+	arrays["nuclide_percents"] = numpy.array(percents, dtype = float)
+	arrays["nuclide_types"] = numpy.array(types, dtype = str)
+	return arrays
+
+
+def _source_key(filename):
+	"""Identify the current version of `filename` by its size and mtime"""
+	stat = os.stat(filename)
+	return numpy.array([SNAPSHOT_VERSION, stat.st_size, stat.st_mtime_ns], dtype = numpy.int64)
+
+
+def load_geometry(summary = "summary.h5", cache = None):
+	"""Load a GeometrySnapshot of an OpenMC summary file, using a cache
+
+	Parameters
+	----------
+	summary : str, optional
+		Path to the summary.h5 file [Default: "summary.h5"]
+	cache : str, optional
+		Path to the cached snapshot [Default: `summary` + CACHE_SUFFIX]
+
+	Returns
+	-------
+	GeometrySnapshot
+
+	"""
+	if cache is None:
+		cache = summary + CACHE_SUFFIX
+	key = _source_key(summary)
+	if os.path.exists(cache):
+		try:
+			snapshot = GeometrySnapshot.load(cache)
+		except (OSError, ValueError, KeyError):
+			snapshot = None
+		if snapshot is not None and numpy.array_equal(snapshot._arrays.get("source_key"), key):
+			return snapshot
+
+	import openmc
+	snapshot = GeometrySnapshot.from_geometry(openmc.Summary(summary).geometry)
+	snapshot._arrays["source_key"] = key
+	snapshot.save(cache)
+	return snapshot
+
+
+if __name__ == "__main__":
+	from time import time
+	t0 = time()
+	geom = load_geometry("treat2d/summary.h5")
+	print("Loaded {} surfaces, {} cells, and {} materials in {:.3f} s".format(
+		len(geom.get_all_surfaces()), len(geom.get_all_cells()),
+		len(geom.get_all_materials()), time() - t0))
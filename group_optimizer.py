@@ -0,0 +1,344 @@
+# Group optimizer
+#
+# Pick the coarsest energy group structure that keeps keff within a bias
+# budget, instead of choosing CASMO or TREAT structures by hand. The mesh
+# arrays of a fine tally structure are condensed in energy with the fine
+# flux of every mesh cell, and candidate structures are scored against
+# the fine-group solution with the diffusion solver (or any other
+# evaluator, e.g. OpenMOC), in a pool of worker processes.
+#
+# Starting from one group, each round adds one group boundary to every
+# structure kept so far (a beam search) and keeps those closest to the
+# budget, until one meets it. Since MOC time grows linearly with the
+# number of groups, the search stops at the first round with a structure
+# that meets the budget, and never pays for the costly many-group solves.
+# It is a heuristic: the structure found is the best within the beam, and
+# a structure with fewer groups that the beam dropped may also meet the
+# budget. A wider beam (or beam_width = None, every structure of each
+# round, for small fine structures) makes that less likely.
+#
+# Structures are given by the fine groups at which each coarse group
+# starts, in group order (fastest group first): (0, 3, 7) condenses 10
+# fine groups into 0-2, 3-6 and 7-9.
+
+import os
+import numpy
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from diffusion import DiffusionSolver, VACUUM
+from scatter_storage import BandedScatter
+
+PCM = 1E5
+BEAM_WIDTH = 3
+
+Candidate = namedtuple("Candidate", ("starts", "bias", "rate_error"))
+
+# Per-process state, set once by _init_worker()
+_shared = None
+
+
+#######################################
+# Energy condensation
+#######################################
+
+def _group_sum(values, starts, axis):
+	return numpy.add.reduceat(values, starts, axis = axis)
+
+
+def condense_arrays(arrays, flux, starts, banded = False):
+	"""Condense mesh arrays to coarse groups, cell by cell
+
+	Reaction cross sections are weighted by the fine flux of the cell,
+	the scattering matrices by the flux of the incoming group (and summed
+	over the outgoing groups), and chi is summed.
+
+	Parameters
+	----------
+	arrays : dict of numpy.ndarray
+		Fine-group mesh arrays, (nx, ny, G) and (nx, ny, G, G); "nu-scatter"
+		may be a BandedScatter
+	flux : numpy.ndarray
+		(nx, ny, G) fine flux of every mesh cell
+	starts : iterable of int
+		First fine group of each coarse group, beginning with 0
+	banded : bool, optional
+		Store the scattering matrices as a BandedScatter [Default: False]
+
+	Returns
+	-------
+	dict of numpy.ndarray
+
+	"""
+	starts = numpy.asarray(starts, dtype = int)
+	flux = numpy.asarray(flux, dtype = float)
+	if starts[0] != 0 or (numpy.diff(starts) <= 0).any() or starts[-1] >= flux.shape[2]:
+		raise ValueError("Invalid coarse group starts: {}".format(list(starts)))
+	norm = _group_sum(flux, starts, 2)
+	norm[norm <= 0] = 1.0
+	condensed = {}
+	for name, values in arrays.items():
+		if isinstance(values, BandedScatter):
+			values = values.to_dense()
+		values = numpy.asarray(values, dtype = float)
+		if name == "chi":
+			condensed[name] = _group_sum(values, starts, 2)
+		elif values.ndim == 4:
+			mixed = _group_sum(_group_sum(values*flux[:, :, :, None], starts, 2), starts, 3)
+			mixed /= norm[:, :, :, None]
+			condensed[name] = BandedScatter.from_dense(mixed) if banded else mixed
+		else:
+			condensed[name] = _group_sum(values*flux, starts, 2)/norm
+	return condensed
+
+
+def structure_edges(fine_edges, starts):
+	"""Energy edges (increasing, as in openmc.mgxs.EnergyGroups) of a coarse structure"""
+	fine_edges = numpy.asarray(fine_edges, dtype = float)
+	num_fine = len(fine_edges) - 1
+	inner = [fine_edges[num_fine - s] for s in starts[1:]]
+	return numpy.array(sorted([fine_edges[0], fine_edges[-1]] + inner))
+
+
+def structure_starts(fine_edges, coarse_edges, rtol = 1E-6):
+	"""Coarse group starts of a structure whose edges are all fine edges
+
+	Raises a ValueError if the coarse structure does not nest in the fine one.
+
+	"""
+	fine_edges = numpy.asarray(fine_edges, dtype = float)
+	num_fine = len(fine_edges) - 1
+	starts = []
+	for edge in numpy.asarray(coarse_edges, dtype = float)[1:-1]:
+		match = numpy.flatnonzero(numpy.isclose(fine_edges, edge, rtol = rtol, atol = 0.0))
+		if not len(match):
+			raise ValueError("Edge {} is not an edge of the fine structure".format(edge))
+		starts.append(num_fine - match[0])
+	return tuple([0] + sorted(starts))
+
+
+def to_energy_groups(edges):
+	"""An openmc.mgxs.EnergyGroups of some edges"""
+	from openmc.mgxs import EnergyGroups
+	groups = EnergyGroups()
+	groups.group_edges = numpy.asarray(edges, dtype = float)
+	return groups
+
+
+#######################################
+# Evaluation
+#######################################
+
+def diffusion_evaluator(arrays, dx, dy, boundary = VACUUM, flux = False, **kwargs):
+	"""Default evaluator: keff and fission rates from the diffusion solver
+
+	With `flux`, the (nx, ny, G) flux is returned as well.
+
+	"""
+	result = DiffusionSolver(arrays, dx, dy, boundary).solve(**kwargs)
+	if flux:
+		return result.keff, result.fission_rates, result.flux
+	return result.keff, result.fission_rates
+
+
+def _init_worker(arrays, flux, evaluator, keff):
+	global _shared
+	_shared = (arrays, flux, evaluator, keff)
+
+
+def _evaluate(starts):
+	arrays, flux, evaluator, keff = _shared
+	condensed = condense_arrays(arrays, flux, starts)
+	if getattr(evaluator, "func", evaluator) is diffusion_evaluator:
+		# The condensed fine solution is close to the coarse one
+		return evaluator(condensed, k_guess = keff, flux_guess = _group_sum(flux, starts, 2))
+	return evaluator(condensed)
+
+
+def _score(result, reference):
+	"""Bias in pcm and largest relative fission rate error of a result"""
+	keff, rates = result
+	ref_keff, ref_rates = reference
+	bias = (keff - ref_keff)*PCM
+	fueled = ref_rates > 0
+	if not fueled.any():
+		return float(bias), 0.0
+	rates = rates*ref_rates[fueled].sum()/rates[fueled].sum()
+	return float(bias), float(numpy.abs(rates[fueled]/ref_rates[fueled] - 1).max())
+
+
+class GroupOptimizer(object):
+	"""Beam search for few groups within a keff bias budget
+
+	Parameters
+	----------
+	arrays : dict of numpy.ndarray
+		Fine-group mesh arrays
+	evaluator : function
+		evaluator(arrays) -> (keff, (nx, ny) fission rates); must be
+		picklable for processes > 1, e.g. a functools.partial of
+		diffusion_evaluator
+	flux : numpy.ndarray, optional
+		(nx, ny, G) fine flux for the condensation, e.g. the MC flux of
+		mesh_arrays.mesh_flux() [Default: that of the fine diffusion
+		solution, when `evaluator` is diffusion_evaluator]
+	fine_edges : iterable of float, optional
+		Energy edges of the fine structure, to report results in energy
+	processes : int, optional
+		Number of worker processes [Default: os.cpu_count()]
+
+	Attributes
+	----------
+	reference : tuple
+		(keff, fission rates) of the fine structure
+	history : list of list of Candidate
+		Every candidate evaluated, round by round
+
+	"""
+	def __init__(self, arrays, evaluator, flux = None, fine_edges = None, processes = None):
+		self.arrays = arrays
+		self.evaluator = evaluator
+		self.num_fine = numpy.shape(arrays["total"])[-1]
+		self.fine_edges = fine_edges
+		self.processes = processes or os.cpu_count() or 1
+		if flux is None:
+			if getattr(evaluator, "func", evaluator) is not diffusion_evaluator:
+				raise ValueError("Give the fine flux for an evaluator other than diffusion_evaluator")
+			keff, rates, flux = evaluator(arrays, flux = True)
+			self.reference = (keff, rates)
+		else:
+			self.reference = evaluator(arrays)
+		self.flux = numpy.asarray(flux, dtype = float)
+		self.history = []
+		self._pool = None
+
+	def _shared_state(self):
+		return self.arrays, self.flux, self.evaluator, self.reference[0]
+
+	def __enter__(self):
+		if self.processes > 1:
+			self._pool = ProcessPoolExecutor(self.processes, initializer = _init_worker,
+			                                 initargs = self._shared_state())
+		else:
+			_init_worker(*self._shared_state())
+		return self
+
+	def __exit__(self, *args):
+		if self._pool is not None:
+			self._pool.shutdown()
+			self._pool = None
+
+	def evaluate(self, structures):
+		"""Score coarse structures (lists of starts) against the fine one
+
+		Returns
+		-------
+		list of Candidate
+
+		"""
+		structures = [tuple(int(s) for s in starts) for starts in structures]
+		if self._pool is not None:
+			results = list(self._pool.map(_evaluate, structures,
+			                              chunksize = max(1, len(structures)//(4*self.processes))))
+		else:
+			if _shared is None or _shared[0] is not self.arrays:
+				_init_worker(*self._shared_state())
+			results = [_evaluate(starts) for starts in structures]
+		return [Candidate(starts, *_score(result, self.reference))
+		        for starts, result in zip(structures, results)]
+
+	def optimize(self, budget, rate_budget = None, beam_width = BEAM_WIDTH):
+		"""A structure with few groups that meets the budgets
+
+		This is a heuristic beam search: every round adds one boundary to
+		the structures kept, and only the `beam_width` of them closest to
+		the budgets are kept for the next round. The result is the best
+		structure found within the beam, not necessarily the one with the
+		fewest groups that meets the budgets, unless `beam_width` is None.
+
+		Parameters
+		----------
+		budget : float
+			Largest absolute keff bias allowed, pcm
+		rate_budget : float, optional
+			Largest relative fission rate error allowed, e.g. 0.01
+			[Default: None -- not checked]
+		beam_width : int, optional
+			Number of structures kept and refined each round; None keeps
+			them all, an exhaustive search of every structure with up to
+			the number of groups found, which is only affordable for few
+			fine groups [Default: BEAM_WIDTH]
+
+		Returns
+		-------
+		Candidate
+			Of the structures of the first round in which any met the
+			budgets, the passing one with the smallest bias
+
+		"""
+		def violation(candidate):
+			# Largest fraction of a budget used; at most 1 when acceptable
+			if rate_budget is None:
+				return abs(candidate.bias)/budget
+			return max(abs(candidate.bias)/budget, candidate.rate_error/rate_budget)
+
+		self.history = []
+		with self:
+			beam = self.evaluate([(0,)])
+			self.history.append(beam)
+			while True:
+				passing = [c for c in beam if violation(c) <= 1]
+				if passing:
+					return min(passing, key = lambda c: abs(c.bias))
+				if len(beam[0].starts) == self.num_fine:
+					# Only the fine structure itself is left
+					return Candidate(tuple(range(self.num_fine)), 0.0, 0.0)
+				structures = set()
+				for candidate in beam:
+					for added in set(range(1, self.num_fine)) - set(candidate.starts):
+						structures.add(tuple(sorted(candidate.starts + (added,))))
+				scored = self.evaluate(sorted(structures))
+				self.history.append(scored)
+				beam = sorted(scored, key = violation)
+				if beam_width is not None:
+					beam = beam[:beam_width]
+
+	def edges(self, candidate):
+		"""Energy edges of a candidate, if the fine edges were given"""
+		if self.fine_edges is None:
+			raise ValueError("The fine structure edges were not given")
+		return structure_edges(self.fine_edges, candidate.starts)
+
+
+if __name__ == "__main__":
+	import functools
+	import openmc
+	import mesh_arrays
+	import energy_groups
+	from build_mesh import mesh, STATEPOINT
+
+	BUDGET = 100  # pcm
+
+	sp = openmc.StatePoint(STATEPOINT)
+	mesh_lib = mesh_arrays.load_mesh_library(sp, mesh)
+	arrays = mesh_arrays.get_mesh_arrays(mesh_lib, mesh, banded = False)
+	flux = mesh_arrays.mesh_flux(mesh_lib, mesh)
+	fine_edges = mesh_lib.energy_groups.group_edges
+	x_grid, y_grid = mesh_arrays.mesh_grids(mesh)
+	evaluator = functools.partial(diffusion_evaluator, dx = numpy.diff(x_grid), dy = numpy.diff(y_grid))
+
+	optimizer = GroupOptimizer(arrays, evaluator, flux, fine_edges)
+	print("Fine structure: {} groups, keff = {:1.6f}".format(optimizer.num_fine, optimizer.reference[0]))
+	# The hand-picked structures, where they nest in the fine one
+	with optimizer:
+		for family in energy_groups.group_structures.values():
+			for name, groups in sorted(family.items()):
+				try:
+					starts = structure_starts(fine_edges, groups.group_edges*1E6)
+				except ValueError:
+					continue
+				candidate = optimizer.evaluate([starts])[0]
+				print("{:>10}: bias {:6.0f} pcm".format(name, candidate.bias))
+	best = optimizer.optimize(BUDGET)
+	print("Beam search within {} pcm: {} groups, bias {:.0f} pcm".format(
+		BUDGET, len(best.starts), best.bias))
+	print("Edges (eV):", optimizer.edges(best))
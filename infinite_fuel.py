@@ -12,6 +12,8 @@ ADDITIONAL_STATEPOINTS = 3
 STATEPOINT_INTERVAL = 20
 TALLY_MGXS = True
 MESH_DIVISIONS = 40
+# Run OpenMC and post-process each statepoint as it appears (async_pipeline.py)
+RUN_ASYNC = False
 
 # Extract the fuel element geometry from an existing summary
 summ = openmc.Summary("treat2d/summary.h5")
@@ -94,3 +96,18 @@ if EXPORT:
 	for filename, xml in file_dict.items():
 		xml.export_to_xml(DESTINATION + filename)
 	print("\nExported to", DESTINATION)
+
+if RUN_ASYNC:
+	import async_pipeline
+	run = async_pipeline.run_and_process(DESTINATION,
+	                                     library = "treat_mesh_lib" if TALLY_MGXS else None,
+	                                     preview = TALLY_MGXS,
+	                                     on_result = async_pipeline.keff_guard())
+	for sp_file in sorted(run.results, key = lambda f: run.results[f]["batch"]):
+		result = run.results[sp_file]
+		line = "Batch {batch}: keff = {keff:1.6f} +/- {keff_std:1.6f}".format(**result)
+		if "diffusion" in result:
+			line += "; diffusion keff = {:1.6f}".format(result["diffusion"]["keff"])
+		print(line)
+	if run.killed:
+		print("Run killed early: eigenvalue out of range")
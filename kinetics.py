@@ -0,0 +1,470 @@
+# Kinetics
+#
+# Transients of the TREAT core without time-dependent transport. The
+# delayed neutron and inverse velocity mesh MGXS ("delayed-nu-fission",
+# "chi-delayed", "beta", "inverse-velocity" in stuff.ALL_LIBRARIES) are
+# collapsed with the forward and adjoint flux shapes into beta_eff and the
+# neutron generation time; point kinetics is then integrated with an
+# exponential propagator that is exact for constant reactivity over a
+# step, for any number of reactivity scenarios at once. Energy deposition
+# feedback makes the self-limiting pulses TREAT is built for.
+#
+# AdiabaticQuasiStatic recomputes the flux shape with the diffusion solver
+# at coarser shape steps, from cross sections that follow the state (e.g.
+# a BranchTable of rod position and temperature); the reactivity is that
+# of the shape eigenvalue, interpolated linearly between shape steps, and
+# beta_eff and the generation time are collapsed again with each new
+# shape. The shapes are static eigenvalue solutions (the adiabatic
+# method): there is no time derivative in the shape equation, as there
+# would be in the improved quasi-static method.
+
+import numpy
+from collections import OrderedDict
+from diffusion import DiffusionSolver, VACUUM
+from mesh_arrays import mesh_xs, nuclide_selection
+
+# Keepin's six-group thermal fission data for U235
+KEEPIN_BETA = numpy.array([0.000215, 0.001424, 0.001274, 0.002568, 0.000748, 0.000273])
+KEEPIN_DECAY = numpy.array([0.0124, 0.0305, 0.111, 0.301, 1.14, 3.01])  # 1/s
+# Prompt neutron generation time when no inverse velocity is tallied;
+# long in TREAT's graphite-moderated core
+GENERATION_TIME = 9E-4  # s
+
+# Array name -> MGXS type of the kinetics data
+KINETICS_KEYS = OrderedDict([("inverse-velocity", "inverse-velocity"),
+                             ("delayed-nu-fission", "delayed-nu-fission"),
+                             ("chi-delayed", "chi-delayed"),
+                             ("beta", "beta")])
+DELAYED_TYPES = ("delayed-nu-fission", "chi-delayed", "beta")
+
+
+class KineticsParameters(object):
+	"""Point kinetics parameters
+
+	Parameters
+	----------
+	beta : iterable of float
+		Effective delayed neutron fraction of each precursor group
+	decay : iterable of float
+		Decay constant of each precursor group, 1/s
+	generation_time : float
+		Prompt neutron generation time, s
+
+	"""
+	def __init__(self, beta = KEEPIN_BETA, decay = KEEPIN_DECAY, generation_time = GENERATION_TIME):
+		self.beta = numpy.asarray(beta, dtype = float)
+		self.decay = numpy.asarray(decay, dtype = float)
+		self.generation_time = float(generation_time)
+		assert self.beta.shape == self.decay.shape, \
+			"Expected one decay constant per delayed group"
+		assert self.generation_time > 0, "The generation time must be positive"
+
+	@property
+	def num_delayed_groups(self):
+		return len(self.beta)
+
+	@property
+	def beta_total(self):
+		return self.beta.sum()
+
+	def to_dollars(self, rho):
+		return numpy.asarray(rho)/self.beta_total
+
+	def from_dollars(self, dollars):
+		return numpy.asarray(dollars)*self.beta_total
+
+	def __repr__(self):
+		return "KineticsParameters(beta={:.6f}, generation_time={:.3e} s)".format(
+			self.beta_total, self.generation_time)
+
+
+#######################################
+# Kinetics data from the mesh MGXS
+#######################################
+
+def delayed_mesh_xs(mesh_lib, mesh, mgxs_type, num_delayed_groups = len(KEEPIN_BETA)):
+	"""A delayed MGXS of a loaded mesh library as a (nx, ny, D, G) array"""
+	mg = mesh_lib.get_mgxs(mesh, mgxs_type)
+	xs = numpy.asarray(mg.get_xs(nuclides = nuclide_selection(mg), xs_type = "macro"), dtype = float)
+	nx, ny = mesh.dimension[:2]
+	return xs.reshape(nx, ny, num_delayed_groups, -1)
+
+
+def get_kinetics_arrays(mesh_lib, mesh, keys = None):
+	"""The kinetics arrays of a mesh library, as for get_mesh_arrays()
+
+	Returns
+	-------
+	dict of numpy.ndarray
+		"inverse-velocity": (nx, ny, G); the delayed types (nx, ny, D, G).
+		Only the types present in `mesh_lib` are included.
+
+	"""
+	if keys is None:
+		keys = KINETICS_KEYS
+	arrays = {}
+	for name, xstype in keys.items():
+		if xstype not in mesh_lib.mgxs_types:
+			continue
+		if xstype in DELAYED_TYPES:
+			arrays[name] = delayed_mesh_xs(mesh_lib, mesh, xstype)
+		else:
+			arrays[name] = mesh_xs(mesh_lib, mesh, xstype)
+	return arrays
+
+
+def kinetics_parameters(arrays, flux, adjoint = None, volumes = None, decay = KEEPIN_DECAY):
+	"""Collapse the kinetics arrays with the flux shape
+
+	beta_eff[i] = <phi+, chi_d[i] nuSf_d[i] phi> / <phi+, chi nuSf phi>
+	Lambda      = <phi+, phi/v> / <phi+, chi nuSf phi>
+
+	Parameters
+	----------
+	arrays : dict of numpy.ndarray
+		Mesh arrays with "nu-fission" and "chi", and any of the kinetics
+		arrays of get_kinetics_arrays(). The delayed fractions come from
+		"delayed-nu-fission" if present, else from "beta" weighted by
+		the nu-fission rate, else Keepin's fractions; without
+		"inverse-velocity", GENERATION_TIME is used.
+	flux : numpy.ndarray
+		(nx, ny, G) forward flux
+	adjoint : numpy.ndarray, optional
+		(nx, ny, G) adjoint flux [Default: None -- flux weighting]
+	volumes : numpy.ndarray, optional
+		(nx, ny) mesh cell volumes [Default: all equal]
+	decay : iterable of float, optional
+		Precursor decay constants, one per delayed group of the arrays
+		[Default: KEEPIN_DECAY]
+
+	Returns
+	-------
+	KineticsParameters
+
+	"""
+	flux = numpy.asarray(flux, dtype = float)
+	weight = numpy.ones_like(flux) if adjoint is None else numpy.asarray(adjoint, dtype = float)
+	if volumes is not None:
+		weight = weight*numpy.asarray(volumes, dtype = float)[:, :, None]
+	nu_fission = numpy.asarray(arrays["nu-fission"], dtype = float)
+	chi = numpy.asarray(arrays["chi"], dtype = float)
+
+	# Adjoint-weighted production: sum over cells of (phi+ . chi)(nuSf . phi)
+	importance = (weight*chi).sum(axis = 2)
+	production = (importance*(nu_fission*flux).sum(axis = 2)).sum()
+	if production <= 0:
+		raise ValueError("No fission production in the flux shape")
+
+	if "delayed-nu-fission" in arrays:
+		delayed = numpy.asarray(arrays["delayed-nu-fission"], dtype = float)
+		chi_d = numpy.asarray(arrays.get("chi-delayed", chi[:, :, None, :]*numpy.ones_like(delayed)),
+		                      dtype = float)
+		# (nx, ny, D): importance of delayed neutrons times their production
+		delayed_importance = (weight[:, :, None, :]*chi_d).sum(axis = 3)
+		delayed_production = (delayed*flux[:, :, None, :]).sum(axis = 3)
+		beta = (delayed_importance*delayed_production).sum(axis = (0, 1))/production
+	elif "beta" in arrays:
+		beta_xs = numpy.asarray(arrays["beta"], dtype = float)
+		rate = (nu_fission*flux)[:, :, None, :]
+		beta = (importance[:, :, None]*(beta_xs*rate).sum(axis = 3)).sum(axis = (0, 1))/production
+	else:
+		beta = KEEPIN_BETA.copy()
+
+	if "inverse-velocity" in arrays:
+		inverse_velocity = numpy.asarray(arrays["inverse-velocity"], dtype = float)
+		generation_time = (weight*inverse_velocity*flux).sum()/production
+	else:
+		generation_time = GENERATION_TIME
+	decay = numpy.asarray(decay, dtype = float)
+	if decay.shape != beta.shape:
+		raise ValueError("{} decay constants given for {} delayed groups".format(len(decay), len(beta)))
+	return KineticsParameters(beta, decay, generation_time)
+
+
+#######################################
+# Point kinetics
+#######################################
+
+class TransientResult(object):
+	"""Power history of one or more point kinetics scenarios
+
+	Attributes
+	----------
+	time : numpy.ndarray
+		(T,) s
+	power : numpy.ndarray
+		(T, S), in the units of the initial power
+	energy : numpy.ndarray
+		(T, S), integral of the power
+	reactivity : numpy.ndarray
+		(T, S), total reactivity including feedback
+
+	"""
+	def __init__(self, time, power, energy, reactivity):
+		self.time = time
+		self.power = power
+		self.energy = energy
+		self.reactivity = reactivity
+
+	@property
+	def peak_power(self):
+		return self.power.max(axis = 0)
+
+	@property
+	def peak_time(self):
+		return self.time[self.power.argmax(axis = 0)]
+
+	@property
+	def fwhm(self):
+		"""Full width at half maximum of the power pulse of each scenario, s"""
+		widths = []
+		for s in range(self.power.shape[1]):
+			above = numpy.flatnonzero(self.power[:, s] >= self.power[:, s].max()/2.0)
+			widths.append(self.time[above[-1]] - self.time[above[0]])
+		return numpy.array(widths)
+
+	def __repr__(self):
+		return "TransientResult({} steps, {} scenarios)".format(*self.power.shape)
+
+
+class PointKinetics(object):
+	"""Point kinetics with precursor groups and energy feedback
+
+	dP/dt   = (rho - beta)/Lambda P + sum_i lambda_i C_i
+	dC_i/dt = beta_i/Lambda P - lambda_i C_i
+	rho     = rho_external(t) - alpha*E,   dE/dt = P
+
+	Parameters
+	----------
+	parameters : KineticsParameters
+	feedback : float or iterable of float, optional
+		alpha: reactivity per unit of deposited energy (power units times
+		seconds), one per scenario or shared [Default: 0]
+
+	"""
+	def __init__(self, parameters, feedback = 0.0):
+		self.parameters = parameters
+		self.feedback = numpy.asarray(feedback, dtype = float)
+
+	def matrix(self, rho):
+		"""The (S, D+1, D+1) kinetics matrices for reactivities rho (S,)"""
+		p = self.parameters
+		D = p.num_delayed_groups
+		rho = numpy.atleast_1d(numpy.asarray(rho, dtype = float))
+		A = numpy.zeros((len(rho), D + 1, D + 1))
+		A[:, 0, 0] = (rho - p.beta_total)/p.generation_time
+		A[:, 0, 1:] = p.decay
+		A[:, 1:, 0] = p.beta/p.generation_time
+		A[:, numpy.arange(1, D + 1), numpy.arange(1, D + 1)] = -p.decay
+		return A
+
+	def equilibrium(self, power):
+		"""Critical state (S, D+1) with precursors in equilibrium with `power`"""
+		p = self.parameters
+		power = numpy.atleast_1d(numpy.asarray(power, dtype = float))
+		precursors = p.beta/(p.decay*p.generation_time)
+		return numpy.column_stack((power, power[:, None]*precursors[None, :]))
+
+	def propagate(self, y, rho, dt):
+		"""Advance states y (S, D+1) by dt at constant reactivities rho (S,)
+
+		y(t + dt) = exp(A dt) y(t), through the eigenvalues of A (the
+		inhour roots, which are real and distinct), so stiffness costs
+		nothing and large steps stay stable.
+
+		"""
+		w, V = numpy.linalg.eig(self.matrix(rho))
+		coefficients = numpy.linalg.solve(V, y[:, :, None].astype(complex))[:, :, 0]
+		return numpy.real(numpy.einsum("sij,sj->si", V, coefficients*numpy.exp(w*dt)))
+
+	def solve(self, reactivity, t_end, dt = 1E-4, power = 1.0, output_every = 1, state = None,
+	          energy = 0.0, t_start = 0.0):
+		"""Integrate a transient, by default from a critical state
+
+		Parameters
+		----------
+		reactivity : float, iterable of float, or function
+			External reactivity: constant, one per scenario, or
+			reactivity(t) returning either
+		t_end : float
+			End time, s
+		dt : float, optional
+			Time step, s [Default: 1E-4]
+		power : float or iterable of float, optional
+			Initial power of each scenario [Default: 1.0]
+		output_every : int, optional
+			Store every n-th step [Default: 1]
+		state : numpy.ndarray, optional
+			(S, D+1) power and precursors to start from, e.g. the `state`
+			of a previous result [Default: equilibrium at `power`]
+		energy : float or iterable of float, optional
+			Energy deposited before t_start [Default: 0]
+		t_start : float, optional
+			Start time, s [Default: 0]
+
+		Returns
+		-------
+		TransientResult
+			With the final (S, D+1) state in `state`
+
+		"""
+		external = reactivity if callable(reactivity) else (lambda t: reactivity)
+		num_scenarios = max(numpy.size(external(t_start)), numpy.size(power), self.feedback.size,
+		                    numpy.size(energy), 1 if state is None else len(state))
+		shape = (num_scenarios,)
+		if state is None:
+			y = self.equilibrium(numpy.broadcast_to(power, shape))
+		else:
+			y = numpy.array(numpy.broadcast_to(state, (num_scenarios, self.parameters.num_delayed_groups + 1)),
+			                dtype = float)
+		energy = numpy.array(numpy.broadcast_to(energy, shape), dtype = float)
+		alpha = numpy.broadcast_to(self.feedback, shape)
+		has_feedback = bool(numpy.any(alpha))
+
+		def total_rho(t, e):
+			return numpy.broadcast_to(external(t), shape) - alpha*e
+
+		num_steps = int(numpy.ceil((t_end - t_start)/dt - 1E-9))
+		t = t_start
+		times, powers, energies, rhos = [t], [y[:, 0].copy()], [energy.copy()], [total_rho(t, energy)]
+		for step in range(1, num_steps + 1):
+			h = min(dt, t_end - t)
+			# Predictor: reactivity at mid-step from the current power
+			rho = total_rho(t + h/2, energy + h/2*y[:, 0])
+			y_new = self.propagate(y, rho, h)
+			energy_new = energy + h/2*(y[:, 0] + y_new[:, 0])
+			if has_feedback:
+				# Corrector with the trapezoidal mid-step energy
+				rho = total_rho(t + h/2, (energy + energy_new)/2)
+				y_new = self.propagate(y, rho, h)
+				energy_new = energy + h/2*(y[:, 0] + y_new[:, 0])
+			y, energy, t = y_new, energy_new, t + h
+			if step % output_every == 0 or step == num_steps:
+				times.append(t)
+				powers.append(y[:, 0].copy())
+				energies.append(energy.copy())
+				rhos.append(total_rho(t, energy))
+		result = TransientResult(numpy.array(times), numpy.array(powers), numpy.array(energies),
+		                         numpy.array(rhos))
+		result.state = y
+		return result
+
+
+#######################################
+# Quasi-static
+#######################################
+
+class AdiabaticQuasiStatic(object):
+	"""Amplitude by point kinetics, shape, reactivity and parameters by diffusion
+
+	The shape at each shape step is the static (adiabatic) eigenvalue
+	solution of the state; the kinetics parameters are collapsed with it
+	and the initial adjoint, and held over the step.
+
+	Parameters
+	----------
+	arrays_at : function
+		arrays_at(t, energy) -> mesh arrays of the state at time t after
+		depositing `energy`, e.g. from BranchTable.evaluate()
+	dx, dy : float or iterable of float
+		Mesh widths, as for DiffusionSolver
+	boundary : str or dict, optional
+		As for DiffusionSolver [Default: VACUUM]
+	parameters : KineticsParameters, optional
+		Fixed kinetics parameters for the whole transient [Default: None
+		-- from every shape and the initial adjoint, with the kinetics
+		arrays if the states have them]
+
+	"""
+	def __init__(self, arrays_at, dx, dy, boundary = VACUUM, parameters = None):
+		self.arrays_at = arrays_at
+		self.dx = dx
+		self.dy = dy
+		self.boundary = boundary
+		self.fixed_parameters = parameters is not None
+		initial = arrays_at(0.0, 0.0)
+		solver = DiffusionSolver(initial, dx, dy, boundary)
+		self.initial = solver.solve()
+		self.volumes = numpy.outer(solver.dx, solver.dy)
+		self.adjoint = None
+		if parameters is None:
+			self.adjoint = solver.solve(adjoint = True)
+			parameters = self.shape_parameters(initial, self.initial)
+		self.parameters = parameters
+		self.shapes = []
+
+	def _solve_shape(self, arrays, previous = None):
+		solver = DiffusionSolver(arrays, self.dx, self.dy, self.boundary)
+		if previous is None:
+			return solver.solve()
+		return solver.solve(k_guess = previous.keff, flux_guess = previous.flux)
+
+	def shape(self, t, energy, previous = None):
+		"""Diffusion solution of the state, warm-started from the previous shape"""
+		return self._solve_shape(self.arrays_at(t, energy), previous)
+
+	def shape_parameters(self, arrays, result):
+		"""Kinetics parameters of a shape, weighted by the initial adjoint"""
+		if self.fixed_parameters:
+			return self.parameters
+		return kinetics_parameters(arrays, result.flux, self.adjoint.flux, self.volumes)
+
+	def reactivity(self, result):
+		"""Reactivity of a shape relative to the initial (critical) state"""
+		return 1.0/self.initial.keff - 1.0/result.keff
+
+	def solve(self, t_end, shape_dt = 1E-2, dt = 1E-4, power = 1.0):
+		"""Integrate the transient
+
+		Each shape step predicts the energy at its end from the current
+		power, solves the shape there, integrates the amplitude with the
+		reactivity interpolated linearly over the step and the kinetics
+		parameters of the end-of-step shape, and repeats the shape solve
+		once with the energy so found.
+
+		Returns
+		-------
+		TransientResult
+			For one scenario; the shapes are kept in self.shapes as
+			(time, DiffusionResult, KineticsParameters)
+
+		"""
+		state = PointKinetics(self.parameters).equilibrium(power)
+		energy = 0.0
+		rho_start = 0.0
+		previous = self.initial
+		self.shapes = [(0.0, previous, self.parameters)]
+		pieces = []
+		t = 0.0
+		while t < t_end - 1E-12:
+			h = min(shape_dt, t_end - t)
+			energy_end = energy + h*state[0, 0]
+			for corrector in range(2):
+				arrays = self.arrays_at(t + h, energy_end)
+				result = self._solve_shape(arrays, previous)
+				parameters = self.shape_parameters(arrays, result)
+				rho_end = self.reactivity(result)
+				ramp = _ramp(t, h, rho_start, rho_end)
+				history = PointKinetics(parameters).solve(ramp, t + h, min(dt, h), state = state,
+				                                          energy = energy, t_start = t)
+				energy_end = history.energy[-1, 0]
+			state = history.state
+			energy = energy_end
+			previous = result
+			rho_start = rho_end
+			pieces.append(history if not pieces else _tail(history))
+			t += h
+			self.shapes.append((t, result, parameters))
+		return TransientResult(*(numpy.concatenate([getattr(piece, name) for piece in pieces])
+		                         for name in ("time", "power", "energy", "reactivity")))
+
+
+def _ramp(t0, h, rho0, rho1):
+	"""Reactivity interpolated linearly over [t0, t0 + h]"""
+	return lambda t: rho0 + (rho1 - rho0)*min(max(t - t0, 0.0)/h, 1.0)
+
+
+def _tail(history):
+	"""A TransientResult without its first point (the end of the previous one)"""
+	return TransientResult(history.time[1:], history.power[1:], history.energy[1:],
+	                       history.reactivity[1:])
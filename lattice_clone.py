@@ -0,0 +1,95 @@
+# Lattice clone
+#
+# Give every position of a lattice its own cells without deep copies.
+# A clone of a universe gets new cells (with new IDs, so that cell tallies
+# and MGXS domains are unique per position) that share the region, and so
+# the surfaces, and the fill of the originals. Materials are not copied:
+# they are shared objects with the same ID anyway. Cloning a 19x19 lattice
+# of few-cell universes takes milliseconds and the memory of the new Cell
+# objects only.
+
+import openmc
+
+# Cell attributes carried over to the clones, when set
+CELL_ATTRIBUTES = ("temperature", "rotation", "translation", "volume")
+
+
+def clone_cell(cell, name = None):
+	"""A new cell sharing the region and fill of `cell`
+
+	Parameters
+	----------
+	cell : openmc.Cell
+	name : str, optional
+		[Default: the name of `cell`]
+
+	Returns
+	-------
+	openmc.Cell
+		With a new automatic ID
+
+	"""
+	new_cell = openmc.Cell(name = cell.name if name is None else name,
+	                       fill = cell.fill, region = cell.region)
+	for attribute in CELL_ATTRIBUTES:
+		value = getattr(cell, attribute, None)
+		if value is not None:
+			setattr(new_cell, attribute, value)
+	return new_cell
+
+
+def clone_universe(universe, suffix = ""):
+	"""A new universe whose cells are clones of those of `universe`
+
+	Nested universes and lattices in the fills are shared, not cloned.
+
+	Parameters
+	----------
+	universe : openmc.Universe
+	suffix : str, optional
+		Appended to the names of the universe and of its cells
+
+	Returns
+	-------
+	openmc.Universe
+		With a new automatic ID
+
+	"""
+	clone = openmc.Universe(name = universe.name + suffix)
+	clone.add_cells([clone_cell(cell, cell.name + suffix) for cell in universe.cells.values()])
+	return clone
+
+
+def clone_lattice(lattice, keep_first = True, label = False):
+	"""Make the universe at every lattice position unique, in place
+
+	This replaces the duplicate() functions of the checkerboard scripts,
+	which deep-copied each universe and then every cell again, materials
+	included.
+
+	Parameters
+	----------
+	lattice : openmc.RectLattice
+	keep_first : bool, optional
+		Leave the original universe at the first position it fills, so
+		that no cells are left orphaned [Default: True]
+	label : bool, optional
+		Append the lattice indices to the names of the clones [Default: False]
+
+	Returns
+	-------
+	int
+		Number of universes cloned
+
+	"""
+	used = set()
+	num_cloned = 0
+	for index in lattice.indices:
+		universe = lattice.universes[index]
+		if keep_first and id(universe) not in used:
+			used.add(id(universe))
+			continue
+		suffix = " " + str(tuple(index)) if label else ""
+		lattice.universes[index] = clone_universe(universe, suffix)
+		num_cloned += 1
+	return num_cloned
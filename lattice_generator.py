@@ -0,0 +1,389 @@
+# Lattice generator
+#
+# Parametric NxN pin-cell checkerboards, the large-lattice version of
+# simple_checkerboard/build_mc_geom.py, for measuring how the MC -> MOC
+# pipeline of build_moc_checkerboard.py scales with the lattice size.
+# Each model is written to its own directory with the materials,
+# geometry, settings and tallies XML and a matching mesh MGXS library.
+# scaling_study() times every stage of the pipeline over a range of
+# sizes, fits a power law to each stage, and finds the sizes at which
+# one stage overtakes another.
+
+import os
+import json
+import time
+import numpy
+import openmc
+import openmc.mgxs as mgxs
+from collections import OrderedDict
+from contextlib import contextmanager
+import energy_groups
+import profiling
+from lattice_clone import clone_lattice
+
+# Pin types: fuel radius in cm
+PIN_RADII = OrderedDict([("small", 0.2), ("medium", 0.3), ("big", 0.4)])
+DEFAULT_MIX = ("small", "medium", "big")
+PITCH = 1.0
+GROUPS = "2-group"
+MESH_DIVISIONS = 1
+MGXS_TYPES = ["fission", "nu-fission", "total", "chi", "consistent nu-scatter matrix"]
+LIBRARY_NAME = "mesh_lib"
+# OpenMC simulation parameters
+BATCHES = 20
+INACTIVE = 10
+PARTICLES = 10000
+# OpenMOC track parameters, as the quick run of build_moc_checkerboard.py
+NUM_AZIM = 16
+AZIM_SPACING = 1.0
+# Lattice sizes of the scaling study
+SIZES = (4, 8, 19, 38, 76, 152, 304)
+SCALING_DIRECTORY = "scaling/"
+
+
+def pin_map(n, mix = DEFAULT_MIX, pattern = "checkerboard", weights = None, seed = 0):
+	"""The pin type at each lattice position
+
+	Parameters
+	----------
+	n : int
+		Lattice size
+	mix : sequence of str, optional
+		Pin types (keys of PIN_RADII) [Default: DEFAULT_MIX]
+	pattern : str, optional
+		"checkerboard": mix[(i%2 + j%2) % len(mix)], which for three pins
+		is the 4x4 layout of simple_checkerboard repeated;
+		"random": drawn with probabilities `weights` [Default: "checkerboard"]
+	weights : sequence of float, optional
+		For the "random" pattern [Default: equal]
+	seed : int, optional
+		For the "random" pattern [Default: 0]
+
+	Returns
+	-------
+	numpy.ndarray of str
+		(n, n)
+
+	"""
+	for pin in mix:
+		if pin not in PIN_RADII:
+			raise ValueError("Unknown pin type: {}".format(pin))
+	if pattern == "checkerboard":
+		i, j = numpy.indices((n, n))
+		index = (i % 2 + j % 2) % len(mix)
+	elif pattern == "random":
+		if weights is not None:
+			weights = numpy.asarray(weights, dtype = float)
+			weights = weights/weights.sum()
+		index = numpy.random.default_rng(seed).choice(len(mix), (n, n), p = weights)
+	else:
+		raise ValueError("Unknown pattern: {}".format(pattern))
+	return numpy.array(mix)[index]
+
+
+def group_structure(groups = GROUPS):
+	"""openmc.mgxs.EnergyGroups from a CASMO name, a number of groups, or edges in eV"""
+	if isinstance(groups, (int, numpy.integer)):
+		groups = "{}-group".format(groups)
+	structure = mgxs.EnergyGroups()
+	if isinstance(groups, str):
+		# The tabulated edges are in MeV
+		structure.group_edges = energy_groups.casmo[groups].group_edges*1E6
+	else:
+		structure.group_edges = numpy.asarray(groups, dtype = float)
+	return structure
+
+
+class CheckerboardModel(object):
+	"""An NxN lattice of fuel pins in water, with a mesh MGXS library
+
+	Parameters
+	----------
+	n : int
+		Lattice size
+	mix, pattern, weights, seed :
+		Pin layout; see pin_map()
+	pitch : float, optional
+		Pin pitch, cm [Default: PITCH]
+	boundary : str, optional
+		Outer boundary condition [Default: "reflective"]
+	unique_cells : bool, optional
+		Give every lattice position its own cells (lattice_clone), for cell
+		tallies; the mesh library does not need them [Default: False]
+
+	"""
+	def __init__(self, n, mix = DEFAULT_MIX, pattern = "checkerboard", weights = None, seed = 0,
+	             pitch = PITCH, boundary = "reflective", unique_cells = False):
+		self.n = n
+		self.pitch = pitch
+		self.pins = pin_map(n, mix, pattern, weights, seed)
+
+		self.fuel = openmc.Material(name = "fuel")
+		self.fuel.set_density("g/cc", 4.5)
+		self.fuel.add_nuclide("U235", 1.)
+		self.moderator = openmc.Material(name = "moderator")
+		self.moderator.set_density("g/cc", 1.0)
+		self.moderator.add_element("H", 2.)
+		self.moderator.add_element("O", 1.)
+		self.moderator.add_s_alpha_beta("c_H_in_H2O")
+		self.materials = openmc.Materials([self.moderator, self.fuel])
+
+		universes = {}
+		for pin in numpy.unique(self.pins):
+			cylinder = openmc.ZCylinder(x0 = 0, y0 = 0, R = PIN_RADII[pin])
+			universes[pin] = openmc.Universe(name = pin + " pin")
+			universes[pin].add_cells(
+				[openmc.Cell(name = pin + " fuel", fill = self.fuel, region = -cylinder),
+				 openmc.Cell(name = pin + " moderator", fill = self.moderator, region = +cylinder)])
+
+		half = n*pitch/2.0
+		self.lattice = openmc.RectLattice(name = "{0}x{0} lattice".format(n))
+		self.lattice.lower_left = numpy.array([-half, -half])
+		self.lattice.pitch = numpy.array([pitch, pitch])
+		self.lattice.universes = [[universes[pin] for pin in row] for row in self.pins]
+		if unique_cells:
+			clone_lattice(self.lattice)
+
+		planes = [openmc.XPlane(x0 = -half), openmc.XPlane(x0 = half),
+		          openmc.YPlane(y0 = -half), openmc.YPlane(y0 = half),
+		          openmc.ZPlane(z0 = -pitch/2.0), openmc.ZPlane(z0 = pitch/2.0)]
+		for plane in planes:
+			plane.boundary_type = boundary
+		root_cell = openmc.Cell(name = "root cell", fill = self.lattice)
+		root_cell.region = +planes[0] & -planes[1] & +planes[2] & -planes[3] & +planes[4] & -planes[5]
+		root = openmc.Universe(name = "root universe")
+		root.add_cell(root_cell)
+		self.geometry = openmc.Geometry(root)
+
+	@property
+	def lower_left(self):
+		return self.lattice.lower_left
+
+	@property
+	def upper_right(self):
+		return -self.lattice.lower_left
+
+	def make_mesh(self, divisions = MESH_DIVISIONS):
+		"""A regular tally mesh with `divisions` cells per pin in x and y"""
+		mesh = openmc.Mesh()
+		mesh.type = "regular"
+		mesh.dimension = [self.n*divisions, self.n*divisions]
+		mesh.lower_left = self.lower_left
+		mesh.upper_right = self.upper_right
+		return mesh
+
+	def make_library(self, mesh, groups = GROUPS, mgxs_types = MGXS_TYPES):
+		"""A mesh MGXS library on `mesh`, as in simple_checkerboard"""
+		mesh_lib = mgxs.Library(self.geometry)
+		mesh_lib.energy_groups = group_structure(groups)
+		mesh_lib.mgxs_types = list(mgxs_types)
+		mesh_lib.by_nuclide = False
+		mesh_lib.correction = None
+		mesh_lib.domain_type = "mesh"
+		mesh_lib.domains = [mesh]
+		mesh_lib.build_library()
+		return mesh_lib
+
+	def make_settings(self, batches = BATCHES, inactive = INACTIVE, particles = PARTICLES):
+		settings = openmc.Settings()
+		settings.batches = batches
+		settings.inactive = inactive
+		settings.particles = particles
+		bounds = list(self.lower_left) + [-self.pitch/2.0] + \
+		         list(self.upper_right) + [self.pitch/2.0]
+		uniform_dist = openmc.stats.Box(bounds[:3], bounds[3:], only_fissionable = True)
+		settings.source = openmc.source.Source(space = uniform_dist)
+		settings.run_mode = "eigenvalue"
+		return settings
+
+	def export(self, directory, groups = GROUPS, mesh_divisions = MESH_DIVISIONS,
+	           batches = BATCHES, inactive = INACTIVE, particles = PARTICLES):
+		"""Write the XML inputs and the mesh library to `directory`
+
+		The tallies are those of the library plus a fission "mesh tally",
+		as read by build_moc_checkerboard.py.
+
+		Returns
+		-------
+		mesh : openmc.Mesh
+		mesh_lib : openmc.mgxs.Library
+
+		"""
+		os.makedirs(directory, exist_ok = True)
+		mesh = self.make_mesh(mesh_divisions)
+		mesh_lib = self.make_library(mesh, groups)
+		tallies = openmc.Tallies()
+		mesh_lib.add_to_tallies_file(tallies, merge = True)
+		fission_tally = openmc.Tally(name = "mesh tally")
+		fission_tally.filters = [openmc.MeshFilter(mesh)]
+		fission_tally.scores = ["fission"]
+		tallies.append(fission_tally)
+
+		self.materials.export_to_xml(os.path.join(directory, "materials.xml"))
+		self.geometry.export_to_xml(os.path.join(directory, "geometry.xml"))
+		self.make_settings(batches, inactive, particles).export_to_xml(
+			os.path.join(directory, "settings.xml"))
+		tallies.export_to_xml(os.path.join(directory, "tallies.xml"))
+		mesh_lib.dump_to_file(LIBRARY_NAME, directory = directory)
+		with open(os.path.join(directory, "model.json"), "w") as f:
+			json.dump({"n": self.n, "pitch": self.pitch, "groups": str(groups),
+			           "mesh_divisions": mesh_divisions, "batches": batches,
+			           "particles": particles, "pins": self.pins.tolist()}, f)
+		return mesh, mesh_lib
+
+
+#######################################
+# Scaling study
+#######################################
+
+def time_pipeline(n, directory, groups = GROUPS, mesh_divisions = MESH_DIVISIONS,
+                  run_openmc = True, solve = True, threads = None,
+                  num_azim = NUM_AZIM, azim_spacing = AZIM_SPACING, **model_kwargs):
+	"""Wall time of each stage of the MC -> MOC pipeline for one lattice size
+
+	The stages after "openmc" need a statepoint in `directory`: from this
+	run, or from an earlier one when run_openmc is False. Without one, the
+	timing stops after the export.
+
+	Returns
+	-------
+	OrderedDict
+		{stage: seconds}
+
+	"""
+	times = OrderedDict()
+
+	@contextmanager
+	def stage(name):
+		with profiling.span(name, n = n):
+			start = time.perf_counter()
+			yield
+			times[name] = time.perf_counter() - start
+
+	with stage("build_model"):
+		model = CheckerboardModel(n, **model_kwargs)
+	with stage("export"):
+		mesh, _ = model.export(directory, groups, mesh_divisions)
+	if run_openmc:
+		with stage("openmc"):
+			openmc.run(threads = threads, cwd = directory)
+	statepoint = os.path.join(directory, "statepoint.{}.h5".format(BATCHES))
+	if not os.path.exists(statepoint):
+		return times
+
+	import mesh_arrays
+	with stage("load_library"):
+		sp = openmc.StatePoint(statepoint)
+		mesh_lib = mesh_arrays.load_mesh_library(sp, mesh, LIBRARY_NAME, directory)
+	with stage("get_mesh_arrays"):
+		xs_arrays = mesh_arrays.get_mesh_arrays(mesh_lib, mesh)
+	if not solve:
+		return times
+
+	import openmoc
+	import moc_builder
+	num_groups = xs_arrays["total"].shape[-1]
+	with stage("build_materials"):
+		materials = moc_builder.build_materials(xs_arrays, num_groups)
+	with stage("build_geometry"):
+		geom = moc_builder.build_geometry(materials, mesh.lower_left, mesh.upper_right,
+		                                  boundary = openmoc.REFLECTIVE)
+	with stage("generate_tracks"):
+		track_generator = openmoc.TrackGenerator(geom, num_azim = num_azim,
+		                                         azim_spacing = azim_spacing)
+		track_generator.generateTracks()
+	with stage("compute_eigenvalue"):
+		solver = openmoc.CPUSolver(track_generator)
+		solver.computeEigenvalue()
+	return times
+
+
+def fit_power_laws(sizes, timings, min_seconds = 1E-3):
+	"""Fit t = a*N**b to each stage
+
+	Times below `min_seconds` are dominated by overhead and left out.
+
+	Parameters
+	----------
+	sizes : sequence of int
+	timings : sequence of dict
+		{stage: seconds} for each size
+
+	Returns
+	-------
+	OrderedDict
+		{stage: (a, b)}, for the stages with at least two usable points
+
+	"""
+	stages = OrderedDict((name, None) for times in timings for name in times)
+	fits = OrderedDict()
+	for name in stages:
+		points = [(n, times[name]) for n, times in zip(sizes, timings)
+		          if times.get(name, 0) >= min_seconds]
+		if len(set(n for n, _ in points)) < 2:
+			continue
+		log_n, log_t = numpy.log(numpy.array(points, dtype = float)).T
+		b, log_a = numpy.polyfit(log_n, log_t, 1)
+		fits[name] = (numpy.exp(log_a), b)
+	return fits
+
+
+def crossovers(fits, n_min = 1, n_max = 1E5):
+	"""Lattice sizes at which one stage's fitted time overtakes another's
+
+	Returns
+	-------
+	list of (float, str, str)
+		(N, faster-growing stage, slower-growing stage), sorted by N
+
+	"""
+	found = []
+	names = list(fits)
+	for k, first in enumerate(names):
+		for second in names[k + 1:]:
+			(a1, b1), (a2, b2) = fits[first], fits[second]
+			if numpy.isclose(b1, b2):
+				continue
+			n = (a2/a1)**(1.0/(b1 - b2))
+			if n_min <= n <= n_max:
+				found.append((n, first, second) if b1 > b2 else (n, second, first))
+	return sorted(found)
+
+
+def format_scaling(sizes, timings, fits = None):
+	"""A table of the stage times, with the fitted exponents"""
+	if fits is None:
+		fits = fit_power_laws(sizes, timings)
+	stages = list(OrderedDict((name, None) for times in timings for name in times))
+	width = max(len(name) for name in stages + ["Stage"])
+	lines = ["{:<{w}}".format("Stage", w = width) +
+	         "".join("{:>10}".format("N=" + str(n)) for n in sizes) + "{:>8}".format("b")]
+	for name in stages:
+		cells = ["{:>10.3g}".format(times[name]) if name in times else "{:>10}".format("-")
+		         for times in timings]
+		exponent = "{:>8.2f}".format(fits[name][1]) if name in fits else "{:>8}".format("-")
+		lines.append("{:<{w}}".format(name, w = width) + "".join(cells) + exponent)
+	for n, faster, slower in crossovers(fits):
+		lines.append("{} overtakes {} at N ~ {:.0f}".format(faster, slower, n))
+	return "\n".join(lines)
+
+
+def scaling_study(sizes = SIZES, directory = SCALING_DIRECTORY, results = "scaling.json",
+                  **kwargs):
+	"""Time the pipeline at each lattice size and save the results
+
+	Each size gets its own subdirectory "N{n}" of `directory`; kwargs go
+	to time_pipeline(). Returns {n: {stage: seconds}}.
+
+	"""
+	timings = OrderedDict()
+	for n in sizes:
+		timings[n] = time_pipeline(n, os.path.join(directory, "N{}".format(n)), **kwargs)
+		with open(os.path.join(directory, results), "w") as f:
+			json.dump({str(size): times for size, times in timings.items()}, f, indent = 1)
+	return timings
+
+
+if __name__ == "__main__":
+	study = scaling_study()
+	print(format_scaling(list(study), list(study.values())))
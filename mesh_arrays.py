@@ -0,0 +1,270 @@
+# Mesh arrays
+#
+# Pull the cross sections of a mesh-domain MGXS library out into plain
+# NumPy arrays indexed by (x, y, group[, group out]), the format shared
+# by the deterministic solvers and exporters in this project.
+
+import numpy
+from scatter_storage import BandedScatter
+
+# Array name -> MGXS type
+MGXS_KEYS = {"total"     : "total",
+             "fission"   : "fission",
+             "nu-fission": "nu-fission",
+             "chi"       : "chi",
+             "nu-scatter": "consistent nu-scatter matrix"}
+
+
+def load_mesh_library(statepoint, mesh, filename = "treat_mesh_lib", directory = "."):
+	"""Load a dumped mesh MGXS library and its statepoint onto `mesh`
+
+	The MGXS objects and their MeshFilters are pointed at `mesh` before
+	and after loading, since loading from the statepoint replaces the
+	domain (see build_moc_checkerboard.py).
+
+	Parameters
+	----------
+	statepoint : openmc.StatePoint
+	mesh : openmc.Mesh or Treat_Mesh
+	filename : str, optional
+		Name of the library dumped with Library.dump_to_file()
+		[Default: "treat_mesh_lib"]
+	directory : str, optional
+		Directory of the dumped library [Default: "."]
+
+	Returns
+	-------
+	mesh_lib : openmc.mgxs.Library
+
+	"""
+	import openmc
+	import openmc.mgxs as mgxs
+	mesh_lib = mgxs.Library.load_from_file(filename = filename, directory = directory)
+	for xstype in mesh_lib.mgxs_types:
+		for domain in mesh_lib.domains:
+			mg = mesh_lib.get_mgxs(domain, xstype)
+			mg.domain = mesh
+			for tally in mg.tallies.values():
+				for filt in tally.filters:
+					if isinstance(filt, openmc.MeshFilter):
+						filt.mesh = mesh
+	mesh_lib.load_from_statepoint(statepoint)
+	for xstype in mesh_lib.mgxs_types:
+		for domain in mesh_lib.domains:
+			mesh_lib.get_mgxs(domain, xstype).domain = mesh
+	mesh_lib.domains = [mesh]
+	return mesh_lib
+
+
+def reshape_mesh_xs(xs, dimension, num_groups):
+	"""Reshape MGXS.get_xs() output for a 2-D mesh to (nx, ny, G[, G])
+
+	Mesh bins are ordered with x varying slowest, as in the "mesh tally"
+	reshaped to mesh.dimension in build_moc_checkerboard.py.
+
+	"""
+	nx, ny = dimension[:2]
+	xs = numpy.asarray(xs, dtype = float)
+	per_cell = xs.size//(nx*ny)
+	if per_cell == num_groups:
+		return xs.reshape(nx, ny, num_groups)
+	elif per_cell == num_groups**2:
+		return xs.reshape(nx, ny, num_groups, num_groups)
+	raise ValueError("Cannot reshape {} values onto a {}x{} mesh with {} groups".format(
+		xs.size, nx, ny, num_groups))
+
+
+def mesh_grids(mesh):
+	"""Cell edges (x_grid, y_grid) of a regular or rectilinear mesh"""
+	if hasattr(mesh, "x_grid"):
+		return numpy.asarray(mesh.x_grid, dtype = float), numpy.asarray(mesh.y_grid, dtype = float)
+	lower_left = numpy.asarray(mesh.lower_left, dtype = float)
+	upper_right = numpy.asarray(mesh.upper_right, dtype = float)
+	nx, ny = mesh.dimension[:2]
+	return (numpy.linspace(lower_left[0], upper_right[0], nx + 1),
+	        numpy.linspace(lower_left[1], upper_right[1], ny + 1))
+
+
+def cell_map(mesh, target):
+	"""Index of the `target` mesh cell containing each cell of `mesh`
+
+	Returns
+	-------
+	x_index, y_index : numpy.ndarray of int
+		One per column and row of `mesh`
+
+	"""
+	index = []
+	for fine, coarse in zip(mesh_grids(mesh), mesh_grids(target)):
+		centers = (fine[:-1] + fine[1:])/2.0
+		index.append(numpy.clip(numpy.searchsorted(coarse, centers) - 1, 0, len(coarse) - 2))
+	return tuple(index)
+
+
+def mesh_flux(mesh_lib, mesh, mgxs_type = "total"):
+	"""Flux-volume integral in each mesh cell: (nx, ny, G) in group order
+
+	Read from the "flux" tally of one MGXS, whose energy bins are in
+	order of increasing energy.
+
+	"""
+	tally = mesh_lib.get_mgxs(mesh, mgxs_type).tallies["flux"]
+	nx, ny = mesh.dimension[:2]
+	values = numpy.asarray(tally.mean, dtype = float).reshape(nx, ny, -1)
+	return values[:, :, ::-1]
+
+
+def _block_sum(values, x_index, y_index):
+	"""Sum (nx, ny, ...) over the blocks of consecutive cells with equal indices"""
+	x_starts = numpy.flatnonzero(numpy.r_[True, numpy.diff(x_index) != 0])
+	y_starts = numpy.flatnonzero(numpy.r_[True, numpy.diff(y_index) != 0])
+	return numpy.add.reduceat(numpy.add.reduceat(values, x_starts, axis = 0), y_starts, axis = 1)
+
+
+def collapse_arrays(arrays, flux, x_index, y_index, banded = True):
+	"""Flux-volume weight mesh arrays onto a coarser mesh
+
+	Reaction cross sections are weighted by the flux in their group, the
+	scattering matrices by the flux in the incoming group, and chi by the
+	fission neutron production.
+
+	Parameters
+	----------
+	arrays : dict of numpy.ndarray
+		On the fine mesh; "nu-scatter" may be a BandedScatter
+	flux : numpy.ndarray
+		(nx, ny, G) flux-volume integrals on the fine mesh
+	x_index, y_index : numpy.ndarray of int
+		Coarse cell of each fine column and row, from cell_map(); the
+		fine cells of a coarse cell must be contiguous
+	banded : bool, optional
+		Store the scattering matrices as a BandedScatter [Default: True]
+
+	Returns
+	-------
+	dict of numpy.ndarray
+
+	"""
+	for index in (x_index, y_index):
+		if (numpy.diff(index) < 0).any():
+			raise ValueError("The coarse cell indices must not decrease")
+	norm = _block_sum(flux, x_index, y_index)
+	norm[norm <= 0] = 1.0
+	collapsed = {}
+	for name, values in arrays.items():
+		if name == "chi":
+			continue
+		if isinstance(values, BandedScatter):
+			values = values.to_dense()
+		if values.ndim == 4:
+			mixed = _block_sum(values*flux[:, :, :, None], x_index, y_index)/norm[:, :, :, None]
+			collapsed[name] = BandedScatter.from_dense(mixed) if banded else mixed
+		else:
+			collapsed[name] = _block_sum(values*flux, x_index, y_index)/norm
+	if "chi" in arrays and "nu-fission" in arrays:
+		production = (arrays["nu-fission"]*flux).sum(axis = 2, keepdims = True)
+		chi = _block_sum(arrays["chi"]*production, x_index, y_index)
+		total = chi.sum(axis = 2, keepdims = True)
+		total[total <= 0] = 1.0
+		collapsed["chi"] = chi/total
+	return collapsed
+
+
+def nuclide_selection(mg, nuclides = "sum"):
+	"""The `nuclides` argument of MGXS.get_xs() that gives the sum over nuclides
+
+	A pruned library (see nuclide_pruning.py) tallies the kept nuclides
+	and a "total" bin for all of them; summing over its nuclides would
+	count every reaction twice.
+
+	"""
+	if nuclides == "sum" and mg.by_nuclide and "total" in mg.get_nuclides():
+		return ["total"]
+	return nuclides
+
+
+def mesh_xs(mesh_lib, mesh, mgxs_type, nuclides = "sum", value = "mean"):
+	"""Return one MGXS type of a loaded mesh library as an array
+
+	Parameters
+	----------
+	mesh_lib : openmc.mgxs.Library
+		Library loaded from a statepoint, with `mesh` as its domain
+	mesh : openmc.Mesh
+	mgxs_type : str
+	nuclides : str, optional
+		Passed on to MGXS.get_xs() [Default: "sum"]
+	value : str, optional
+		"mean" or "std_dev" [Default: "mean"]
+
+	Returns
+	-------
+	xs : numpy.ndarray
+		(nx, ny, G), or (nx, ny, G in, G out) for scattering matrices
+
+	"""
+	mg = mesh_lib.get_mgxs(mesh, mgxs_type)
+	xs = mg.get_xs(nuclides = nuclide_selection(mg, nuclides), xs_type = "macro", value = value)
+	return reshape_mesh_xs(xs, mesh.dimension, mg.energy_groups.num_groups)
+
+
+def get_mesh_arrays(mesh_lib, mesh, keys = None, banded = True, target = None):
+	"""Return the arrays needed by the deterministic solvers
+
+	Parameters
+	----------
+	mesh_lib : openmc.mgxs.Library
+	mesh : openmc.Mesh
+	keys : dict, optional
+		{array name: MGXS type} [Default: MGXS_KEYS]
+	banded : bool, optional
+		Whether to store the scattering matrices as a BandedScatter
+		instead of a dense (nx, ny, G, G) array [Default: True]
+	target : Rectilinear_Treat_Mesh, optional
+		Coarser mesh to collapse the arrays onto, e.g. one that is fine
+		only in the fuel [Default: None -- the arrays stay on `mesh`]
+
+	Returns
+	-------
+	arrays : dict of numpy.ndarray
+		Only the types present in `mesh_lib` are included
+
+	"""
+	if keys is None:
+		keys = MGXS_KEYS
+	arrays = {name: mesh_xs(mesh_lib, mesh, xstype)
+	          for name, xstype in keys.items() if xstype in mesh_lib.mgxs_types}
+	if target is not None and target is not mesh:
+		flux = mesh_flux(mesh_lib, mesh)
+		return collapse_arrays(arrays, flux, *cell_map(mesh, target), banded = banded)
+	if banded and "nu-scatter" in arrays:
+		arrays["nu-scatter"] = BandedScatter.from_dense(arrays["nu-scatter"])
+	return arrays
+
+
+def save_arrays(filename, arrays, **extra):
+	"""Save a dictionary of mesh arrays (and any extra arrays) to .npz
+
+	A BandedScatter is stored as its bands, under "<name>_shape",
+	"<name>_lower", "<name>_upper" and "<name>_data".
+
+	"""
+	flat = {}
+	for key, value in dict(arrays, **extra).items():
+		if isinstance(value, BandedScatter):
+			flat.update(value.to_arrays(key))
+		else:
+			flat[key] = value
+	numpy.savez_compressed(filename, **flat)
+
+
+def load_arrays(filename):
+	"""Load a dictionary of mesh arrays written by save_arrays()"""
+	with numpy.load(filename) as data:
+		arrays = {key: data[key] for key in data.files}
+	for key in [k[:-len("_data")] for k in arrays if k.endswith("_data")]:
+		if key + "_shape" in arrays and key + "_lower" in arrays:
+			arrays[key] = BandedScatter.from_arrays(arrays, key)
+			for suffix in ("_shape", "_lower", "_upper", "_data"):
+				del arrays[key + suffix]
+	return arrays
@@ -0,0 +1,244 @@
+# Mesh homogenization
+#
+# Build the per-mesh-cell cross sections from a material-domain MGXS
+# library instead of tallying every mesh bin and nuclide in OpenMC.
+# Each mesh cell is a mix of the TREAT materials in proportion to their
+# volume in that cell; the materials are flux-volume weighted with their
+# core-average spectra, corrected by a coarse flux mesh tally for the
+# spatial variation of the spectrum (which matters for chi).
+
+import numpy
+from mesh_arrays import MGXS_KEYS, mesh_grids, cell_map
+from point_classifier import NOT_FOUND
+from scatter_storage import BandedScatter
+
+COARSE_FLUX_TALLY = "coarse flux"
+POINTS_PER_SIDE = 16
+
+
+def volume_fractions(classifier, mesh, points_per_side = POINTS_PER_SIDE):
+	"""Volume fraction of every material in every mesh cell
+
+	The fractions are the share of a regular grid of points (at the
+	midplane of the mesh) that falls in each material: exact for the
+	planar boundaries, and within about 1/points_per_side**2 for the
+	octagonal fuel corners and the control rod cylinders.
+
+	Parameters
+	----------
+	classifier : point_classifier.PointClassifier
+	mesh : Treat_Mesh, Rectilinear_Treat_Mesh or openmc.Mesh
+		2-D (or single-level) regular or rectilinear mesh
+	points_per_side : int, optional
+		Grid points per mesh cell in x and y [Default: POINTS_PER_SIDE]
+
+	Returns
+	-------
+	material_ids : numpy.ndarray of int
+		The (sorted) IDs of the materials found on the mesh
+	fractions : numpy.ndarray
+		(nx, ny, number of materials); void is left out, so a cell's
+		fractions may sum to less than 1
+
+	"""
+	nx, ny = mesh.dimension[:2]
+	x_grid, y_grid = mesh_grids(mesh)
+	lower_left = numpy.asarray(mesh.lower_left, dtype = float)
+	upper_right = numpy.asarray(mesh.upper_right, dtype = float)
+	z = (lower_left[2] + upper_right[2])/2.0 if len(lower_left) > 2 else 0.0
+
+	# Midpoints of a points_per_side x points_per_side grid in every cell
+	sub = (numpy.arange(points_per_side) + 0.5)/points_per_side
+	xs = (x_grid[:-1, None] + numpy.diff(x_grid)[:, None]*sub[None, :]).ravel()
+	ys = (y_grid[:-1, None] + numpy.diff(y_grid)[:, None]*sub[None, :]).ravel()
+	x, y = numpy.meshgrid(xs, ys, indexing = "ij")
+	points = numpy.column_stack((x.ravel(), y.ravel(), numpy.full(x.size, z)))
+	material_map = classifier.locate(points)[1]
+
+	# (nx, p, ny, p) -> count by material in each (nx, ny) cell
+	material_map = material_map.reshape(nx, points_per_side, ny, points_per_side)
+	material_ids = numpy.unique(material_map)
+	material_ids = material_ids[material_ids != NOT_FOUND]
+	fractions = numpy.empty((nx, ny, len(material_ids)))
+	for m, mid in enumerate(material_ids):
+		fractions[:, :, m] = (material_map == mid).mean(axis = (1, 3))
+	return material_ids, fractions
+
+
+def material_xs(material_lib, material_ids, mgxs_type):
+	"""Macroscopic cross sections of each material: (M, G[, G])"""
+	domains = {domain.id: domain for domain in material_lib.domains}
+	return numpy.array([material_lib.get_mgxs(domains[mid], mgxs_type).get_xs(
+		nuclides = "sum", xs_type = "macro") for mid in material_ids], dtype = float)
+
+
+def material_flux(material_lib, material_ids, volumes, mgxs_type = "total"):
+	"""Average scalar flux in each material: (M, G)
+
+	The flux-volume integrals come from the "flux" tally of one of the
+	MGXS, whose energy bins are in order of increasing energy; they are
+	reversed into the usual group order (group 1 fastest).
+
+	Parameters
+	----------
+	material_lib : openmc.mgxs.Library
+		Material-domain library loaded from a statepoint
+	material_ids : iterable of int
+	volumes : iterable of float
+		Volume of each material in the whole model
+	mgxs_type : str, optional
+		MGXS whose flux tally to read [Default: "total"]
+
+	"""
+	domains = {domain.id: domain for domain in material_lib.domains}
+	flux = []
+	for mid, volume in zip(material_ids, volumes):
+		tally = material_lib.get_mgxs(domains[mid], mgxs_type).tallies["flux"]
+		values = numpy.asarray(tally.mean, dtype = float).ravel()[::-1]
+		flux.append(values/volume if volume > 0 else numpy.zeros_like(values))
+	return numpy.array(flux)
+
+
+def load_coarse_flux(statepoint, dimension, name = COARSE_FLUX_TALLY):
+	"""Read the coarse flux mesh tally as a (cx, cy, G) array in group order
+
+	The tally has a MeshFilter then an EnergyFilter, so mesh bins (x
+	slowest) vary slower than energy bins (lowest energy first).
+
+	"""
+	tally = statepoint.get_tally(name = name)
+	cx, cy = dimension[:2]
+	values = numpy.asarray(tally.mean, dtype = float).reshape(cx, cy, -1)
+	return values[:, :, ::-1]
+
+
+def coarse_index(mesh, coarse_mesh):
+	"""Coarse mesh cell containing the center of each column and row of `mesh`
+
+	For spectral_shape() on a mesh that does not divide evenly into the
+	coarse flux mesh, such as a Rectilinear_Treat_Mesh.
+
+	"""
+	return cell_map(mesh, coarse_mesh)
+
+
+def spectral_shape(coarse_flux, shape, index = None):
+	"""Spread a coarse flux over a fine mesh, relative to the core spectrum
+
+	Parameters
+	----------
+	coarse_flux : numpy.ndarray
+		(cx, cy, G) flux
+	shape : tuple of int
+		(nx, ny) of the fine mesh
+	index : tuple of numpy.ndarray, optional
+		(x_index, y_index): the coarse cell of each fine column and row,
+		from coarse_index() [Default: None -- the fine mesh must divide
+		evenly into the coarse mesh]
+
+	Returns
+	-------
+	numpy.ndarray
+		(nx, ny, G): the coarse cell's spectrum over the core spectrum
+
+	"""
+	cx, cy, G = coarse_flux.shape
+	nx, ny = shape
+	if index is None and (nx % cx or ny % cy):
+		raise ValueError("A {}x{} mesh does not divide into a {}x{} coarse mesh".format(
+			nx, ny, cx, cy))
+	core = coarse_flux.sum(axis = (0, 1))
+	core = core/core.sum()
+	total = coarse_flux.sum(axis = 2, keepdims = True)
+	local = numpy.divide(coarse_flux, total, out = numpy.zeros_like(coarse_flux), where = total > 0)
+	ratio = numpy.divide(local, core, out = numpy.ones_like(local), where = core > 0)
+	ratio[total[:, :, 0] <= 0] = 1.0
+	if index is not None:
+		return ratio[numpy.ix_(index[0], index[1])]
+	return numpy.repeat(numpy.repeat(ratio, nx//cx, axis = 0), ny//cy, axis = 1)
+
+
+def homogenize(material_lib, material_ids, fractions, volumes = None, coarse_flux = None,
+               keys = None, banded = True, cell_volumes = None, coarse_index = None):
+	"""Flux-volume weight the material cross sections onto the mesh
+
+	In mesh cell c, the flux in material m is modelled as
+	phi[m, g]*s[c, g]: the material's average flux times the spectral
+	shape of the coarse mesh cell around c. Reaction and scattering cross
+	sections are then weighted by fraction*phi, and chi by each material's
+	fission neutron production in that cell.
+
+	Parameters
+	----------
+	material_lib : openmc.mgxs.Library
+		Material-domain library loaded from a statepoint
+	material_ids : numpy.ndarray of int
+	fractions : numpy.ndarray
+		(nx, ny, M) volume fractions, from volume_fractions()
+	volumes : iterable of float, optional
+		Volume of each material in the whole model, for its average flux
+		[Default: the fractions times `cell_volumes`, summed over the
+		mesh; only valid when the mesh covers every instance of the
+		materials]
+	coarse_flux : numpy.ndarray, optional
+		(cx, cy, G) coarse flux mesh tally, from load_coarse_flux()
+		[Default: None -- the core-average spectrum everywhere]
+	keys : dict, optional
+		{array name: MGXS type} [Default: mesh_arrays.MGXS_KEYS]
+	banded : bool, optional
+		Store the scattering matrices as a BandedScatter [Default: True]
+	cell_volumes : numpy.ndarray, optional
+		(nx, ny) mesh cell volumes, for a non-uniform mesh
+		[Default: None -- all equal]
+	coarse_index : tuple of numpy.ndarray, optional
+		Passed on to spectral_shape() as `index`, for a mesh that does
+		not divide evenly into the coarse flux mesh
+
+	Returns
+	-------
+	arrays : dict of numpy.ndarray
+		The same arrays as mesh_arrays.get_mesh_arrays()
+
+	"""
+	if keys is None:
+		keys = MGXS_KEYS
+	nx, ny, M = fractions.shape
+	if cell_volumes is not None:
+		# Count each cell by its size in the material volumes; the weights
+		# are normalized cell by cell, so they are otherwise unchanged
+		cell_volumes = numpy.asarray(cell_volumes, dtype = float)
+		fractions = fractions*(cell_volumes/cell_volumes.mean())[:, :, None]
+	if volumes is None:
+		volumes = fractions.sum(axis = (0, 1))
+	phi = material_flux(material_lib, material_ids, volumes)
+	G = phi.shape[1]
+	if coarse_flux is None:
+		shape = numpy.ones((nx, ny, G))
+	else:
+		shape = spectral_shape(numpy.asarray(coarse_flux, dtype = float), (nx, ny), coarse_index)
+
+	# Flux-volume weight of each material in each cell and group: (nx, ny, M, G)
+	weights = fractions[:, :, :, None]*phi[None, None, :, :]
+	norm = weights.sum(axis = 2)
+	norm[norm <= 0] = 1.0
+
+	arrays = {}
+	for name, xstype in keys.items():
+		if xstype not in material_lib.mgxs_types or xstype == "chi":
+			continue
+		xs = material_xs(material_lib, material_ids, xstype)
+		if xs.ndim == 3:
+			# Scattering matrix, weighted by the incoming group flux
+			mixed = numpy.einsum("xymg,mgh->xygh", weights, xs)/norm[:, :, :, None]
+			arrays[name] = BandedScatter.from_dense(mixed) if banded else mixed
+		else:
+			arrays[name] = numpy.einsum("xymg,mg->xyg", weights, xs)/norm
+
+	if "chi" in keys and keys["chi"] in material_lib.mgxs_types:
+		chi = material_xs(material_lib, material_ids, keys["chi"])
+		nu_fission = material_xs(material_lib, material_ids, "nu-fission")
+		production = numpy.einsum("xymg,mg,xyg->xym", weights, nu_fission, shape)
+		total = production.sum(axis = 2, keepdims = True)
+		total[total <= 0] = 1.0
+		arrays["chi"] = numpy.einsum("xym,mg->xyg", production/total, chi)
+	return arrays
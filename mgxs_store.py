@@ -0,0 +1,266 @@
+# MGXS store
+#
+# Library.dump_to_file() pickles a whole MGXS library, so reading one
+# MGXS type means unpickling all of them, by-nuclide data included, and
+# then loading the statepoint again. Once a library has been loaded from
+# its statepoint, write_library() puts its cross sections in a chunked,
+# compressed HDF5 file, one dataset per (MGXS type, domain, nuclide).
+# MGXSStore reads a dataset only when it is asked for, and only the slice
+# asked for, e.g. one group or one row of the mesh.
+#
+# Layout:
+#   /                                  attrs: group_edges, domain_type, source, version
+#   /<mgxs type>/<domain id>/<nuclide>  groups of datasets "mean", "std_dev"
+#   /flux/<domain id>/sum/mean         flux-volume integrals, in group order
+#
+# The nuclide "sum" holds the sum over nuclides. Mesh domains are stored
+# as (nx, ny, [delayed group,] G[, G]), x slowest as in mesh_arrays.py;
+# other domains as MGXS.get_xs() returns them. Every dataset names its
+# axes in its "axes" attribute, e.g. "x,y,delayed,group", since delayed
+# data with as many delayed groups as energy groups has the shape of a
+# scattering matrix.
+
+import os
+import numpy
+import h5py
+import mesh_arrays
+from scatter_storage import BandedScatter
+
+SUM = "sum"
+FLUX = "flux"
+# Stores of an older version are rewritten (see is_current())
+VERSION = 2
+DELAYED_TYPES = ("delayed-nu-fission", "chi-delayed", "beta", "decay-rate",
+                 "delayed-nu-fission matrix")
+VALUES = ("mean", "std_dev")
+COMPRESSION = "gzip"
+COMPRESSION_LEVEL = 4
+# Mesh rows per chunk; each chunk holds one group (one incoming group of
+# a matrix) of CHUNK_ROWS rows
+CHUNK_ROWS = 8
+
+
+def _domain_key(domain):
+	"""Name of a domain's group: its id, given the domain, its id or the name"""
+	return str(getattr(domain, "id", domain))
+
+
+def _is_mesh(domain):
+	return hasattr(domain, "dimension")
+
+
+def _axes(mgxs_type, mesh):
+	"""Names of the axes of the data of an MGXS type"""
+	axes = ["x", "y"] if mesh else []
+	if mgxs_type in DELAYED_TYPES:
+		axes.append("delayed")
+	if "matrix" in mgxs_type:
+		axes += ["group_in", "group_out"]
+	else:
+		axes.append("group")
+	return axes
+
+
+def _mesh_shape(xs, dimension, num_groups, axes):
+	"""(nx, ny, ...) shape of get_xs() output for a 2-D mesh, with the given axes"""
+	nx, ny = dimension[:2]
+	per_delayed = num_groups**sum(axis.startswith("group") for axis in axes)
+	num_delayed = xs.size//(nx*ny*per_delayed) if "delayed" in axes else 1
+	if nx*ny*num_delayed*per_delayed != xs.size:
+		raise ValueError("Cannot reshape {} values onto a {}x{} mesh with {} groups as ({})".format(
+			xs.size, nx, ny, num_groups, ",".join(axes)))
+	sizes = {"x": nx, "y": ny, "delayed": num_delayed}
+	return tuple(sizes.get(axis, num_groups) for axis in axes)
+
+
+def _chunks(axes, shape, mesh):
+	"""One group (one incoming group of a matrix) of CHUNK_ROWS rows per chunk"""
+	if not mesh:
+		return True
+	chunks = list(shape)
+	chunks[0] = min(CHUNK_ROWS, shape[0])
+	chunks[_group_axis(axes)] = 1
+	return tuple(chunks)
+
+
+def _group_axis(axes):
+	return axes.index("group_in" if "group_in" in axes else "group")
+
+
+def _write_dataset(group, name, values, axes, mesh):
+	dataset = group.create_dataset(name, data = values, chunks = _chunks(axes, values.shape, mesh),
+	                               compression = COMPRESSION, compression_opts = COMPRESSION_LEVEL,
+	                               shuffle = True)
+	dataset.attrs["axes"] = ",".join(axes)
+
+
+def write_library(library, filename, values = VALUES, by_nuclide = True, source = ""):
+	"""Write the cross sections of a loaded MGXS library to an HDF5 store
+
+	Parameters
+	----------
+	library : openmc.mgxs.Library
+		Loaded from its statepoint (load_from_statepoint())
+	filename : str
+		HDF5 file to write; overwritten
+	values : iterable of str, optional
+		Any of "mean" and "std_dev" [Default: both]
+	by_nuclide : bool, optional
+		For a by-nuclide library, also store every nuclide [Default: True]
+	source : str, optional
+		Statepoint the library was loaded from, so that is_current()
+		can tell when the store is out of date [Default: ""]
+
+	"""
+	num_groups = library.energy_groups.num_groups
+	with h5py.File(filename, "w") as f:
+		f.attrs["group_edges"] = numpy.asarray(library.energy_groups.group_edges, dtype = float)
+		f.attrs["domain_type"] = str(library.domain_type)
+		f.attrs["source"] = os.path.abspath(source) if source else ""
+		f.attrs["source_mtime"] = os.path.getmtime(source) if source else 0.0
+		f.attrs["version"] = VERSION
+		for domain in library.domains:
+			key = _domain_key(domain)
+			mesh = _is_mesh(domain)
+			for xstype in library.mgxs_types:
+				mg = library.get_mgxs(domain, xstype)
+				nuclides = mg.get_nuclides() if mg.by_nuclide else []
+				axes = _axes(xstype, mesh)
+				stored = {SUM: mesh_arrays.nuclide_selection(mg, SUM)}
+				if by_nuclide:
+					stored.update((nuclide, [nuclide]) for nuclide in nuclides if nuclide != "total")
+				for name, selection in stored.items():
+					group = f.require_group("{}/{}/{}".format(xstype, key, name))
+					for value in values:
+						xs = numpy.asarray(mg.get_xs(nuclides = selection, xs_type = "macro",
+						                             value = value), dtype = float)
+						if mesh:
+							xs = xs.reshape(_mesh_shape(xs, domain.dimension, num_groups, axes))
+						_write_dataset(group, value, xs, axes, mesh)
+			if mesh and "total" in library.mgxs_types:
+				flux = mesh_arrays.mesh_flux(library, domain)
+				_write_dataset(f.require_group("{}/{}/{}".format(FLUX, key, SUM)), "mean", flux,
+				               ["x", "y", "group"], True)
+
+
+def is_current(filename, statepoint):
+	"""Whether a store exists, of this VERSION, and was written from this version of a statepoint"""
+	if not os.path.exists(filename):
+		return False
+	with h5py.File(filename, "r") as f:
+		return f.attrs.get("version", 1) == VERSION and \
+			f.attrs.get("source", "") == os.path.abspath(statepoint) and \
+			f.attrs.get("source_mtime", 0.0) == os.path.getmtime(statepoint)
+
+
+class MGXSStore(object):
+	"""Lazy reader of an HDF5 store written by write_library()
+
+	Datasets are opened on demand and read only as far as they are
+	sliced. Domains may be given as objects with an id, ids, or names.
+
+	Parameters
+	----------
+	filename : str
+
+	"""
+	def __init__(self, filename):
+		self.filename = filename
+		self._file = h5py.File(filename, "r")
+		self.group_edges = numpy.asarray(self._file.attrs["group_edges"])
+		self.domain_type = self._file.attrs["domain_type"]
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		self._file.close()
+
+	@property
+	def num_groups(self):
+		return len(self.group_edges) - 1
+
+	@property
+	def mgxs_types(self):
+		return [name for name in self._file if name != FLUX]
+
+	def domains(self, mgxs_type):
+		return list(self._file[mgxs_type])
+
+	def nuclides(self, mgxs_type, domain):
+		return list(self._file[mgxs_type][_domain_key(domain)])
+
+	def dataset(self, mgxs_type, domain, nuclide = SUM, value = "mean"):
+		"""The h5py.Dataset of one MGXS; nothing is read until it is sliced"""
+		try:
+			return self._file["{}/{}/{}/{}".format(mgxs_type, _domain_key(domain), nuclide, value)]
+		except KeyError:
+			raise KeyError("No '{}' of {} '{}' for domain {} in {}".format(
+				value, mgxs_type, nuclide, _domain_key(domain), self.filename))
+
+	def axes(self, mgxs_type, domain, nuclide = SUM, value = "mean"):
+		"""Names of the axes of one MGXS, e.g. ["x", "y", "delayed", "group"]"""
+		data = self.dataset(mgxs_type, domain, nuclide, value)
+		if "axes" not in data.attrs:
+			raise ValueError("{} was written by an older version; write it again".format(self.filename))
+		return data.attrs["axes"].split(",")
+
+	def get_xs(self, mgxs_type, domain, nuclide = SUM, value = "mean", rows = None, groups = None):
+		"""Read one MGXS, or a slice of it
+
+		Parameters
+		----------
+		mgxs_type : str
+		domain : domain, id or name
+		nuclide : str, optional
+			[Default: SUM]
+		value : str, optional
+			"mean" or "std_dev" [Default: "mean"]
+		rows : int or slice, optional
+			Mesh rows (first index) to read [Default: all]
+		groups : int or slice, optional
+			Groups to read; for matrices, incoming groups [Default: all]
+
+		Returns
+		-------
+		numpy.ndarray
+			For a mesh domain, (nx, ny, [D,] G[, G]) with the axes of an
+			int `rows` or `groups` dropped; see axes()
+
+		"""
+		data = self.dataset(mgxs_type, domain, nuclide, value)
+		if rows is None and groups is None:
+			return data[()]
+		axes = self.axes(mgxs_type, domain, nuclide, value)
+		index = [slice(None)]*data.ndim
+		if rows is not None:
+			if "x" not in axes:
+				raise ValueError("{} of domain {} is not on a mesh".format(mgxs_type, _domain_key(domain)))
+			index[axes.index("x")] = rows
+		if groups is not None:
+			index[_group_axis(axes)] = groups
+		return data[tuple(index)]
+
+	def mesh_flux(self, domain):
+		"""Flux-volume integrals of a mesh domain: (nx, ny, G), as mesh_arrays.mesh_flux()"""
+		return self._file["{}/{}/{}/mean".format(FLUX, _domain_key(domain), SUM)][()]
+
+	def get_mesh_arrays(self, mesh, keys = None, banded = True, target = None):
+		"""Mesh arrays as from mesh_arrays.get_mesh_arrays(), read from the store"""
+		if keys is None:
+			keys = mesh_arrays.MGXS_KEYS
+		types = self.mgxs_types
+		arrays = {name: self.get_xs(xstype, mesh) for name, xstype in keys.items() if xstype in types}
+		if target is not None and target is not mesh:
+			return mesh_arrays.collapse_arrays(arrays, self.mesh_flux(mesh),
+			                                   *mesh_arrays.cell_map(mesh, target), banded = banded)
+		if banded and "nu-scatter" in arrays:
+			arrays["nu-scatter"] = BandedScatter.from_dense(arrays["nu-scatter"])
+		return arrays
+
+	def __repr__(self):
+		return "MGXSStore('{}', {} types, {} groups)".format(
+			self.filename, len(self.mgxs_types), self.num_groups)
@@ -0,0 +1,204 @@
+# MOC builder
+#
+# Build OpenMOC checkerboard models from per-mesh-cell cross section
+# arrays (see mesh_arrays.py): one homogeneous material per mesh cell,
+# arranged in a lattice with the same widths as the tally mesh, or in
+# nested per-assembly lattices for a Rectilinear_Treat_Mesh.
+
+import numpy
+import openmoc
+from scatter_storage import BandedScatter
+
+# Array name -> openmoc.Material setter
+SETTERS = {"total"     : "setSigmaT",
+           "chi"       : "setChi",
+           "nu-fission": "setNuSigmaF",
+           "fission"   : "setSigmaF",
+           "nu-scatter": "setSigmaS"}
+
+
+def set_material_xs(material, arrays, i, j, keys = None):
+	"""Set the cross sections of mesh cell (i, j) on an openmoc.Material
+
+	Parameters
+	----------
+	material : openmoc.Material
+	arrays : dict
+		Mesh arrays; "nu-scatter" may be dense or a BandedScatter
+	i, j : int
+		Mesh indices (0-based) in x and y
+	keys : iterable of str, optional
+		Which arrays to set [Default: all of those in SETTERS]
+
+	"""
+	if keys is None:
+		keys = SETTERS
+	for key in keys:
+		if key not in arrays:
+			continue
+		values = arrays[key]
+		if isinstance(values, BandedScatter):
+			values = values.cell_matrix((i, j))
+		else:
+			values = values[i, j]
+		# Scattering matrices are flattened with the incoming group first
+		getattr(material, SETTERS[key])(numpy.ascontiguousarray(values, dtype = float).ravel())
+
+
+def build_materials(arrays, num_groups):
+	"""Create one openmoc.Material per mesh cell
+
+	Returns
+	-------
+	materials : list of lists of openmoc.Material
+		materials[i][j] holds the cross sections of mesh cell (i, j)
+
+	"""
+	nx, ny = numpy.shape(arrays["total"])[:2]
+	materials = [[None for j in range(ny)] for i in range(nx)]
+	for i in range(nx):
+		for j in range(ny):
+			m = openmoc.Material()
+			m.setNumEnergyGroups(num_groups)
+			set_material_xs(m, arrays, i, j)
+			materials[i][j] = m
+	return materials
+
+
+def build_geometry(materials, lower_left, upper_right, boundary = openmoc.VACUUM,
+                   num_sectors = 8, name = 'TREAT lattice'):
+	"""Arrange the materials in a checkerboard lattice
+
+	Parameters
+	----------
+	materials : list of lists of openmoc.Material
+		As returned by build_materials()
+	lower_left, upper_right : iterable of float
+		Corners of the mesh
+	boundary : openmoc boundary type, optional
+		[Default: openmoc.VACUUM]
+	num_sectors : int, optional
+		Number of sectors per cell [Default: 8]
+	name : str, optional
+		Name of the lattice
+
+	Returns
+	-------
+	geometry : openmoc.Geometry
+
+	"""
+	nx, ny = len(materials), len(materials[0])
+	x_width = (upper_right[0] - lower_left[0])/nx
+	y_width = (upper_right[1] - lower_left[1])/ny
+	lattice = openmoc.Lattice(name = name)
+	lattice.setWidth(x_width, y_width)
+
+	universes = [[None for i in range(nx)] for j in range(ny)]
+	for i in range(nx):
+		for j in range(ny):
+			c = openmoc.Cell()
+			c.setFill(materials[i][j])
+			u = openmoc.Universe()
+			u.addCell(c)
+			universes[j][i] = u
+	lattice.setUniverses([universes])
+	return _bounded_geometry(lattice, lower_left, upper_right, boundary, num_sectors)
+
+
+def build_rectilinear_geometry(materials, lower_left, pitch, x_divisions, y_divisions,
+                               boundary = openmoc.VACUUM, num_sectors = 8, name = 'TREAT lattice'):
+	"""Arrange the materials of a rectilinear mesh in nested lattices
+
+	The mesh of a Rectilinear_Treat_Mesh is uniform within each assembly,
+	so the outer lattice has one universe per assembly, each filled with
+	a regular x_divisions[i] by y_divisions[j] lattice of its mesh cells.
+
+	Parameters
+	----------
+	materials : list of lists of openmoc.Material
+		As returned by build_materials(), on the rectilinear mesh
+	lower_left : iterable of float
+		Lower left corner of the assembly lattice
+	pitch : iterable of float
+		Assembly pitch in x and y
+	x_divisions, y_divisions : iterable of int
+		Mesh cells per assembly in each lattice column and row
+	boundary, num_sectors, name :
+		As for build_geometry()
+
+	Returns
+	-------
+	geometry : openmoc.Geometry
+
+	"""
+	x_divisions = numpy.asarray(x_divisions, dtype = int)
+	y_divisions = numpy.asarray(y_divisions, dtype = int)
+	nx, ny = len(materials), len(materials[0])
+	assert (x_divisions.sum(), y_divisions.sum()) == (nx, ny), \
+		"The divisions do not match the {}x{} materials".format(nx, ny)
+	x_starts = numpy.concatenate(([0], numpy.cumsum(x_divisions)[:-1]))
+	y_starts = numpy.concatenate(([0], numpy.cumsum(y_divisions)[:-1]))
+
+	assemblies = [[None for i in range(len(x_divisions))] for j in range(len(y_divisions))]
+	for I, (x0, dx) in enumerate(zip(x_starts, x_divisions)):
+		for J, (y0, dy) in enumerate(zip(y_starts, y_divisions)):
+			inner = openmoc.Lattice()
+			inner.setWidth(pitch[0]/dx, pitch[1]/dy)
+			universes = [[None for a in range(dx)] for b in range(dy)]
+			for a in range(dx):
+				for b in range(dy):
+					c = openmoc.Cell()
+					c.setFill(materials[x0 + a][y0 + b])
+					u = openmoc.Universe()
+					u.addCell(c)
+					universes[b][a] = u
+			inner.setUniverses([universes])
+			cell = openmoc.Cell()
+			cell.setFill(inner)
+			assembly = openmoc.Universe()
+			assembly.addCell(cell)
+			assemblies[J][I] = assembly
+
+	lattice = openmoc.Lattice(name = name)
+	lattice.setWidth(pitch[0], pitch[1])
+	lattice.setUniverses([assemblies])
+	upper_right = [lower_left[0] + pitch[0]*len(x_divisions),
+	               lower_left[1] + pitch[1]*len(y_divisions)]
+	return _bounded_geometry(lattice, lower_left, upper_right, boundary, num_sectors)
+
+
+def build_mesh_geometry(materials, mesh, **kwargs):
+	"""build_geometry() or build_rectilinear_geometry(), as suits the mesh"""
+	if hasattr(mesh, "x_divisions"):
+		return build_rectilinear_geometry(materials, mesh.lower_left, mesh.pitch,
+		                                  mesh.x_divisions, mesh.y_divisions, **kwargs)
+	return build_geometry(materials, mesh.lower_left, mesh.upper_right, **kwargs)
+
+
+def _bounded_geometry(lattice, lower_left, upper_right, boundary, num_sectors):
+	"""The Geometry of a root cell filled with `lattice`, bounded by four planes"""
+	root_universe = openmoc.Universe(name = "root universe")
+	root_cell = openmoc.Cell(name = "root cell")
+	root_cell.setFill(lattice)
+
+	# Make some boundaries
+	min_x = openmoc.XPlane(x = lower_left[0])
+	max_x = openmoc.XPlane(x = upper_right[0])
+	min_y = openmoc.YPlane(y = lower_left[1])
+	max_y = openmoc.YPlane(y = upper_right[1])
+	for s in (min_x, max_x, min_y, max_y):
+		s.setBoundaryType(boundary)
+	root_cell.addSurface(+1, min_x)
+	root_cell.addSurface(-1, max_x)
+	root_cell.addSurface(+1, min_y)
+	root_cell.addSurface(-1, max_y)
+
+	root_universe.addCell(root_cell)
+	geom = openmoc.Geometry()
+	geom.setRootUniverse(root_universe)
+
+	# Spatial discretization
+	cells = geom.getAllMaterialCells()
+	for c in cells:
+		cells[c].setNumSectors(num_sectors)
+	return geom
@@ -0,0 +1,161 @@
+# MOC update
+#
+# Re-solve an OpenMOC checkerboard after a local change of the cross
+# sections (a control rod moved, a perturbed statepoint) without
+# rebuilding it: compare the new per-cell arrays with the old ones, reset
+# only the openmoc.Materials of the cells that changed, keep the geometry
+# and tracks, and restart the eigenvalue solve from the previous
+# converged flux.
+
+import numpy
+import openmoc
+import openmoc.process
+import moc_builder
+import warm_start
+from scatter_storage import BandedScatter
+
+# Relative change in any cross section of a cell that counts as a change
+RTOL = 1E-6
+
+
+def _per_cell(values):
+	"""(nx, ny, ...) dense array of a mesh array or BandedScatter"""
+	if isinstance(values, BandedScatter):
+		values = values.to_dense()
+	return numpy.asarray(values, dtype = float)
+
+
+def changed_cells(old_arrays, new_arrays, rtol = RTOL, keys = None):
+	"""Mesh cells whose cross sections differ between two sets of arrays
+
+	Parameters
+	----------
+	old_arrays, new_arrays : dict
+		Mesh arrays on the same mesh, as from mesh_arrays.get_mesh_arrays()
+	rtol : float, optional
+		Largest relative change (of any group of any array, relative to
+		that array's largest value in the cell) that is ignored [Default: RTOL]
+	keys : iterable of str, optional
+		Arrays to compare [Default: those of moc_builder.SETTERS in both]
+
+	Returns
+	-------
+	numpy.ndarray of bool
+		(nx, ny)
+
+	"""
+	if keys is None:
+		keys = [key for key in moc_builder.SETTERS if key in old_arrays and key in new_arrays]
+	changed = None
+	for key in keys:
+		old = _per_cell(old_arrays[key])
+		new = _per_cell(new_arrays[key])
+		if old.shape != new.shape:
+			raise ValueError("'{}' changed shape from {} to {}: rebuild the model".format(
+				key, old.shape, new.shape))
+		nx, ny = old.shape[:2]
+		old = old.reshape(nx, ny, -1)
+		new = new.reshape(nx, ny, -1)
+		scale = numpy.maximum(numpy.abs(old).max(axis = 2), numpy.abs(new).max(axis = 2))
+		diff = numpy.abs(new - old).max(axis = 2) > rtol*scale
+		changed = diff if changed is None else changed | diff
+	return changed
+
+
+class IncrementalSolver(object):
+	"""An OpenMOC checkerboard that can be re-solved after local changes
+
+	Parameters
+	----------
+	solver : openmoc.Solver
+		Solver of the checkerboard, whose tracks have been generated
+	materials : list of lists of openmoc.Material
+		materials[i][j] of mesh cell (i, j), as from moc_builder.build_materials()
+	arrays : dict
+		The mesh arrays the materials currently hold
+	rtol : float, optional
+		See changed_cells() [Default: RTOL]
+
+	Attributes
+	----------
+	history : list of dict
+		keff, iterations, seconds and changed cells of every solve
+
+	"""
+	def __init__(self, solver, materials, arrays, rtol = RTOL):
+		self.solver = solver
+		self.materials = materials
+		self.arrays = arrays
+		self.rtol = rtol
+		self.num_groups = numpy.shape(arrays["total"])[-1]
+		self.history = []
+		self._fluxes = None
+
+	@classmethod
+	def build(cls, arrays, mesh, num_azim = 16, azim_spacing = 1.0, boundary = openmoc.VACUUM,
+	          num_threads = 1, rtol = RTOL):
+		"""Build the materials, geometry, tracks and solver for mesh arrays"""
+		num_groups = numpy.shape(arrays["total"])[-1]
+		materials = moc_builder.build_materials(arrays, num_groups)
+		geom = moc_builder.build_mesh_geometry(materials, mesh, boundary = boundary)
+		track_generator = openmoc.TrackGenerator(geom, num_azim = num_azim,
+		                                         azim_spacing = azim_spacing)
+		track_generator.setNumThreads(num_threads)
+		track_generator.generateTracks()
+		solver = openmoc.CPUSolver(track_generator)
+		solver.setNumThreads(num_threads)
+		return cls(solver, materials, arrays, rtol)
+
+	@classmethod
+	def from_solver(cls, solver, materials, arrays, rtol = RTOL):
+		"""Wrap a solver that has just converged on `arrays`, keeping its flux"""
+		updater = cls(solver, materials, arrays, rtol)
+		updater._save_fluxes()
+		return updater
+
+	def _save_fluxes(self):
+		self._fluxes = numpy.asarray(openmoc.process.get_scalar_fluxes(self.solver), dtype = float)
+
+	def update(self, new_arrays):
+		"""Reset the materials of the cells whose cross sections changed
+
+		Returns
+		-------
+		numpy.ndarray of bool
+			(nx, ny) mask of the updated cells
+
+		"""
+		mask = changed_cells(self.arrays, new_arrays, self.rtol)
+		for i, j in zip(*numpy.nonzero(mask)):
+			moc_builder.set_material_xs(self.materials[i][j], new_arrays, i, j)
+		self.arrays = new_arrays
+		return mask
+
+	def solve(self, label = "", **kwargs):
+		"""Solve for keff, from the last converged flux if there is one"""
+		if self._fluxes is not None:
+			warm_start.set_fluxes(self.solver, self._fluxes)
+		result = warm_start.compute_eigenvalue(self.solver, label, **kwargs)
+		self._save_fluxes()
+		self.history.append(result)
+		return result
+
+	def run_case(self, new_arrays, label = "", **kwargs):
+		"""Update the changed materials and re-solve
+
+		Returns
+		-------
+		dict
+			As from solve(), with the number of changed cells
+			("changed_cells"); with no change the last result is reused
+
+		"""
+		mask = self.update(new_arrays)
+		num_changed = int(mask.sum())
+		if num_changed == 0 and self.history:
+			result = dict(self.history[-1], changed_cells = 0, iterations = 0, seconds = 0.0)
+			self.history.append(result)
+			return result
+		result = self.solve("{} ({} cells changed)".format(label, num_changed), **kwargs)
+		result["changed_cells"] = num_changed
+		return result
@@ -0,0 +1,90 @@
+# Nuclide densities
+#
+# Merge the nuclide densities of several materials or cells by volume
+# fraction. Only the get_nuclide_densities() of the cells is used, so
+# this needs no OpenMC import; see treat_mesh.py.
+
+import profiling
+
+
+def merge_nuclide_densities(old_dict, new_dict, vfrac):
+	"""Add a dictionary of nuclide densities to an existing dictionary
+	by volume fraction.
+	
+	Parameters
+	----------
+	old_dict : dictionary
+		Existing Dictionary whose keys are nuclide names and values are
+			3-tuples of (nuclide, density percent, density percent type)
+	
+	new_dict : dictionary
+		Dictionary to merge into old_dict. Must be of the same format,
+			and nuclides must share fraction type.
+	
+	vfrac : float
+		Volume fraction of the material whose nuclides are in new_dict
+	
+	
+	Returns
+	-------
+	old_dict : dictionary
+		The original dictionary updated with the values from new_dict
+	
+	"""
+	for key in new_dict:
+		if key in old_dict:
+			old_tuple = old_dict[key]
+			new_tuple = new_dict[key]
+			# Third entry is the percent type
+			old_type = old_tuple[2]
+			new_type = new_tuple[2]
+			errstr = "Density percents must be of the same type. \
+			Expected '{}', got '{}'".format(old_type, new_type)
+			assert old_type == new_type, errstr
+			
+			# Update the dictionary with the appropriate fraction of this nuclide
+			merged_frac = old_tuple[1] + new_tuple[1]*vfrac
+			old_dict[key] = (old_tuple[0], merged_frac, old_type)
+		else:
+			old_dict[key] = new_dict[key]
+	return old_dict
+
+
+@profiling.timed
+def merge_nuclide_densities_by_cell(cell_dict, vfrac_list, nuclide_densities = None):
+	"""Find and merge the nuclide densities for several OpenMC cells
+
+	Parameters
+	----------
+	cell_dict : collections.OrderedDict
+		Ordered dictionary of {cell_id : openmc.Cell} from which each
+			cell nuclide densities will be looked up
+	
+	vfrac_list : list or tuple
+		List of the volume fractions corresponding to each Cell.
+			Must be the same length as cell_dict.
+	
+	nuclide_densities : dictionary, optional
+		Existing Dictionary whose keys are nuclide names and values are
+			3-tuples of (nuclide, density percent, density percent type).
+			Nuclide densities from cell_dict will be merged into this.
+	
+	Returns
+	-------
+	nuclide_densities: dictionary
+
+	"""
+	n = len(cell_dict)
+	assert n == len(vfrac_list), \
+		"Number of volume fractions given does not equal number of cells."
+	
+	if nuclide_densities is None:
+		nuclide_densities = {}
+	i = 0
+	
+	for id in cell_dict:
+		cell_nuc_dens = cell_dict[id].get_nuclide_densities()
+		v = vfrac_list[i]
+		i += 1
+		nuclide_densities = merge_nuclide_densities(nuclide_densities, cell_nuc_dens, v)
+	return nuclide_densities
@@ -0,0 +1,229 @@
+# Nuclide pruning
+#
+# Choose which nuclides deserve their own bins in the by-nuclide MGXS
+# tallies. Each nuclide's share of every material's macroscopic
+# absorption and scattering is estimated from the material densities and
+# one-group (2200 m/s) cross sections; nuclides that never matter are
+# lumped into a residual, tallied as the "total" nuclide, and the largest
+# share of any material left in that residual is reported as the bound
+# on what the explicit nuclides miss.
+
+import re
+from collections import OrderedDict
+
+AVOGADRO = 0.602214076  # atoms*cm^2/(mol*barn)
+THRESHOLD = 1E-3
+# Always tallied explicitly: fuel, the control poison, and the moderator
+ALWAYS_KEEP = ("U235", "U238", "B10", "C0")
+RESIDUAL = "total"
+
+# One-group (2200 m/s) absorption and scattering cross sections, barns
+ONE_GROUP_XS = {
+	"H1": (0.3326, 20.49), "H2": (0.000519, 3.39), "He3": (5333.0, 4.42),
+	"Li6": (940.0, 0.97), "Li7": (0.0454, 1.37), "Be9": (0.0076, 6.15),
+	"B10": (3837.0, 2.23), "B11": (0.0055, 5.05), "C0": (0.0035, 4.74),
+	"N14": (1.91, 10.05), "N15": (0.000024, 4.59), "O16": (0.00019, 3.76),
+	"O17": (0.236, 3.76), "F19": (0.0096, 4.02), "Na23": (0.53, 3.28),
+	"Mg24": (0.05, 3.71), "Al27": (0.231, 1.50), "Si28": (0.177, 2.12),
+	"Cl35": (44.1, 21.8), "Ar40": (0.66, 0.65), "K39": (2.1, 2.0),
+	"Ti48": (7.84, 4.65), "V51": (4.9, 5.1), "Cr52": (0.76, 3.04),
+	"Cr53": (18.1, 5.93), "Mn55": (13.3, 2.15), "Fe54": (2.25, 2.2),
+	"Fe56": (2.59, 12.42), "Fe57": (2.48, 1.0), "Co59": (37.18, 6.0),
+	"Ni58": (4.6, 26.1), "Ni60": (2.9, 1.0), "Cu63": (4.5, 5.2),
+	"Cu65": (2.17, 14.5), "Zn64": (0.79, 4.0), "Zr90": (0.011, 5.1),
+	"Mo95": (13.1, 6.0), "Rh103": (144.8, 4.6), "Ag107": (37.6, 7.7),
+	"Ag109": (91.0, 2.6), "Cd113": (20600.0, 12.4), "In115": (202.0, 2.5),
+	"Sm149": (42080.0, 200.0), "Sm152": (206.0, 3.1), "Eu151": (9100.0, 6.0),
+	"Eu153": (312.0, 8.5), "Gd155": (60900.0, 40.8), "Gd157": (254000.0, 1044.0),
+	"Dy161": (600.0, 14.0), "Dy164": (2840.0, 300.0), "Er167": (659.0, 3.1),
+	"Tm169": (100.0, 6.4), "Lu176": (2065.0, 5.0), "Hf177": (373.0, 0.1),
+	"Hf178": (84.0, 4.4), "Hf179": (41.0, 7.6), "Ta181": (20.6, 6.0),
+	"W186": (37.9, 0.2), "Re185": (112.0, 10.0), "Re187": (76.4, 10.0),
+	"Ir191": (954.0, 14.0), "Ir193": (111.0, 14.0), "Au197": (98.65, 7.84),
+	"Hg199": (2150.0, 66.0), "Pb208": (0.00048, 11.34), "Th232": (7.37, 13.36),
+	"U234": (100.1, 10.0), "U235": (680.9, 14.0), "U236": (5.11, 8.3),
+	"U238": (2.68, 9.38)}
+# Used for nuclides missing from the table
+DEFAULT_XS = (5.0, 5.0)
+# Atomic masses of natural elements (other nuclides use their mass number)
+NATURAL_MASSES = {"C0": 12.011}
+
+
+def atomic_mass(nuclide):
+	"""Approximate atomic mass of a nuclide name such as 'U235' or 'C0'"""
+	if nuclide in NATURAL_MASSES:
+		return NATURAL_MASSES[nuclide]
+	match = re.match(r"^[A-Z][a-z]?(\d+)", nuclide)
+	if match is None or int(match.group(1)) == 0:
+		raise ValueError("Cannot determine the atomic mass of " + nuclide)
+	return float(match.group(1))
+
+
+def atom_densities(material):
+	"""Number density of each nuclide in a material, atoms/b-cm
+
+	Parameters
+	----------
+	material : openmc.Material or geometry_snapshot.LightMaterial
+		With density in "g/cc", "g/cm3", "atom/b-cm" or "sum" units
+
+	Returns
+	-------
+	densities : OrderedDict
+		{nuclide name: atoms/b-cm}
+
+	"""
+	nuclides = list(material.get_nuclide_densities().values())
+	if not nuclides:
+		return OrderedDict()
+	names = [nuc[0] for nuc in nuclides]
+	percents = [nuc[1] for nuc in nuclides]
+	masses = [atomic_mass(name) for name in names]
+	# Convert weight fractions into atom fractions
+	atoms = [p if nuc[2] == "ao" else p/m for p, m, nuc in zip(percents, masses, nuclides)]
+	units = material.density_units
+	if units == "sum":
+		return OrderedDict(zip(names, atoms))
+	total = sum(atoms)
+	if units == "atom/b-cm":
+		scale = material.density/total
+	elif units in ("g/cc", "g/cm3"):
+		scale = material.density*AVOGADRO/sum(a*m for a, m in zip(atoms, masses))
+	else:
+		raise ValueError("Unsupported density units for pruning: {}".format(units))
+	return OrderedDict((name, a*scale) for name, a in zip(names, atoms))
+
+
+def nuclide_shares(material, cross_sections = None):
+	"""Each nuclide's share of a material's absorption and scattering
+
+	Parameters
+	----------
+	material : openmc.Material or geometry_snapshot.LightMaterial
+	cross_sections : dict, optional
+		{nuclide: (absorption, scatter)} one-group microscopic cross
+		sections, e.g. condensed from an earlier run [Default: ONE_GROUP_XS]
+
+	Returns
+	-------
+	shares : OrderedDict
+		{nuclide: (absorption share, scattering share)}
+
+	"""
+	if cross_sections is None:
+		cross_sections = ONE_GROUP_XS
+	rates = OrderedDict()
+	for name, density in atom_densities(material).items():
+		sigma_a, sigma_s = cross_sections.get(name, DEFAULT_XS)
+		rates[name] = (density*sigma_a, density*sigma_s)
+	absorption = sum(r[0] for r in rates.values()) or 1.0
+	scatter = sum(r[1] for r in rates.values()) or 1.0
+	return OrderedDict((name, (a/absorption, s/scatter)) for name, (a, s) in rates.items())
+
+
+class PruningResult(object):
+	"""Explicit and lumped nuclides, with the residual bound per material
+
+	Attributes
+	----------
+	kept : list of str
+		Nuclides that get their own tally bins
+	lumped : list of str
+		Nuclides left in the residual
+	bounds : OrderedDict
+		{material id: largest share of its absorption or scattering that
+		is only in the residual}
+	max_bound : float
+		Largest of the bounds
+
+	"""
+	def __init__(self, kept, lumped, bounds):
+		self.kept = kept
+		self.lumped = lumped
+		self.bounds = bounds
+		self.max_bound = max(bounds.values()) if bounds else 0.0
+
+	@property
+	def num_bins(self):
+		"""Tallied nuclide bins, including the residual"""
+		return len(self.kept) + (1 if self.lumped else 0)
+
+	@property
+	def reduction(self):
+		"""Factor by which the number of nuclide bins drops"""
+		return (len(self.kept) + len(self.lumped))/float(max(self.num_bins, 1))
+
+	def tally_nuclides(self):
+		"""Nuclides to give the by-nuclide tallies"""
+		return self.kept + ([RESIDUAL] if self.lumped else [])
+
+	def summary(self):
+		lines = ["Explicit nuclides ({}): {}".format(len(self.kept), ", ".join(self.kept)),
+		         "Lumped nuclides: {}".format(len(self.lumped)),
+		         "Nuclide bins: {} ({:.1f}x fewer)".format(self.num_bins, self.reduction),
+		         "Residual bound: {:.2e}".format(self.max_bound)]
+		return "\n".join(lines)
+
+
+def prune(materials, threshold = THRESHOLD, always = ALWAYS_KEEP, cross_sections = None):
+	"""Keep the nuclides with a significant share of any material
+
+	A nuclide is kept if its share of the absorption or the scattering
+	in any material exceeds `threshold`, or if it is in `always`.
+
+	Parameters
+	----------
+	materials : iterable of openmc.Material or LightMaterial
+	threshold : float, optional
+		[Default: THRESHOLD]
+	always : iterable of str, optional
+		[Default: ALWAYS_KEEP]
+	cross_sections : dict, optional
+		Passed on to nuclide_shares()
+
+	Returns
+	-------
+	PruningResult
+
+	"""
+	shares = OrderedDict((mat.id, nuclide_shares(mat, cross_sections)) for mat in materials)
+	present = []
+	kept = set(always)
+	for mat_shares in shares.values():
+		for name, (a, s) in mat_shares.items():
+			if name not in present:
+				present.append(name)
+			if max(a, s) > threshold:
+				kept.add(name)
+	kept_list = [name for name in present if name in kept]
+	lumped = [name for name in present if name not in kept]
+	bounds = OrderedDict()
+	for mid, mat_shares in shares.items():
+		residual_a = sum(a for name, (a, s) in mat_shares.items() if name not in kept)
+		residual_s = sum(s for name, (a, s) in mat_shares.items() if name not in kept)
+		bounds[mid] = max(residual_a, residual_s)
+	return PruningResult(kept_list, lumped, bounds)
+
+
+def apply_to_library(library, result):
+	"""Restrict the by-nuclide MGXS of a library to the pruned nuclides
+
+	Each by-nuclide MGXS then tallies the nuclides it contains that were
+	kept, plus the RESIDUAL ("total") bin. The sum over all nuclides is
+	the RESIDUAL bin itself; mesh_arrays.mesh_xs() reads it in place of
+	"sum" when it is present.
+
+	"""
+	for domain_mgxs in library.all_mgxs.values():
+		for mg in domain_mgxs.values():
+			if not mg.by_nuclide:
+				continue
+			present = mg.get_nuclides()
+			mg.nuclides = [nuc for nuc in result.kept if nuc in present] + [RESIDUAL]
+
+
+if __name__ == "__main__":
+	import xml_geometry
+	geom = xml_geometry.read_model()
+	pruned = prune(geom.get_all_materials().values())
+	print(pruned.summary())
@@ -0,0 +1,276 @@
+# Perturbation
+#
+# First-order perturbation theory on the diffusion model of the
+# checkerboard. With the forward and adjoint fluxes of M phi = F phi / k
+# computed once, the reactivity worth of any change of the mesh cross
+# sections is an inner product, with no new eigenvalue solve:
+#
+#   drho = -<phi+, (dM - dF/k) phi> / <phi+, F phi>
+#
+# The derivatives of rho with respect to every cross section of every
+# mesh cell and group (sensitivity maps over the 19x19 core) come in
+# closed form from the same two fluxes, including the leakage change
+# through the diffusion coefficients. They give the worth of many
+# perturbations at once; operator_estimate() takes any new set of arrays.
+
+import numpy
+from diffusion import DiffusionSolver, VACUUM, REFLECTIVE, ZERO_FLUX, MIN_TOTAL
+from scatter_storage import BandedScatter
+
+PCM = 1E5
+
+
+def _dense(values):
+	if isinstance(values, BandedScatter):
+		values = values.to_dense()
+	return numpy.asarray(values, dtype = float)
+
+
+def _boundary_derivative(D, h, boundary):
+	"""Derivative of diffusion._boundary_coupling() with respect to D"""
+	if boundary == VACUUM:
+		return h/(h + 2*D)**2
+	elif boundary == REFLECTIVE:
+		return numpy.zeros_like(D)
+	elif boundary == ZERO_FLUX:
+		return numpy.ones_like(D)/h
+	raise ValueError("Unknown boundary condition: " + str(boundary))
+
+
+class PerturbationTheory(object):
+	"""Forward and adjoint diffusion solutions, and reactivity worths from them
+
+	Parameters
+	----------
+	arrays : dict of numpy.ndarray
+		Reference mesh arrays, see diffusion.DiffusionSolver
+	dx, dy : float or iterable of float
+		Mesh widths in cm
+	boundary : str or dict, optional
+		See diffusion.DiffusionSolver [Default: VACUUM]
+	kwargs :
+		Passed on to DiffusionSolver.solve()
+
+	Attributes
+	----------
+	forward, adjoint : diffusion.DiffusionResult
+	keff : float
+
+	"""
+	def __init__(self, arrays, dx, dy, boundary = VACUUM, **kwargs):
+		self.arrays = arrays
+		self.dx = dx
+		self.dy = dy
+		self.boundary = boundary
+		self.solver = DiffusionSolver(arrays, dx, dy, boundary)
+		self.forward = self.solver.solve(**kwargs)
+		kwargs.setdefault("k_guess", self.forward.keff)
+		self.adjoint = self.solver.solve(adjoint = True, **kwargs)
+		self.keff = self.forward.keff
+		phi = self.solver._from_mesh(self.forward.flux)
+		phi_adj = self.solver._from_mesh(self.adjoint.flux)
+		# <phi+, F phi>: the normalization of every worth
+		self.production = phi_adj @ (self.solver.fission_operator @ phi)
+		self._derivatives = None
+
+	@property
+	def flux(self):
+		return self.forward.flux
+
+	@property
+	def importance(self):
+		return self.adjoint.flux
+
+	def reactivity_to_keff(self, drho):
+		"""Perturbed keff for reactivity worths drho: 1/(1/k - drho)"""
+		return 1.0/(1.0/self.keff - numpy.asarray(drho))
+
+	#######################################
+	# Operator differences
+	#######################################
+
+	def contributions(self, new_arrays):
+		"""First-order worth of new arrays, by mesh cell and group
+
+		dM and dF are the differences of the assembled diffusion
+		operators, so every change is included: removal, scattering,
+		fission, and leakage through the diffusion coefficients. Each
+		term is attributed to the cell and group of its balance equation.
+
+		Returns
+		-------
+		numpy.ndarray
+			(nx, ny, G) contributions to drho; their sum is the worth
+
+		"""
+		new = DiffusionSolver(new_arrays, self.dx, self.dy, self.boundary)
+		dM = new.loss_operator - self.solver.loss_operator
+		dF = new.fission_operator - self.solver.fission_operator
+		phi = self.solver._from_mesh(self.forward.flux)
+		phi_adj = self.solver._from_mesh(self.adjoint.flux)
+		terms = -phi_adj*((dM - dF/self.keff) @ phi)/self.production
+		return self.solver._to_mesh(terms)
+
+	def operator_estimate(self, new_arrays):
+		"""First-order reactivity worth (float) of a new set of mesh arrays"""
+		return self.contributions(new_arrays).sum()
+
+	#######################################
+	# Sensitivities
+	#######################################
+
+	def derivatives(self):
+		"""Derivatives of rho with respect to each cross section
+
+		Returns
+		-------
+		dict of numpy.ndarray
+			"total", "nu-fission", "chi": (nx, ny, G); "nu-scatter":
+			(nx, ny, G in, G out); and "transport" (nx, ny, G) if the
+			arrays have it. The leakage change through the diffusion
+			coefficients goes with "transport" if present, with "total"
+			otherwise. Units: reactivity per cm^-1.
+
+		"""
+		if self._derivatives is not None:
+			return self._derivatives
+		s = self.solver
+		phi = self.forward.flux
+		phi_adj = self.adjoint.flux
+		area = (s.dx[:, None]*s.dy[None, :])[:, :, None]
+		weight = area/self.production
+		chi = _dense(self.arrays["chi"])
+		nu_fission = _dense(self.arrays["nu-fission"])
+
+		derivatives = {}
+		# Removal: d(M) = area*d(total) on the diagonal
+		derivatives["total"] = -weight*phi_adj*phi
+		# In-scatter g -> g': d(M)[g', g] = -area*d(scatter)
+		derivatives["nu-scatter"] = weight[..., None]*phi[:, :, :, None]*phi_adj[:, :, None, :]
+		# Fission: d(F)[g', g] = area*chi[g']*d(nu-fission[g])
+		adjoint_chi = (chi*phi_adj).sum(axis = 2, keepdims = True)
+		derivatives["nu-fission"] = weight*phi*adjoint_chi/self.keff
+		production = (nu_fission*phi).sum(axis = 2, keepdims = True)
+		derivatives["chi"] = weight*phi_adj*production/self.keff
+
+		leakage = self._diffusion_derivative()
+		key = "transport" if "transport" in self.arrays else "total"
+		sigma_tr = numpy.asarray(self.arrays.get("transport", s.total), dtype = float)
+		D = 1.0/(3.0*numpy.maximum(sigma_tr, MIN_TOTAL))
+		dD = numpy.where(sigma_tr > MIN_TOTAL, -3.0*D**2, 0.0)
+		if key == "total":
+			derivatives["total"] = derivatives["total"] + leakage*dD
+		else:
+			derivatives["transport"] = leakage*dD
+		self._derivatives = derivatives
+		return derivatives
+
+	def _diffusion_derivative(self):
+		"""Derivative of rho with respect to the diffusion coefficients: (nx, ny, G)
+
+		Each face adds c (phi+_a - phi+_b)(phi_a - phi_b) to <phi+, M phi>,
+		with c the harmonic-mean coupling of diffusion.DiffusionSolver.build();
+		each boundary face adds b phi+_a phi_a.
+
+		"""
+		s = self.solver
+		phi = self.forward.flux
+		phi_adj = self.adjoint.flux
+		sigma_tr = numpy.asarray(self.arrays.get("transport", s.total), dtype = float)
+		D = 1.0/(3.0*numpy.maximum(sigma_tr, MIN_TOTAL))
+		hx = s.dx[:, None, None]/2.0
+		hy = s.dy[None, :, None]/2.0
+		dM = numpy.zeros(D.shape)
+
+		# Interior faces: dc/dD_i = c^2 h_i/(D_i^2 w)
+		for axis, h, w in ((0, hx, s.dy[None, :, None]), (1, hy, s.dx[:, None, None])):
+			lo = [slice(None)]*3
+			hi = [slice(None)]*3
+			lo[axis] = slice(None, -1)
+			hi[axis] = slice(1, None)
+			lo, hi = tuple(lo), tuple(hi)
+			c = w/(h[lo]/D[lo] + h[hi]/D[hi])
+			jumps = (phi_adj[lo] - phi_adj[hi])*(phi[lo] - phi[hi])
+			dM[lo] += c**2*h[lo]/(D[lo]**2*w)*jumps
+			dM[hi] += c**2*h[hi]/(D[hi]**2*w)*jumps
+
+		# Outer boundaries
+		b = s.boundary
+		dM[0] += _boundary_derivative(D[0], hx[0], b["xmin"])*s.dy[:, None]*phi_adj[0]*phi[0]
+		dM[-1] += _boundary_derivative(D[-1], hx[-1], b["xmax"])*s.dy[:, None]*phi_adj[-1]*phi[-1]
+		dM[:, 0] += _boundary_derivative(D[:, 0], hy[:, 0], b["ymin"])*s.dx[:, None]*phi_adj[:, 0]*phi[:, 0]
+		dM[:, -1] += _boundary_derivative(D[:, -1], hy[:, -1], b["ymax"])*s.dx[:, None]*phi_adj[:, -1]*phi[:, -1]
+		return -dM/self.production
+
+	def sensitivities(self):
+		"""Relative sensitivities: the worth of a +100% change, to first order
+
+		Returns
+		-------
+		dict of numpy.ndarray
+			As derivatives(), multiplied by the cross sections
+			themselves; e.g. sensitivities()["nu-fission"].sum(axis = 2)
+			is the (nx, ny) map of fission worth
+
+		"""
+		return {key: derivative*_dense(self.arrays[key])
+		        for key, derivative in self.derivatives().items()}
+
+	def delta_rho(self, changes):
+		"""First-order worth of cross section changes
+
+		Parameters
+		----------
+		changes : dict of numpy.ndarray
+			{array name: change}, each with the shape of the array, or
+			with leading axes for a batch of perturbations evaluated at
+			once, e.g. (number of cases, nx, ny, G). Scattering changes
+			may be BandedScatter.
+
+		Returns
+		-------
+		float or numpy.ndarray
+			Reactivity worth, one per case of the batch
+
+		"""
+		derivatives = self.derivatives()
+		total = 0.0
+		for key, change in changes.items():
+			if key not in derivatives:
+				raise ValueError("No sensitivity to '{}'; expected one of {}".format(
+					key, ", ".join(sorted(derivatives))))
+			derivative = derivatives[key]
+			change = _dense(change)
+			axes = tuple(range(change.ndim - derivative.ndim, change.ndim))
+			total = total + (change*derivative).sum(axis = axes)
+		return total
+
+	def delta_k(self, changes):
+		"""Perturbed keff minus the reference keff, from delta_rho()"""
+		return self.reactivity_to_keff(self.delta_rho(changes)) - self.keff
+
+
+if __name__ == "__main__":
+	from time import time
+	import openmc
+	import mesh_arrays
+	from build_mesh import mesh, xs_mesh, STATEPOINT, MESH_XS_MODE, MESH_XS_FILE
+
+	sp = openmc.StatePoint(STATEPOINT)
+	if MESH_XS_MODE == "material":
+		arrays = mesh_arrays.load_arrays(MESH_XS_FILE)
+	else:
+		mesh_lib = mesh_arrays.load_mesh_library(sp, mesh)
+		arrays = mesh_arrays.get_mesh_arrays(mesh_lib, mesh, target = xs_mesh)
+
+	t0 = time()
+	x_grid, y_grid = mesh_arrays.mesh_grids(xs_mesh)
+	theory = PerturbationTheory(arrays, numpy.diff(x_grid), numpy.diff(y_grid))
+	maps = theory.sensitivities()
+	print('Diffusion keff: {:1.6f}; forward and adjoint in {:.2f} s'.format(theory.keff, time() - t0))
+	for key, values in sorted(maps.items()):
+		cell_map = values.reshape(values.shape[:2] + (-1,)).sum(axis = 2)
+		i, j = numpy.unravel_index(numpy.abs(cell_map).argmax(), cell_map.shape)
+		print('{:<11} total {:8.0f} pcm; largest {:6.0f} pcm in cell ({}, {})'.format(
+			key, cell_map.sum()*PCM, cell_map[i, j]*PCM, i, j))
+		numpy.savetxt("moc_data/sensitivity_" + key, cell_map)
@@ -0,0 +1,338 @@
+# Pipeline
+#
+# A small declarative pipeline: each Stage declares the stages it needs,
+# the input files it reads, the configuration keys it depends on and the
+# files it writes. Its result is cached under a hash of all of those and
+# of the source code it runs: the stage function, the functions of its
+# own module that it calls, and every local module it imports, directly
+# or through them. Only the stages whose inputs changed run again, and
+# stages that do not depend on each other run in parallel.
+
+import os
+import ast
+import json
+import time
+import pickle
+import inspect
+import textwrap
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+CACHE_DIRECTORY = ".pipeline_cache"
+
+# (path, mtime_ns, size) -> content hash, so unchanged files are hashed once
+_file_hashes = {}
+
+
+def file_hash(path):
+	"""SHA-1 of a file's content, or None if it does not exist"""
+	if not os.path.exists(path):
+		return None
+	stat = os.stat(path)
+	key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+	if key not in _file_hashes:
+		digest = hashlib.sha1()
+		with open(path, "rb") as f:
+			for block in iter(lambda: f.read(1 << 20), b""):
+				digest.update(block)
+		_file_hashes[key] = digest.hexdigest()
+	return _file_hashes[key]
+
+
+def _imports_and_names(tree):
+	"""Modules imported and global names used in a syntax tree"""
+	modules = set()
+	names = set()
+	for node in ast.walk(tree):
+		if isinstance(node, ast.Import):
+			modules.update(alias.name for alias in node.names)
+		elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+			modules.add(node.module)
+		elif isinstance(node, ast.Name):
+			names.add(node.id)
+	return modules, names
+
+
+def _module_file(name, directory):
+	"""Source file of a module in `directory`, or None if it is not a local module"""
+	base = os.path.join(directory, *name.split("."))
+	for path in (base + ".py", os.path.join(base, "__init__.py")):
+		if os.path.isfile(path):
+			return path
+	return None
+
+
+def source_files(func):
+	"""Local source files whose changes may change what func computes
+
+	These are the functions of func's own module that it calls, directly
+	or through each other, and the modules next to it that any of them
+	imports or uses, with everything those modules import in turn.
+
+	Returns
+	-------
+	functions : list of function
+		func and the functions of its module that it calls
+	files : list of str
+		Source files of the other local modules
+
+	"""
+	directory = os.path.dirname(os.path.abspath(inspect.getsourcefile(func)))
+	functions = []
+	modules = set()
+	todo = [func]
+	while todo:
+		f = todo.pop()
+		if f in functions:
+			continue
+		functions.append(f)
+		imported, names = _imports_and_names(ast.parse(textwrap.dedent(inspect.getsource(f))))
+		modules.update(imported)
+		for name in names:
+			value = f.__globals__.get(name)
+			if inspect.isfunction(value) and value.__module__ == func.__module__:
+				todo.append(value)
+			elif inspect.ismodule(value):
+				modules.add(value.__name__)
+			elif value is not None and getattr(value, "__module__", None):
+				modules.add(value.__module__)
+	own = os.path.abspath(inspect.getsourcefile(func))
+	files = []
+	todo = [path for path in (_module_file(m, directory) for m in modules) if path]
+	while todo:
+		path = todo.pop()
+		if path in files or path == own:
+			continue
+		files.append(path)
+		with open(path) as f:
+			imported, _ = _imports_and_names(ast.parse(f.read(), path))
+		todo.extend(path for path in (_module_file(m, directory) for m in imported) if path)
+	return functions, sorted(files)
+
+
+def _source_hash(func):
+	digest = hashlib.sha1()
+	try:
+		functions, files = source_files(func)
+	except (OSError, TypeError):
+		digest.update((func.__module__ + "." + func.__qualname__).encode())
+		return digest.hexdigest()
+	for f in sorted(functions, key = lambda f: f.__qualname__):
+		digest.update(inspect.getsource(f).encode())
+	for path in files:
+		digest.update("{}:{}".format(os.path.basename(path), file_hash(path)).encode())
+	return digest.hexdigest()
+
+
+class Stage(object):
+	"""One step of a Pipeline
+
+	Parameters
+	----------
+	name : str
+	func : function
+		func(config, inputs) -> result, where `inputs` maps the name of
+		each required stage to its result. The result must be picklable.
+	requires : iterable of str, optional
+		Names of the stages whose results this one needs
+	files : iterable of str or function, optional
+		Input files; a function of the config returns a list of paths
+	config_keys : iterable of str, optional
+		Configuration entries that affect the result
+	outputs : iterable of str or function, optional
+		Files written by the stage; the cache is stale if any of them
+		is missing or has been modified since
+
+	"""
+	def __init__(self, name, func, requires = (), files = (), config_keys = (), outputs = ()):
+		self.name = name
+		self.func = func
+		self.requires = tuple(requires)
+		self.files = files
+		self.config_keys = tuple(config_keys)
+		self.outputs = outputs
+
+	def _paths(self, spec, config):
+		return list(spec(config)) if callable(spec) else list(spec)
+
+	def input_files(self, config):
+		return self._paths(self.files, config)
+
+	def output_files(self, config):
+		return self._paths(self.outputs, config)
+
+	def key(self, config, upstream_keys):
+		"""Hash of everything the result depends on"""
+		missing = [k for k in self.config_keys if k not in config]
+		if missing:
+			raise KeyError("Stage {} needs config {}".format(self.name, missing))
+		content = {"name": self.name,
+		           "source": _source_hash(self.func),
+		           "config": {k: config[k] for k in self.config_keys},
+		           "files": {path: file_hash(path) for path in self.input_files(config)},
+		           "upstream": [upstream_keys[r] for r in self.requires]}
+		text = json.dumps(content, sort_keys = True, default = repr)
+		return hashlib.sha1(text.encode()).hexdigest()
+
+	def __repr__(self):
+		return "Stage({})".format(self.name)
+
+
+class Pipeline(object):
+	"""Stages run in dependency order, cached by content hash
+
+	Parameters
+	----------
+	stages : iterable of Stage
+	cache_directory : str, optional
+		[Default: CACHE_DIRECTORY]
+
+	"""
+	def __init__(self, stages, cache_directory = CACHE_DIRECTORY):
+		self.stages = OrderedDict((stage.name, stage) for stage in stages)
+		self.cache_directory = cache_directory
+		for stage in self.stages.values():
+			for name in stage.requires:
+				if name not in self.stages:
+					raise ValueError("Stage {} requires unknown stage {}".format(stage.name, name))
+		self._check_acyclic()
+
+	def _check_acyclic(self):
+		state = {}
+
+		def visit(name, path):
+			if state.get(name) == "done":
+				return
+			if state.get(name) == "visiting":
+				raise ValueError("Cycle in the pipeline: " + " -> ".join(path + [name]))
+			state[name] = "visiting"
+			for r in self.stages[name].requires:
+				visit(r, path + [name])
+			state[name] = "done"
+
+		for name in self.stages:
+			visit(name, [])
+
+	def upstream(self, targets):
+		"""The targets and every stage they depend on"""
+		needed = set()
+		todo = list(targets)
+		while todo:
+			name = todo.pop()
+			if name not in needed:
+				needed.add(name)
+				todo.extend(self.stages[name].requires)
+		return [name for name in self.stages if name in needed]
+
+	def _record_path(self, name):
+		return os.path.join(self.cache_directory, name + ".json")
+
+	def _result_path(self, name, key):
+		return os.path.join(self.cache_directory, "{}-{}.pkl".format(name, key))
+
+	def _load_cached(self, stage, key, config):
+		record_path = self._record_path(stage.name)
+		if not os.path.exists(record_path):
+			return False, None
+		with open(record_path) as f:
+			record = json.load(f)
+		if record.get("key") != key:
+			return False, None
+		for path, digest in record.get("outputs", {}).items():
+			if file_hash(path) != digest:
+				return False, None
+		result_path = self._result_path(stage.name, key)
+		if not os.path.exists(result_path):
+			return False, None
+		with open(result_path, "rb") as f:
+			return True, pickle.load(f)
+
+	def _store(self, stage, key, config, result):
+		os.makedirs(self.cache_directory, exist_ok = True)
+		old = self._record_path(stage.name)
+		if os.path.exists(old):
+			with open(old) as f:
+				old_key = json.load(f).get("key")
+			if old_key and old_key != key and os.path.exists(self._result_path(stage.name, old_key)):
+				os.remove(self._result_path(stage.name, old_key))
+		with open(self._result_path(stage.name, key), "wb") as f:
+			pickle.dump(result, f)
+		outputs = {path: file_hash(path) for path in stage.output_files(config)}
+		missing = [path for path, digest in outputs.items() if digest is None]
+		if missing:
+			raise IOError("Stage {} did not write {}".format(stage.name, missing))
+		with open(self._record_path(stage.name), "w") as f:
+			json.dump({"key": key, "outputs": outputs}, f, indent = 1)
+
+	def invalidate(self, names = None):
+		"""Forget the cached results of some (or all) stages"""
+		for name in (self.stages if names is None else names):
+			if os.path.exists(self._record_path(name)):
+				os.remove(self._record_path(name))
+
+	def run(self, config, targets = None, force = (), max_workers = None, verbose = True):
+		"""Bring the targets up to date
+
+		Parameters
+		----------
+		config : dict
+		targets : iterable of str, optional
+			Stages wanted [Default: all of them]
+		force : iterable of str, optional
+			Stages to re-run even if their cache is valid
+		max_workers : int, optional
+			Stages that may run at once [Default: number of stages]
+		verbose : bool, optional
+			Print what is cached and what ran [Default: True]
+
+		Returns
+		-------
+		results : OrderedDict
+			{stage name: result}
+		report : OrderedDict
+			{stage name: ("cached" or "ran", seconds)}
+
+		"""
+		order = self.upstream(self.stages if targets is None else targets)
+		force = set(force)
+		keys = {}
+		results = OrderedDict()
+		report = OrderedDict()
+		running = {}
+
+		def execute(stage, key, inputs):
+			start = time.time()
+			result = stage.func(config, inputs)
+			self._store(stage, key, config, result)
+			return result, time.time() - start
+
+		with ThreadPoolExecutor(max_workers or len(order) or 1) as pool:
+			remaining = list(order)
+			while remaining or running:
+				for name in list(remaining):
+					stage = self.stages[name]
+					if not all(r in results for r in stage.requires):
+						continue
+					remaining.remove(name)
+					keys[name] = stage.key(config, keys)
+					cached, result = (False, None) if name in force else \
+						self._load_cached(stage, keys[name], config)
+					if cached:
+						results[name] = result
+						report[name] = ("cached", 0.0)
+						if verbose:
+							print("[cached] " + name)
+						continue
+					inputs = {r: results[r] for r in stage.requires}
+					running[pool.submit(execute, stage, keys[name], inputs)] = name
+				if not running:
+					continue
+				done, _ = wait(list(running), return_when = FIRST_COMPLETED)
+				for future in done:
+					name = running.pop(future)
+					results[name], seconds = future.result()
+					report[name] = ("ran", seconds)
+					if verbose:
+						print("[ran]    {} ({:.1f} s)".format(name, seconds))
+		return OrderedDict((name, results[name]) for name in order), report
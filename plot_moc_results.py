@@ -1,22 +1,15 @@
 import pylab
+import compare_results
 
 
 def plot_reaction_rates(eps = 1E-6):
-	moc_fission_rates = pylab.loadtxt("moc_data/moc_fission_rates")
-	fission_rates = pylab.loadtxt("moc_data/montecarlo_fission_rates")
-	
-	# Filter out values that are essentially zero
-	# Objective: Ignore zero fission rates in guide tubes with Matplotlib color scheme
-	indices = fission_rates <= eps
-	fission_rates[indices] = pylab.NaN
-	moc_fission_rates[indices] = pylab.NaN
-	
-	# Normalize with the nanmean function, which excludes NaNs from the mean
-	fission_rates /= pylab.nanmean(fission_rates)
-	moc_fission_rates /= pylab.nanmean(moc_fission_rates)
-	# Then use these normalized arrays to calculate the relative error
-	errors = pylab.divide(moc_fission_rates - fission_rates, fission_rates/100.0)
-	errors[indices] = pylab.NaN
+	# Values that are essentially zero come back as NaN, so that zero fission
+	# rates in guide tubes are ignored by the Matplotlib color scheme.
+	# The files are only reloaded (and the errors recomputed) when they change.
+	result = compare_results.compare_files(eps = eps)
+	fission_rates = result.mc
+	moc_fission_rates = result.moc
+	errors = result.pct_error
 	
 	pylab.figure()
 	# Plot OpenMC's fission rates in the left subplot
@@ -37,6 +30,14 @@ def plot_reaction_rates(eps = 1E-6):
 	pylab.title('Percent error')
 	pylab.colorbar(pct)
 	
+	if result.zscore is not None:
+		# Error in units of the Monte Carlo standard deviation
+		fig4 = pylab.subplot(224)
+		zsc = pylab.imshow(result.zscore.squeeze(), interpolation = 'none', cmap = 'jet')
+		pylab.clim(-5, 5)
+		pylab.title('MC z-score')
+		pylab.colorbar(zsc)
+	
 	pylab.tight_layout()
 	pylab.show()
 	
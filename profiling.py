@@ -0,0 +1,235 @@
+# Profiling
+#
+# Lightweight spans for finding where the time goes in the scripts of
+# this project. Set the SPAM_PROFILE environment variable to turn them
+# on: each span records its wall time, CPU time and memory use. The
+# memory is the resident set size (RSS) at the start and end of the span,
+# its peak during the span, sampled every SAMPLE_INTERVAL by a background
+# thread, and how much the span raised the peak RSS of the process
+# (ru_maxrss), which attributes each new high-water mark to the span that
+# set it. A summary table is printed at exit and a trace is written in the
+# Chrome/Perfetto JSON format (to the file named by SPAM_PROFILE, or to
+# PROFILE_TRACE if it is just "1").
+# With SPAM_PROFILE unset, span() and timed() do next to nothing.
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+from collections import OrderedDict
+try:
+	import resource
+except ImportError:  # Windows
+	resource = None
+
+ENVIRONMENT_VARIABLE = "SPAM_PROFILE"
+PROFILE_TRACE = "profile_trace.json"
+SAMPLE_INTERVAL = 0.01  # s
+
+_setting = os.environ.get(ENVIRONMENT_VARIABLE, "")
+ENABLED = _setting not in ("", "0")
+TRACE_FILE = _setting if ENABLED and _setting != "1" else PROFILE_TRACE
+
+_records = []
+_local = threading.local()
+_start = time.perf_counter()
+# Open spans of every thread, whose peaks the sampler updates
+_active = set()
+_lock = threading.Lock()
+_sampler = None
+
+
+def process_peak_rss_mb():
+	"""Peak resident set size of this process so far, MB
+
+	ru_maxrss is the high-water mark since the process started, so it
+	does not go down when memory is freed.
+
+	"""
+	if resource is None:
+		return float("nan")
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# kilobytes on Linux, bytes on macOS
+	return peak/(1024.0**2 if sys.platform == "darwin" else 1024.0)
+
+
+def rss_mb():
+	"""Current resident set size of this process, MB
+
+	Read from /proc/self/statm where there is one; elsewhere this falls
+	back to process_peak_rss_mb().
+
+	"""
+	try:
+		with open("/proc/self/statm") as f:
+			pages = int(f.read().split()[1])
+	except (OSError, IndexError, ValueError):
+		return process_peak_rss_mb()
+	return pages*os.sysconf("SC_PAGE_SIZE")/1024.0**2
+
+
+def _sample():
+	while True:
+		time.sleep(SAMPLE_INTERVAL)
+		rss = rss_mb()
+		with _lock:
+			for open_span in _active:
+				open_span.peak = max(open_span.peak, rss)
+
+
+def _start_sampler():
+	global _sampler
+	with _lock:
+		if _sampler is None:
+			_sampler = threading.Thread(target = _sample, name = "profiling sampler", daemon = True)
+			_sampler.start()
+
+
+class _NullSpan(object):
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+	def __init__(self, name, args):
+		self.name = name
+		self.args = args
+
+	def __enter__(self):
+		stack = getattr(_local, "stack", None)
+		if stack is None:
+			stack = _local.stack = []
+		self.parent = stack[-1].name if stack else None
+		self.depth = len(stack)
+		stack.append(self)
+		_start_sampler()
+		self.rss = rss_mb()
+		self.process_peak = process_peak_rss_mb()
+		with _lock:
+			self.peak = self.rss
+			_active.add(self)
+		self.wall = time.perf_counter()
+		self.cpu = time.process_time()
+		return self
+
+	def __exit__(self, *exc):
+		wall = time.perf_counter() - self.wall
+		cpu = time.process_time() - self.cpu
+		rss = rss_mb()
+		process_peak = process_peak_rss_mb()
+		with _lock:
+			_active.discard(self)
+			peak = max(self.peak, rss)
+		_local.stack.pop()
+		_records.append({"name": self.name, "parent": self.parent, "depth": self.depth,
+		                 "start": self.wall - _start, "wall": wall, "cpu": cpu,
+		                 "rss_start_mb": self.rss, "rss_end_mb": rss, "peak_rss_mb": peak,
+		                 "peak_growth_mb": process_peak - self.process_peak,
+		                 "process_peak_rss_mb": process_peak, "thread": threading.get_ident(),
+		                 "args": self.args})
+		return False
+
+
+def span(name, **args):
+	"""Context manager timing the enclosed block as stage `name`"""
+	if not ENABLED:
+		return _NULL_SPAN
+	return _Span(name, args)
+
+
+def timed(name = None):
+	"""Decorator timing every call of a function
+
+	Usable as @timed or @timed("stage name"). When profiling is off the
+	function is returned unwrapped.
+
+	"""
+	def decorate(func):
+		if not ENABLED:
+			return func
+		label = name or func.__module__ + "." + func.__qualname__
+
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			with _Span(label, {}):
+				return func(*args, **kwargs)
+		return wrapper
+
+	if callable(name):
+		func, name = name, None
+		return decorate(func)
+	return decorate
+
+
+def records():
+	"""The spans recorded so far, in order of completion"""
+	return list(_records)
+
+
+def summarize(spans = None):
+	"""Totals for each span name: calls, wall and CPU time, and memory
+
+	"peak_rss_mb" is the largest RSS seen during any call, "rss_change_mb"
+	the total change of RSS from start to end, and "peak_growth_mb" the
+	total by which the calls raised the peak RSS of the process.
+
+	"""
+	table = OrderedDict()
+	for rec in sorted(spans if spans is not None else _records, key = lambda r: r["start"]):
+		row = table.setdefault(rec["name"], {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak_rss_mb": 0.0,
+		                                     "rss_change_mb": 0.0, "peak_growth_mb": 0.0,
+		                                     "depth": rec["depth"]})
+		row["calls"] += 1
+		row["wall"] += rec["wall"]
+		row["cpu"] += rec["cpu"]
+		row["peak_rss_mb"] = max(row["peak_rss_mb"], rec["peak_rss_mb"])
+		row["rss_change_mb"] += rec["rss_end_mb"] - rec["rss_start_mb"]
+		row["peak_growth_mb"] += rec["peak_growth_mb"]
+	return table
+
+
+def format_summary(table = None):
+	if table is None:
+		table = summarize()
+	width = max([len("  "*row["depth"] + name) for name, row in table.items()] + [5])
+	lines = ["{:<{w}}  {:>6}  {:>10}  {:>10}  {:>10}  {:>12}  {:>12}".format(
+		"Stage", "Calls", "Wall (s)", "CPU (s)", "Peak (MB)", "Change (MB)", "Raised (MB)", w = width)]
+	for name, row in table.items():
+		lines.append("{:<{w}}  {:>6d}  {:>10.3f}  {:>10.3f}  {:>10.1f}  {:>+12.1f}  {:>12.1f}".format(
+			"  "*row["depth"] + name, row["calls"], row["wall"], row["cpu"], row["peak_rss_mb"],
+			row["rss_change_mb"], row["peak_growth_mb"], w = width))
+	return "\n".join(lines)
+
+
+def write_trace(filename = None):
+	"""Write the spans as Chrome trace events (open in chrome://tracing or Perfetto)"""
+	if filename is None:
+		filename = TRACE_FILE
+	pid = os.getpid()
+	memory = ("rss_start_mb", "rss_end_mb", "peak_rss_mb", "peak_growth_mb", "process_peak_rss_mb")
+	events = [{"name": rec["name"], "ph": "X", "pid": pid, "tid": rec["thread"],
+	           "ts": rec["start"]*1E6, "dur": rec["wall"]*1E6,
+	           "args": dict(rec["args"], cpu_s = rec["cpu"], **{key: rec[key] for key in memory})}
+	          for rec in _records]
+	with open(filename, "w") as f:
+		json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default = str)
+	return filename
+
+
+def _report():
+	if _records:
+		print("\n" + format_summary())
+		print("Profile trace written to", write_trace())
+
+
+if ENABLED:
+	atexit.register(_report)
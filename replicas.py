@@ -0,0 +1,250 @@
+# Replicas
+#
+# Run N independent OpenMC replicas of one model with distinct seeds, as
+# local processes or as a SLURM job array, and merge their statepoints.
+# Tally sums, sums of squares and realization counts simply add up across
+# independent replicas; the eigenvalues are combined by inverse-variance
+# weighting. The merged object is an openmc.StatePoint, so it can be
+# handed to mgxs.Library.load_from_statepoint() as in build_mesh.py.
+
+import os
+import glob
+import shutil
+import subprocess
+import numpy
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+import openmc
+
+SOURCE = "treat2d/"
+DESTINATION = "treat2d/replicas/"
+NUM_REPLICAS = 4
+FIRST_SEED = 1
+THREADS = 1
+OPENMC = "openmc"
+INPUT_FILES = ("geometry.xml", "materials.xml", "settings.xml", "tallies.xml", "plots.xml")
+
+
+def _set_text(root, tag, value):
+	element = root.find(tag)
+	if element is None:
+		element = ET.SubElement(root, tag)
+	element.text = str(value)
+	return element
+
+
+def prepare_replicas(source = SOURCE, destination = DESTINATION, num_replicas = NUM_REPLICAS,
+                     first_seed = FIRST_SEED, split_particles = False):
+	"""Copy a model's input files into one directory per replica
+
+	Parameters
+	----------
+	source : str, optional
+		Directory with the XML input files [Default: SOURCE]
+	destination : str, optional
+		Parent directory of the replica directories [Default: DESTINATION]
+	num_replicas : int, optional
+		[Default: NUM_REPLICAS]
+	first_seed : int, optional
+		Seed of replica 0; replica i gets first_seed + i [Default: FIRST_SEED]
+	split_particles : bool, optional
+		Divide the particles per batch among the replicas, so that all
+		of them together do the work of the original run; otherwise each
+		replica runs the full settings.xml [Default: False]
+
+	Returns
+	-------
+	directories : list of str
+
+	"""
+	assert num_replicas >= 1, "num_replicas must be at least 1"
+	directories = []
+	for i in range(num_replicas):
+		directory = os.path.join(destination, "replica_{:03d}".format(i))
+		os.makedirs(directory, exist_ok = True)
+		for filename in INPUT_FILES:
+			path = os.path.join(source, filename)
+			if os.path.exists(path) and filename != "settings.xml":
+				shutil.copy(path, directory)
+		tree = ET.parse(os.path.join(source, "settings.xml"))
+		root = tree.getroot()
+		_set_text(root, "seed", first_seed + i)
+		if split_particles:
+			particles = root.find("particles")
+			total = int(float(particles.text))
+			particles.text = str(total//num_replicas + (1 if i < total % num_replicas else 0))
+		tree.write(os.path.join(directory, "settings.xml"))
+		directories.append(directory)
+	return directories
+
+
+def run_replicas(directories, processes = None, threads = THREADS, executable = OPENMC):
+	"""Run OpenMC in each replica directory, a few at a time
+
+	Parameters
+	----------
+	directories : list of str
+	processes : int, optional
+		Replicas to run at once [Default: os.cpu_count()//threads]
+	threads : int, optional
+		OpenMP threads per replica [Default: THREADS]
+	executable : str, optional
+		[Default: OPENMC]
+
+	Returns
+	-------
+	returncodes : list of int
+
+	"""
+	if processes is None:
+		processes = max(1, (os.cpu_count() or 1)//threads)
+
+	def run(directory):
+		with open(os.path.join(directory, "openmc.log"), "w") as log:
+			return subprocess.call([executable, "-s", str(threads)], cwd = directory,
+			                       stdout = log, stderr = subprocess.STDOUT)
+
+	with ThreadPoolExecutor(processes) as pool:
+		return list(pool.map(run, directories))
+
+
+def write_job_array(directories, filename = "replicas.sh", threads = THREADS,
+                    executable = OPENMC, job_name = "openmc-replicas", time = "24:00:00"):
+	"""Write a SLURM job array script with one task per replica
+
+	Submit it with `sbatch replicas.sh`, then merge the results with
+	merge_statepoints(find_statepoints(directories)).
+
+	"""
+	lines = ["#!/bin/bash",
+	         "#SBATCH --job-name={}".format(job_name),
+	         "#SBATCH --array=0-{}".format(len(directories) - 1),
+	         "#SBATCH --cpus-per-task={}".format(threads),
+	         "#SBATCH --time={}".format(time),
+	         "",
+	         "DIRECTORIES=({})".format(" ".join(os.path.abspath(d) for d in directories)),
+	         'cd "${DIRECTORIES[$SLURM_ARRAY_TASK_ID]}" || exit 1',
+	         "{} -s {} > openmc.log 2>&1".format(executable, threads),
+	         ""]
+	with open(filename, "w") as script:
+		script.write("\n".join(lines))
+	return filename
+
+
+def find_statepoints(directories, batch = None):
+	"""Return the statepoint of each replica: the last one, or that of `batch`"""
+	statepoints = []
+	for directory in directories:
+		if batch is not None:
+			statepoints.append(os.path.join(directory, "statepoint.{}.h5".format(batch)))
+			continue
+		found = glob.glob(os.path.join(directory, "statepoint.*.h5"))
+		if not found:
+			raise IOError("No statepoint in " + directory)
+		statepoints.append(max(found, key = lambda f: int(f.split(".")[-2])))
+	return statepoints
+
+
+def combine_estimates(means, std_devs):
+	"""Inverse-variance weighted mean of independent estimates
+
+	Returns
+	-------
+	mean, std_dev : float
+
+	"""
+	means = numpy.asarray(means, dtype = float)
+	variances = numpy.asarray(std_devs, dtype = float)**2
+	if (variances <= 0).any():
+		# Without uncertainties, fall back on the plain average
+		return means.mean(), means.std(ddof = 1)/numpy.sqrt(len(means)) if len(means) > 1 else 0.0
+	weights = 1.0/variances
+	return (weights*means).sum()/weights.sum(), 1.0/numpy.sqrt(weights.sum())
+
+
+def merge_sums(sums, sums_sq, realizations):
+	"""Pool the realizations of independent tallies
+
+	Returns
+	-------
+	total, total_sq : numpy.ndarray
+		Summed tally sums and sums of squares
+	n : int
+		Total number of realizations
+	mean, std_dev : numpy.ndarray
+		Mean and standard deviation of the mean over all realizations
+
+	"""
+	total = numpy.sum(sums, axis = 0)
+	total_sq = numpy.sum(sums_sq, axis = 0)
+	n = int(sum(realizations))
+	mean = total/n
+	if n > 1:
+		std_dev = numpy.sqrt(numpy.maximum(total_sq/n - mean**2, 0.0)/(n - 1))
+	else:
+		std_dev = numpy.zeros_like(mean)
+	return total, total_sq, n, mean, std_dev
+
+
+class MergedStatePoint(openmc.StatePoint):
+	"""The first replica's statepoint, with every replica's tallies merged in
+
+	Parameters
+	----------
+	filenames : list of str
+		Statepoints of independent replicas of the same model
+	autolink : bool, optional
+		Link the summary.h5 next to the first statepoint [Default: True]
+
+	"""
+	def __init__(self, filenames, autolink = True):
+		super().__init__(filenames[0], autolink = autolink)
+		self.filenames = list(filenames)
+		others = [openmc.StatePoint(f, autolink = False) for f in self.filenames[1:]]
+		statepoints = [self] + others
+
+		keff = [sp.k_combined for sp in statepoints]
+		self._merged_k = combine_estimates([k[0] for k in keff], [k[1] for k in keff])
+		self._merged_realizations = sum(sp.n_realizations for sp in statepoints)
+
+		for tally_id, tally in self.tallies.items():
+			replicas = [tally] + [sp.tallies[tally_id] for sp in others]
+			shapes = set(t.sum.shape for t in replicas)
+			if len(shapes) != 1:
+				raise ValueError("Tally {} differs between the replicas: {}".format(tally_id, shapes))
+			total, total_sq, n, mean, std_dev = merge_sums(
+				[t.sum for t in replicas], [t.sum_sq for t in replicas],
+				[t.num_realizations for t in replicas])
+			tally._sum = total
+			tally._sum_sq = total_sq
+			tally._mean = mean
+			tally._std_dev = std_dev
+			tally.num_realizations = n
+
+	@property
+	def k_combined(self):
+		return self._merged_k
+
+	@property
+	def n_realizations(self):
+		return self._merged_realizations
+
+	@property
+	def num_replicas(self):
+		return len(self.filenames)
+
+
+def merge_statepoints(filenames, autolink = True):
+	"""Merge the statepoints of independent replicas into one StatePoint"""
+	return MergedStatePoint(filenames, autolink)
+
+
+if __name__ == "__main__":
+	replica_dirs = prepare_replicas()
+	codes = run_replicas(replica_dirs)
+	if any(codes):
+		raise SystemExit("Replica(s) failed: {}".format(
+			[d for d, c in zip(replica_dirs, codes) if c]))
+	merged = merge_statepoints(find_statepoints(replica_dirs))
+	print("{} replicas, {} realizations".format(merged.num_replicas, merged.n_realizations))
+	print("Merged keff: {:1.6f} +/- {:1.6f}".format(*merged.k_combined))
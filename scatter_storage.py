@@ -0,0 +1,173 @@
+# Scatter storage
+#
+# Banded storage of the per-mesh-cell scattering matrices.
+# For each incoming group, only the band of outgoing groups that is
+# nonzero somewhere on the mesh is kept: above the thermal cutoff there
+# is no up-scatter, and the fastest groups barely scatter down far.
+# Every cell shares the same band, so the whole mesh is stored as one
+# (num_cells, band entries) array and the in-scatter source is a handful
+# of vectorized multiply-adds per group.
+
+import numpy
+
+
+class BandedScatter(object):
+	"""Scattering matrices of every mesh cell, stored by group band
+
+	Parameters
+	----------
+	shape : tuple of int
+		Mesh shape, e.g. (nx, ny)
+	num_groups : int
+	lower, upper : numpy.ndarray of int
+		For each incoming group, the first and last outgoing group kept
+		(upper < lower for a group that never scatters)
+	data : numpy.ndarray
+		(num_cells, total band width): the bands of every incoming group,
+		one after another
+
+	Attributes
+	----------
+	offsets : numpy.ndarray of int
+		Start of each incoming group's band in the columns of `data`
+
+	"""
+	def __init__(self, shape, num_groups, lower, upper, data):
+		self.shape = tuple(shape)
+		self.num_groups = num_groups
+		self.lower = numpy.asarray(lower, dtype = int)
+		self.upper = numpy.asarray(upper, dtype = int)
+		widths = numpy.maximum(self.upper - self.lower + 1, 0)
+		self.offsets = numpy.concatenate(([0], numpy.cumsum(widths)))
+		self.data = numpy.asarray(data, dtype = float).reshape(-1, self.offsets[-1])
+
+	@classmethod
+	def from_dense(cls, matrices, tolerance = 0.0):
+		"""Detect the bands of dense matrices and store them
+
+		Parameters
+		----------
+		matrices : numpy.ndarray
+			(..., G in, G out) scattering matrices, e.g. (nx, ny, G, G)
+		tolerance : float, optional
+			Entries whose magnitude never exceeds this are dropped
+			[Default: 0.0]
+
+		Returns
+		-------
+		BandedScatter
+
+		"""
+		matrices = numpy.asarray(matrices, dtype = float)
+		G = matrices.shape[-1]
+		shape = matrices.shape[:-2]
+		flat = matrices.reshape(-1, G, G)
+		present = (numpy.abs(flat) > tolerance).any(axis = 0)
+		lower = numpy.empty(G, dtype = int)
+		upper = numpy.empty(G, dtype = int)
+		for g in range(G):
+			nonzero = numpy.flatnonzero(present[g])
+			if len(nonzero):
+				lower[g], upper[g] = nonzero[0], nonzero[-1]
+			else:
+				lower[g], upper[g] = 0, -1
+		data = numpy.concatenate([flat[:, g, lower[g]:upper[g] + 1] for g in range(G)], axis = 1)
+		return cls(shape, G, lower, upper, data)
+
+	@property
+	def num_cells(self):
+		return self.data.shape[0]
+
+	@property
+	def nbytes(self):
+		return self.data.nbytes + self.lower.nbytes + self.upper.nbytes + self.offsets.nbytes
+
+	@property
+	def density(self):
+		"""Fraction of the dense G x G entries that are stored"""
+		return self.offsets[-1]/float(self.num_groups**2)
+
+	def band(self, g):
+		"""Return the (num_cells, width) block of incoming group g"""
+		return self.data[:, self.offsets[g]:self.offsets[g + 1]]
+
+	def to_dense(self):
+		"""Return the full (..., G in, G out) array"""
+		G = self.num_groups
+		dense = numpy.zeros((self.num_cells, G, G))
+		for g in range(G):
+			dense[:, g, self.lower[g]:self.upper[g] + 1] = self.band(g)
+		return dense.reshape(self.shape + (G, G))
+
+	def cell_matrix(self, index):
+		"""Return the dense (G in, G out) matrix of one cell
+
+		Parameters
+		----------
+		index : int or tuple of int
+			Flat cell index, or mesh indices such as (i, j)
+
+		"""
+		if not numpy.isscalar(index):
+			index = numpy.ravel_multi_index(tuple(index), self.shape)
+		G = self.num_groups
+		matrix = numpy.zeros((G, G))
+		row = self.data[index]
+		for g in range(G):
+			matrix[g, self.lower[g]:self.upper[g] + 1] = row[self.offsets[g]:self.offsets[g + 1]]
+		return matrix
+
+	def out_scatter(self):
+		"""Total scattering out of each group: (..., G)"""
+		totals = numpy.zeros((self.num_cells, self.num_groups))
+		for g in range(self.num_groups):
+			totals[:, g] = self.band(g).sum(axis = 1)
+		return totals.reshape(self.shape + (self.num_groups,))
+
+	def source(self, flux):
+		"""In-scatter source of every cell and outgoing group
+
+		Parameters
+		----------
+		flux : numpy.ndarray
+			(..., G) scalar flux on the mesh
+
+		Returns
+		-------
+		source : numpy.ndarray
+			(..., G): sum over g_in of S[g_in, g_out]*flux[g_in]
+
+		"""
+		flux = numpy.asarray(flux, dtype = float).reshape(self.num_cells, self.num_groups)
+		source = numpy.zeros_like(flux)
+		for g in range(self.num_groups):
+			if self.upper[g] >= self.lower[g]:
+				source[:, self.lower[g]:self.upper[g] + 1] += self.band(g)*flux[:, g, None]
+		return source.reshape(self.shape + (self.num_groups,))
+
+	def coo_entries(self):
+		"""(cell, group in, group out, value) of every stored entry"""
+		G = self.num_groups
+		gin = numpy.repeat(numpy.arange(G), self.offsets[1:] - self.offsets[:-1])
+		gout = numpy.concatenate([numpy.arange(self.lower[g], self.upper[g] + 1) for g in range(G)]
+		                         or [numpy.zeros(0, dtype = int)])
+		cell = numpy.repeat(numpy.arange(self.num_cells), len(gin))
+		return cell, numpy.tile(gin, self.num_cells), numpy.tile(gout, self.num_cells), self.data.ravel()
+
+	def to_arrays(self, prefix = "nu-scatter"):
+		"""Return a dictionary of arrays for mesh_arrays.save_arrays()"""
+		return {prefix + "_shape": numpy.array(self.shape + (self.num_groups,)),
+		        prefix + "_lower": self.lower,
+		        prefix + "_upper": self.upper,
+		        prefix + "_data": self.data}
+
+	@classmethod
+	def from_arrays(cls, arrays, prefix = "nu-scatter"):
+		"""Rebuild a BandedScatter from the output of to_arrays()"""
+		shape = tuple(int(n) for n in arrays[prefix + "_shape"])
+		return cls(shape[:-1], shape[-1], arrays[prefix + "_lower"], arrays[prefix + "_upper"],
+		           arrays[prefix + "_data"])
+
+	def __repr__(self):
+		return "BandedScatter(shape={}, groups={}, density={:.2f})".format(
+			self.shape, self.num_groups, self.density)
@@ -1,19 +1,8 @@
 import openmc
 import openmc.mgxs as mgxs
 import numpy as np
-import copy
-
-
-def duplicate(universe):
-	cell_copy = copy.deepcopy(universe)
-	cell_copy.id = None
-	old_cells = copy.deepcopy(cell_copy.cells)
-	cell_copy._cells.clear()
-	for cell_id in old_cells:
-		new_cell = copy.deepcopy(old_cells[cell_id])
-		new_cell.id = None
-		cell_copy.add_cell(new_cell)
-	return cell_copy
+import sys; sys.path.append("..")
+from lattice_clone import clone_lattice
 
 
 ###############################################################################
@@ -113,8 +102,8 @@ lattice.universes = [[univ1, univ2, univ1, univ2],
                      [univ1, univ2, univ1, univ2],
                      [univ2, univ3, univ2, univ3]]
 
-for i in lattice.indices:
-	lattice.universes[i] = duplicate(lattice.universes[i])
+# Unique cells at every position, sharing surfaces and materials
+clone_lattice(lattice)
 
 # Fill Cell with the Lattice
 cell1.fill = lattice
@@ -1,18 +1,8 @@
 import openmc
 import openmc.mgxs as mgxs
 import numpy as np
-import copy
-
-def duplicate(universe):
-    thing2 = copy.deepcopy(universe)
-    thing2.id = None
-    old_cells = copy.deepcopy(thing2.cells)
-    thing2._cells.clear()
-    for id in old_cells:
-        new_cell = copy.deepcopy(old_cells[id])
-        new_cell.id = None
-        thing2.add_cell(new_cell)
-    return thing2
+import sys; sys.path.append("..")
+from lattice_clone import clone_lattice
 
 ###############################################################################
 #                      Simulation Input File Parameters
@@ -109,8 +99,8 @@ lattice.universes = [[univ1, univ2, univ1, univ2],
                      [univ1, univ2, univ1, univ2],
                      [univ2, univ3, univ2, univ3]]
 
-for i in lattice.indices:
-    lattice.universes[i] = duplicate(lattice.universes[i])
+# Unique cells at every position, sharing surfaces and materials
+clone_lattice(lattice)
 
 # Fill Cell with the Lattice
 cell1.fill = lattice
@@ -0,0 +1,269 @@
+# Tally planner
+#
+# Every MGXS type in an openmc.mgxs.Library brings its own tallies, even
+# though most of them share the same flux, fission and scattering scores.
+# Plan the union of the (score, filters) tallies needed by any subset of
+# stuff.ALL_LIBRARIES, merge the scores that share filters into a single
+# tally, and derive every requested cross section from those arrays.
+# Scores that OpenMC can only tally with the analog estimator get a tally
+# of their own, so that they do not force it on the others.
+
+import numpy
+from collections import OrderedDict
+from stuff import ALL_LIBRARIES
+
+# Filters besides the domain filter
+ENERGY = "energy"
+ENERGYOUT = "energyout"
+DELAYED = "delayedgroup"
+NUM_DELAYED_GROUPS = 6
+
+
+def analog_only(score):
+	"""Whether OpenMC tallies a score with the analog estimator only"""
+	return score == "nu-scatter" or score.startswith("scatter-") or score.startswith("nu-scatter-")
+
+# MGXS type -> (score, filters) it needs
+REQUIREMENTS = {
+	"total"                       : (("flux", (ENERGY,)), ("total", (ENERGY,))),
+	"transport"                   : (("flux", (ENERGY,)), ("total", (ENERGY,)),
+	                                 ("scatter-1", (ENERGY,))),
+	"nu-transport"                : (("flux", (ENERGY,)), ("total", (ENERGY,)),
+	                                 ("nu-scatter-1", (ENERGY,))),
+	"absorption"                  : (("flux", (ENERGY,)), ("absorption", (ENERGY,))),
+	"capture"                     : (("flux", (ENERGY,)), ("absorption", (ENERGY,)),
+	                                 ("fission", (ENERGY,))),
+	"fission"                     : (("flux", (ENERGY,)), ("fission", (ENERGY,))),
+	"nu-fission"                  : (("flux", (ENERGY,)), ("nu-fission", (ENERGY,))),
+	"kappa-fission"               : (("flux", (ENERGY,)), ("kappa-fission", (ENERGY,))),
+	"scatter"                     : (("flux", (ENERGY,)), ("scatter", (ENERGY,))),
+	"nu-scatter"                  : (("flux", (ENERGY,)), ("nu-scatter", (ENERGY,))),
+	"scatter matrix"              : (("flux", (ENERGY,)), ("scatter", (ENERGY, ENERGYOUT))),
+	"nu-scatter matrix"           : (("flux", (ENERGY,)), ("nu-scatter", (ENERGY, ENERGYOUT))),
+	"consistent nu-scatter matrix": (("flux", (ENERGY,)), ("scatter", (ENERGY,)),
+	                                 ("scatter", (ENERGY, ENERGYOUT)),
+	                                 ("nu-scatter", (ENERGY, ENERGYOUT))),
+	"chi"                         : (("nu-fission", (ENERGY,)), ("nu-fission", (ENERGYOUT,))),
+	"chi prompt"                  : (("prompt-nu-fission", (ENERGY,)),
+	                                 ("prompt-nu-fission", (ENERGYOUT,))),
+	"inverse-velocity"            : (("flux", (ENERGY,)), ("inverse-velocity", (ENERGY,))),
+	"prompt-nu-fission"           : (("flux", (ENERGY,)), ("prompt-nu-fission", (ENERGY,))),
+	"delayed-nu-fission"          : (("flux", (ENERGY,)), ("delayed-nu-fission", (DELAYED, ENERGY))),
+	"chi-delayed"                 : (("delayed-nu-fission", (DELAYED, ENERGY)),
+	                                 ("delayed-nu-fission", (DELAYED, ENERGYOUT))),
+	"beta"                        : (("nu-fission", (ENERGY,)),
+	                                 ("delayed-nu-fission", (DELAYED, ENERGY)))}
+
+
+def _ratio(numerator, denominator):
+	"""numerator/denominator, with 0 where the denominator is 0"""
+	numerator, denominator = numpy.broadcast_arrays(numerator, denominator)
+	return numpy.divide(numerator, denominator, out = numpy.zeros(numerator.shape),
+	                    where = denominator != 0)
+
+
+def _normalize(rates):
+	"""Divide a spectrum by its sum over the last (group) axis"""
+	return _ratio(rates, rates.sum(axis = -1, keepdims = True))
+
+
+class TallyPlan(object):
+	"""The shared tallies needed for a set of MGXS types
+
+	Parameters
+	----------
+	mgxs_types : iterable of str, optional
+		[Default: stuff.ALL_LIBRARIES]
+
+	Attributes
+	----------
+	requirements : list of tuple
+		Unique (score, filters) pairs, in order of first use
+	tallies : OrderedDict
+		{filters: [scores]}: the scores merged into each tally
+
+	"""
+	def __init__(self, mgxs_types = ALL_LIBRARIES):
+		self.mgxs_types = list(mgxs_types)
+		for xstype in self.mgxs_types:
+			if xstype not in REQUIREMENTS:
+				raise ValueError("No tally plan for MGXS type: " + xstype)
+		self.requirements = []
+		for xstype in self.mgxs_types:
+			for req in REQUIREMENTS[xstype]:
+				if req not in self.requirements:
+					self.requirements.append(req)
+		self.tallies = OrderedDict()
+		for score, filters in self.requirements:
+			self.tallies.setdefault(filters, []).append(score)
+
+	@staticmethod
+	def tally_groups(filters, scores):
+		"""Split the scores of one set of filters into openmc.Tally objects
+
+		The flux gets its own tally (for "total" only). Without an
+		energyout filter, which makes the whole tally analog anyway, the
+		analog-only scores are split from the rest.
+
+		Returns
+		-------
+		list of (kind, scores)
+			kind is "flux", "analog" or "" (the estimator left to OpenMC)
+
+		"""
+		reactions = [s for s in scores if s != "flux"]
+		if ENERGYOUT in filters:
+			analog, other = [], reactions
+		else:
+			analog = [s for s in reactions if analog_only(s)]
+			other = [s for s in reactions if not analog_only(s)]
+		groups = [("flux", ["flux"] if "flux" in scores else []), ("", other), ("analog", analog)]
+		return [(kind, group) for kind, group in groups if group]
+
+	@property
+	def num_tallies(self):
+		"""Number of openmc.Tally objects, see tally_groups()"""
+		return sum(len(self.tally_groups(filters, scores)) for filters, scores in self.tallies.items())
+
+	@property
+	def num_unshared(self):
+		"""Number of (score, filters) tallies the Library would create"""
+		return sum(len(REQUIREMENTS[xstype]) for xstype in self.mgxs_types)
+
+	def summary(self):
+		return "{} MGXS types: {} scores in {} tallies (instead of {} tallies)".format(
+			len(self.mgxs_types), len(self.requirements), self.num_tallies, self.num_unshared)
+
+	def build_tallies(self, domain_filter, group_edges, nuclides = ("total",),
+	                  num_delayed_groups = NUM_DELAYED_GROUPS, name = "planned"):
+		"""Create one openmc.Tally per set of filters
+
+		Parameters
+		----------
+		domain_filter : openmc.Filter
+			e.g. openmc.MaterialFilter or openmc.MeshFilter
+		group_edges : iterable of float
+			Energy group edges in eV, increasing
+		nuclides : iterable of str, optional
+			Nuclides of the reaction rate tallies; the flux is always
+			tallied for "total" [Default: ("total",)]
+		num_delayed_groups : int, optional
+			[Default: NUM_DELAYED_GROUPS]
+		name : str, optional
+			Prefix of the tally names [Default: "planned"]
+
+		Returns
+		-------
+		tallies : list of openmc.Tally
+
+		"""
+		import openmc
+		filters = {ENERGY   : openmc.EnergyFilter(group_edges),
+		           ENERGYOUT: openmc.EnergyoutFilter(group_edges),
+		           DELAYED  : openmc.DelayedGroupFilter(list(range(1, num_delayed_groups + 1)))}
+		tallies = []
+		for tally_filters, scores in self.tallies.items():
+			for kind, group in self.tally_groups(tally_filters, scores):
+				tally = openmc.Tally(name = self.tally_name(name, tally_filters, kind))
+				tally.filters = [domain_filter] + [filters[f] for f in tally_filters]
+				tally.scores = group
+				tally.nuclides = ["total"] if kind == "flux" else list(nuclides)
+				if kind == "analog":
+					tally.estimator = "analog"
+				tallies.append(tally)
+		return tallies
+
+	@staticmethod
+	def tally_name(name, filters, kind = ""):
+		return "{} {}{}".format(name, "-".join(filters), " " + kind if kind else "")
+
+	def load(self, statepoint, num_domains, num_groups, name = "planned",
+	         num_delayed_groups = NUM_DELAYED_GROUPS, value = "mean"):
+		"""Read the planned tallies into arrays in group order
+
+		Returns
+		-------
+		rates : dict
+			{(score, filters): numpy.ndarray} with axes (domain, nuclide,
+			[delayed group], [group in], [group out]); group 1 is the
+			fastest group.
+
+		"""
+		sizes = {ENERGY: num_groups, ENERGYOUT: num_groups, DELAYED: num_delayed_groups}
+		rates = {}
+		for tally_filters, scores in self.tallies.items():
+			for kind, group in self.tally_groups(tally_filters, scores):
+				tally = statepoint.get_tally(name = self.tally_name(name, tally_filters, kind))
+				values = numpy.asarray(getattr(tally, value), dtype = float)
+				num_nuclides = values.shape[1]
+				shape = [num_domains] + [sizes[f] for f in tally_filters]
+				for s, score in enumerate(group):
+					array = values[:, :, s].reshape(shape + [num_nuclides])
+					array = numpy.moveaxis(array, -1, 1)
+					# Energy bins increase in energy; groups decrease
+					for axis, f in enumerate(tally_filters):
+						if f != DELAYED:
+							array = numpy.flip(array, axis = axis + 2)
+					rates[(score, tally_filters)] = array
+		return rates
+
+
+def derive(rates, mgxs_type):
+	"""Compute one macroscopic MGXS type from the planned tally arrays
+
+	Parameters
+	----------
+	rates : dict
+		As returned by TallyPlan.load()
+	mgxs_type : str
+
+	Returns
+	-------
+	xs : numpy.ndarray
+		(domain, nuclide, [delayed group], group[, group out])
+
+	"""
+	def r(score, *filters):
+		return rates[(score, filters)]
+
+	if mgxs_type == "chi":
+		return _normalize(r("nu-fission", ENERGYOUT))
+	elif mgxs_type == "chi prompt":
+		return _normalize(r("prompt-nu-fission", ENERGYOUT))
+	elif mgxs_type == "chi-delayed":
+		return _normalize(r("delayed-nu-fission", DELAYED, ENERGYOUT))
+	elif mgxs_type == "beta":
+		return _ratio(r("delayed-nu-fission", DELAYED, ENERGY), r("nu-fission", ENERGY)[:, :, None, :])
+
+	flux = r("flux", ENERGY)
+	if mgxs_type == "transport":
+		return _ratio(r("total", ENERGY) - r("scatter-1", ENERGY), flux)
+	elif mgxs_type == "nu-transport":
+		return _ratio(r("total", ENERGY) - r("nu-scatter-1", ENERGY), flux)
+	elif mgxs_type == "capture":
+		return _ratio(r("absorption", ENERGY) - r("fission", ENERGY), flux)
+	elif mgxs_type == "scatter matrix":
+		return _ratio(r("scatter", ENERGY, ENERGYOUT), flux[..., None])
+	elif mgxs_type == "nu-scatter matrix":
+		return _ratio(r("nu-scatter", ENERGY, ENERGYOUT), flux[..., None])
+	elif mgxs_type == "consistent nu-scatter matrix":
+		multiplicity = _ratio(r("nu-scatter", ENERGY, ENERGYOUT),
+		                      r("scatter", ENERGY, ENERGYOUT).sum(axis = -1, keepdims = True))
+		return _ratio(r("scatter", ENERGY), flux)[..., None]*multiplicity
+	elif mgxs_type == "delayed-nu-fission":
+		return _ratio(r("delayed-nu-fission", DELAYED, ENERGY), flux[:, :, None, :])
+	elif mgxs_type in REQUIREMENTS:
+		# Simple reaction rate over flux
+		return _ratio(r(mgxs_type, ENERGY), flux)
+	raise ValueError("Unknown MGXS type: " + mgxs_type)
+
+
+def derive_all(rates, mgxs_types):
+	"""Return {MGXS type: array} for each of `mgxs_types`"""
+	return OrderedDict((xstype, derive(rates, xstype)) for xstype in mgxs_types)
+
+
+if __name__ == "__main__":
+	six = ['total', 'fission', 'nu-fission', 'capture', 'chi', 'consistent nu-scatter matrix']
+	print(TallyPlan(six).summary())
+	print(TallyPlan(ALL_LIBRARIES).summary())
@@ -5,31 +5,34 @@
 MGXS_TYPE = "fission"
 DIRECTORY = "kinf/tmp/"
 STATEPOINT = DIRECTORY + "statepoint.100.h5"
+# HDF5 store of the loaded library (see mgxs_store.py)
+MGXS_STORE = "kinf/treat_mesh_lib.h5"
 
+import sys
+sys.path.append("..")
 import openmc
 import openmc.mgxs as mgxs
+import mgxs_store
 from pylab import *
 
 sp = openmc.StatePoint(STATEPOINT)
 mesh = sp.meshes[1]
-mesh_lib = mgxs.Library.load_from_file(filename="treat_mesh_lib", directory="kinf/")
-mesh_lib.load_from_statepoint(sp)
-
-#mesh_lib.load_from_statepoint(sp)
-#mesh_lib.domains = [mesh]
-mgxs_data = mesh_lib.get_mgxs(mesh, MGXS_TYPE)
-df = mgxs_data.get_pandas_dataframe()
+if not mgxs_store.is_current(MGXS_STORE, STATEPOINT):
+	# Load the pickled library once; later runs only read the store
+	mesh_lib = mgxs.Library.load_from_file(filename="treat_mesh_lib", directory="kinf/")
+	mesh_lib.load_from_statepoint(sp)
+	mgxs_store.write_library(mesh_lib, MGXS_STORE, source=STATEPOINT)
+store = mgxs_store.MGXSStore(MGXS_STORE)
 tally26 = sp.tallies[26]
 scores = tally26._scores
 print(scores)
-print(mgxs_data)
+print(store)
 
-for g in range(1, 11 + 1):
+for g in range(1, store.num_groups + 1):
 #for g in range(11,12):
-	group_df = df[df["group in"] == g]
-	#uncert = group_df['std. dev.']
-	xsvals = array(group_df['mean'])
-	xsvals.shape = mesh.dimension
+	# Only this group is read from the store
+	xsvals = store.get_xs(MGXS_TYPE, mesh, groups=g - 1)
+	#uncert = store.get_xs(MGXS_TYPE, mesh, value="std_dev", groups=g - 1)
 	# Set the zero xs to NaN
 	indices = xsvals <= 1E-6
 	xsvals[indices] = NaN
@@ -6,12 +6,17 @@
 import openmc
 import numpy
 import area_calculator
+import geometry_snapshot
+import profiling
 from copy import deepcopy
+from nuclide_densities import merge_nuclide_densities, merge_nuclide_densities_by_cell
 
 LAT_ID = 100
 FUEL_UNIVERSE = 9  # 99 for active fuel
 REFL_UNIVERSE = 4  # 26 for active reflector
 CONTROL_UNIVERSE = 5  # 99 (minus hole) for active crd
+# Lattice rows/columns containing these universes get the fine subdivision
+FINE_UNIVERSES = (FUEL_UNIVERSE, CONTROL_UNIVERSE)
 
 MAT_IDS = {"fuel"    : 90000,
            "air"     : 20000,
@@ -20,88 +25,6 @@ MAT_IDS = {"fuel"    : 90000,
            "graphite": 20012}
 
 
-def merge_nuclide_densities(old_dict, new_dict, vfrac):
-	"""Add a dictionary of nuclide densities to an existing dictionary
-	by volume fraction.
-	
-	Parameters
-	----------
-	old_dict : dictionary
-		Existing Dictionary whose keys are nuclide names and values are
-			3-tuples of (nuclide, density percent, density percent type)
-	
-	new_dict : dictionary
-		Dictionary to merge into old_dict. Must be of the same format,
-			and nuclides must share fraction type.
-	
-	vfrac : float
-		Volume fraction of the material whose nuclides are in new_dict
-	
-	
-	Returns
-	-------
-	old_dict : dictionary
-		The original dictionary updated with the values from new_dict
-	
-	"""
-	for key in new_dict:
-		if key in old_dict:
-			old_tuple = old_dict[key]
-			new_tuple = new_dict[key]
-			# Third entry is the percent type
-			old_type = old_tuple[2]
-			new_type = new_tuple[2]
-			errstr = "Density percents must be of the same type. \
-			Expected '{}', got '{}'".format(old_type, new_type)
-			assert old_type == new_type, errstr
-			
-			# Update the dictionary with the appropriate fraction of this nuclide
-			merged_frac = old_tuple[1] + new_tuple[1]*vfrac
-			old_dict[key] = (old_tuple[0], merged_frac, old_type)
-		else:
-			old_dict[key] = new_dict[key]
-	return old_dict
-
-
-def merge_nuclide_densities_by_cell(cell_dict, vfrac_list, nuclide_densities = None):
-	"""Find and merge the nuclide densities for several OpenMC cells
-
-	Parameters
-	----------
-	cell_dict : collections.OrderedDict
-		Ordered dictionary of {cell_id : openmc.Cell} from which each
-			cell nuclide densities will be looked up
-	
-	vfrac_list : list or tuple
-		List of the volume fractions corresponding to each Cell.
-			Must be the same length as cell_dict.
-	
-	nuclide_densities : dictionary, optional
-		Existing Dictionary whose keys are nuclide names and values are
-			3-tuples of (nuclide, density percent, density percent type).
-			Nuclide densities from cell_dict will be merged into this.
-	
-	Returns
-	-------
-	nuclide_densities: dictionary
-
-	"""
-	n = len(cell_dict)
-	assert n == len(vfrac_list), \
-		"Number of volume fractions given does not equal number of cells."
-	
-	if nuclide_densities is None:
-		nuclide_densities = {}
-	i = 0
-	
-	for id in cell_dict:
-		cell_nuc_dens = cell_dict[id].get_nuclide_densities()
-		v = vfrac_list[i]
-		i += 1
-		nuclide_densities = merge_nuclide_densities(nuclide_densities, cell_nuc_dens, v)
-	return nuclide_densities
-
-
 class Treat_Mesh(openmc.Mesh):
 	"""A structured Cartesian mesh in one, two, or three dimensions
 
@@ -111,7 +34,7 @@ class Treat_Mesh(openmc.Mesh):
 		Unique identifier for the mesh
 	name : str
 		Name of the mesh
-	geometry: openmc.Geometry
+	geometry: openmc.Geometry or geometry_snapshot.GeometrySnapshot
 		Geometry of the TREAT model
 	mesh_size : tuple of floats
 		Mesh size in units of complete assemblies.
@@ -138,6 +61,7 @@ class Treat_Mesh(openmc.Mesh):
 
 	"""
 	
+	@profiling.timed("Treat_Mesh.__init__")
 	def __init__(self, mesh_id = None, name = '', geometry = None, mesh_size = (1, 1, 1)):
 		super().__init__(mesh_id, name)
 		self.geometry = geometry
@@ -181,6 +105,7 @@ class Treat_Mesh(openmc.Mesh):
 			self._dimension[i] = self._mesh_size[i]*xyz[i]
 			
 	
+	@profiling.timed("Treat_Mesh.get_nuclides")
 	def get_nuclides(self):
 		"""Return all of the nuclides in the active region of the core.
 		
@@ -197,6 +122,7 @@ class Treat_Mesh(openmc.Mesh):
 					nuclides.append(nuclide)
 		return nuclides
 	
+	@profiling.timed("Treat_Mesh.get_nuclide_densities")
 	def get_nuclide_densities(self, assembly_type):
 		"""Return all nuclides contained in the universe
 		
@@ -234,10 +160,165 @@ class Treat_Mesh(openmc.Mesh):
 		return nuclide_densities
 
 
+def lattice_universe_ids(lattice):
+	"""Universe IDs of a lattice as a 2-D array, (y, x) with the top row first
+
+	Works for openmc.RectLattice and geometry_snapshot.LightLattice.
+	"""
+	universes = numpy.asarray(lattice.universes)
+	if universes.dtype == object:
+		universes = numpy.vectorize(lambda u: u.id, otypes = [int])(universes)
+	if universes.ndim == 3:
+		universes = universes[0]
+	return universes
+
+
+def divisions_from_universes(universe_ids, fine_divisions, coarse_divisions = 1,
+                             fine_universes = FINE_UNIVERSES):
+	"""Choose the subdivision of each lattice column and row
+
+	A column (or row) gets `fine_divisions` if it contains any of the
+	`fine_universes`, and `coarse_divisions` otherwise.
+
+	Parameters
+	----------
+	universe_ids : numpy.ndarray of int
+		(y, x) with the top row first, as from lattice_universe_ids()
+	fine_divisions, coarse_divisions : int
+	fine_universes : iterable of int, optional
+		[Default: FINE_UNIVERSES]
+
+	Returns
+	-------
+	x_divisions : numpy.ndarray of int
+		One per column, left to right
+	y_divisions : numpy.ndarray of int
+		One per row, bottom to top
+
+	"""
+	fine = numpy.isin(universe_ids, list(fine_universes))[::-1, :]
+	x_divisions = numpy.where(fine.any(axis = 0), fine_divisions, coarse_divisions)
+	y_divisions = numpy.where(fine.any(axis = 1), fine_divisions, coarse_divisions)
+	return x_divisions, y_divisions
+
+
+class Rectilinear_Treat_Mesh(Treat_Mesh):
+	"""A Treat_Mesh whose subdivision varies by lattice column and row
+
+	Each lattice column i is split into x_divisions[i] equal mesh cells,
+	and each row j (from the bottom) into y_divisions[j], so the fueled
+	center can be fine while the reflector and dummy assemblies at the
+	periphery stay coarse. OpenMC 0.9 only tallies on regular meshes:
+	tally on regular_mesh() and collapse the arrays onto this mesh with
+	mesh_arrays.get_mesh_arrays(..., target = this mesh), or homogenize
+	onto it directly from the material library (mesh_homogenization.py).
+
+	Parameters
+	----------
+	mesh_id : int
+		Unique identifier for the mesh
+	name : str
+		Name of the mesh
+	geometry: openmc.Geometry or geometry_snapshot.GeometrySnapshot
+		Geometry of the TREAT model
+	x_divisions, y_divisions : int or iterable of int
+		Mesh cells per assembly in each lattice column and row
+
+	Attributes
+	----------
+	x_grid, y_grid : numpy.ndarray
+		Mesh cell edges in x and y
+	cell_volumes : numpy.ndarray
+		(nx, ny) volume of each mesh cell over the active height
+
+	"""
+	
+	def __init__(self, mesh_id = None, name = '', geometry = None, x_divisions = 1, y_divisions = 1):
+		super().__init__(mesh_id, name, geometry)
+		lattice = geometry.get_all_lattices()[LAT_ID]
+		self.lattice_shape = tuple(lattice.shape[:2])
+		self.pitch = numpy.asarray(lattice.pitch[:2], dtype = float)
+		lower_left = numpy.asarray(lattice.lower_left[:2], dtype = float)
+		self.lower_left = list(lower_left) + [self._surfaces[20009].z0]
+		self.upper_right = list(lower_left + self.pitch*self.lattice_shape) + \
+		                   [self._surfaces[20010].z0]
+		self.x_divisions = x_divisions
+		self.y_divisions = y_divisions
+	
+	@classmethod
+	def from_universes(cls, geometry, fine_divisions, coarse_divisions = 1,
+	                   fine_universes = FINE_UNIVERSES, mesh_id = None, name = ''):
+		"""Fine subdivision only in the lattice columns and rows with fuel or control rods"""
+		ids = lattice_universe_ids(geometry.get_all_lattices()[LAT_ID])
+		x_divisions, y_divisions = divisions_from_universes(
+			ids, fine_divisions, coarse_divisions, fine_universes)
+		return cls(mesh_id, name, geometry, x_divisions, y_divisions)
+	
+	def _check_divisions(self, divisions, n):
+		divisions = numpy.asarray(divisions, dtype = int)
+		if divisions.ndim == 0:
+			divisions = numpy.full(n, int(divisions))
+		if divisions.shape != (n,) or (divisions < 1).any():
+			raise ValueError("Expected {} positive divisions, got {}".format(n, divisions))
+		return divisions
+	
+	@property
+	def x_divisions(self):
+		return self._x_divisions
+	
+	@x_divisions.setter
+	def x_divisions(self, divisions):
+		self._x_divisions = self._check_divisions(divisions, self.lattice_shape[0])
+	
+	@property
+	def y_divisions(self):
+		return self._y_divisions
+	
+	@y_divisions.setter
+	def y_divisions(self, divisions):
+		self._y_divisions = self._check_divisions(divisions, self.lattice_shape[1])
+	
+	@property
+	def dimension(self):
+		return [int(self._x_divisions.sum()), int(self._y_divisions.sum()), 1]
+	
+	def _grid(self, divisions, axis):
+		start = self.lower_left[axis] + self.pitch[axis]*numpy.arange(len(divisions))
+		edges = [s + self.pitch[axis]*numpy.arange(d)/d for s, d in zip(start, divisions)]
+		return numpy.append(numpy.concatenate(edges), self.upper_right[axis])
+	
+	@property
+	def x_grid(self):
+		return self._grid(self._x_divisions, 0)
+	
+	@property
+	def y_grid(self):
+		return self._grid(self._y_divisions, 1)
+	
+	@property
+	def cell_volumes(self):
+		return numpy.outer(numpy.diff(self.x_grid), numpy.diff(self.y_grid))*self.zactive
+	
+	@property
+	def fine_divisions(self):
+		"""Subdivision of the regular mesh that every division divides evenly"""
+		return int(numpy.lcm.reduce(numpy.concatenate((self._x_divisions, self._y_divisions))))
+	
+	def regular_mesh(self, mesh_id = None, name = ''):
+		"""The regular Treat_Mesh to tally on, refined enough to collapse onto this mesh"""
+		fine = self.fine_divisions
+		mesh = Treat_Mesh(mesh_id, name, self.geometry)
+		mesh.mesh_size = (fine, fine, 1)
+		mesh.lower_left = self.lower_left
+		mesh.upper_right = self.upper_right
+		mesh.type = 'regular'
+		mesh.dimension = list(self.lattice_shape) + [1]
+		return mesh
+
+
 # test
 if __name__ == "__main__":
-	summ = openmc.Summary("summary.h5")
-	geom = summ.geometry
+	geom = geometry_snapshot.load_geometry("summary.h5")
 	mesh = Treat_Mesh(geometry = geom)
 	mesh.get_nuclides()
 	fuel_nuc_dens = mesh.get_nuclide_densities(assembly_type = "fuel")
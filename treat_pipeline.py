@@ -0,0 +1,332 @@
+# TREAT pipeline
+#
+# The whole 2D TREAT workflow as cached pipeline stages:
+#   summary -> MGXS libraries -> tallies.xml -> statepoint -> mesh arrays
+#   -> diffusion preview and OpenMOC -> plots
+# Settings live in CONFIG instead of in the EXPORT/RUN/PLOT/CMFD and
+# MESH_DIVISIONS constants of the individual scripts; changing one only
+# re-runs the stages that depend on it.
+
+import os
+import shutil
+import subprocess
+import numpy
+from copy import deepcopy
+from pipeline import Stage, Pipeline
+
+CONFIG = {
+	"summary"       : "treat2d/summary.h5",
+	"inputs"        : "treat2d/",
+	"mesh_divisions": 4,
+	"groups"        : "11-group",
+	"mgxs_types"    : ['total', 'fission', 'nu-fission', 'capture', 'chi',
+	                   'consistent nu-scatter matrix'],
+	"mesh_xs_mode"  : "mesh",
+	"prune_nuclides": False,
+	"particles"     : int(1E5),
+	"batches"       : 100,
+	"inactive"      : 35,
+	"threads"       : None,
+	"num_azim"      : 16,
+	"azim_spacing"  : 1.0,
+	"cmfd"          : False,
+	"plot_directory": "plots/pipeline/",
+}
+
+MODEL_FILES = ("geometry.xml", "materials.xml")
+
+
+def run_directory(config):
+	num = config["mesh_divisions"]*19
+	return os.path.join(config["inputs"], "{0}x{0}".format(num))
+
+
+def _path(config, filename):
+	return os.path.join(run_directory(config), filename)
+
+
+def _statepoint_file(config):
+	return _path(config, "statepoint.{}.h5".format(config["batches"]))
+
+
+def _make_meshes(geom, mesh_divisions):
+	"""The Treat_Mesh over the core lattice and the assembly-wise coarse mesh"""
+	import openmc
+	from treat_mesh import Treat_Mesh
+	mesh = Treat_Mesh(1, geometry = geom)
+	mesh.mesh_size = (mesh_divisions, mesh_divisions, 1)
+	core_lat = geom.get_all_lattices()[100]
+	mesh.lower_left = deepcopy(core_lat.lower_left)
+	mesh.lower_left[-1] = mesh._surfaces[20009].z0
+	mesh.upper_right = -deepcopy(core_lat.lower_left)
+	mesh.upper_right[-1] = mesh._surfaces[20010].z0
+	mesh.type = 'regular'
+	mesh.dimension = deepcopy(core_lat.shape)
+
+	coarse_mesh = openmc.Mesh(2, name = "coarse flux mesh")
+	coarse_mesh.type = 'regular'
+	coarse_mesh.lower_left = mesh.lower_left
+	coarse_mesh.upper_right = mesh.upper_right
+	coarse_mesh.dimension = list(core_lat.shape[:2]) + [1]
+	return mesh, coarse_mesh
+
+
+def _load_model(config):
+	import openmc
+	geom = openmc.Summary(config["summary"]).geometry
+	mesh, coarse_mesh = _make_meshes(geom, config["mesh_divisions"])
+	return geom, mesh, coarse_mesh
+
+
+def _energy_groups(config):
+	from openmc import mgxs
+	import energy_groups
+	groups = mgxs.EnergyGroups()
+	groups.group_edges = energy_groups.treat[config["groups"]].group_edges*1E6
+	return groups
+
+
+#######################################
+# Stages
+#######################################
+
+def summary_stage(config, inputs):
+	"""Refresh the cached geometry snapshot of the summary"""
+	import geometry_snapshot
+	geometry_snapshot.load_geometry(config["summary"])
+	return config["summary"]
+
+
+def libraries_stage(config, inputs):
+	"""Build and dump the mesh and material MGXS libraries"""
+	from openmc import mgxs
+	geom, mesh, coarse_mesh = _load_model(config)
+	groups = _energy_groups(config)
+	mats = geom.get_all_materials()
+	directory = run_directory(config)
+	os.makedirs(directory, exist_ok = True)
+
+	material_lib = mgxs.Library(geom)
+	material_lib.energy_groups = groups
+	material_lib.mgxs_types = config["mgxs_types"]
+	material_lib.domain_type = "material"
+	material_lib.domains = mats.values()
+	material_lib.by_nuclide = False
+	material_lib.build_library()
+	material_lib.dump_to_file("treat_material_lib", directory)
+
+	mesh_lib = mgxs.Library(geom)
+	mesh_lib.energy_groups = groups
+	mesh_lib.mgxs_types = config["mgxs_types"]
+	mesh_lib.by_nuclide = config["mesh_xs_mode"] == "mesh"
+	mesh_lib.domain_type = "mesh"
+	mesh_lib.correction = None
+	mesh_lib.domains = [mesh]
+	mesh_lib.build_library()
+	if "consistent nu-scatter matrix" in config["mgxs_types"]:
+		mesh_lib.get_mgxs(mesh, 'consistent nu-scatter matrix').by_nuclide = False
+	if config["prune_nuclides"] and mesh_lib.by_nuclide:
+		import nuclide_pruning
+		nuclide_pruning.apply_to_library(mesh_lib, nuclide_pruning.prune(mats.values()))
+	mesh_lib.dump_to_file("treat_mesh_lib", directory)
+	return {"mesh": _path(config, "treat_mesh_lib.pkl"),
+	        "material": _path(config, "treat_material_lib.pkl")}
+
+
+def _library_outputs(config):
+	return [_path(config, "treat_mesh_lib.pkl"), _path(config, "treat_material_lib.pkl")]
+
+
+def tallies_stage(config, inputs):
+	"""Write the OpenMC input files of the run directory"""
+	import openmc
+	from openmc import mgxs
+	import xml.etree.ElementTree as ET
+	directory = run_directory(config)
+	mesh_lib = mgxs.Library.load_from_file("treat_mesh_lib", directory)
+	material_lib = mgxs.Library.load_from_file("treat_material_lib", directory)
+	geom, mesh, coarse_mesh = _load_model(config)
+
+	mesh_filter = openmc.MeshFilter(mesh)
+	fission_tally = openmc.Tally(name = 'mesh tally')
+	fission_tally.filters = [mesh_filter]
+	fission_tally.scores = ["fission"]
+	tallies_file = openmc.Tallies([fission_tally])
+	if config["mesh_xs_mode"] == "material":
+		coarse_tally = openmc.Tally(name = "coarse flux")
+		coarse_tally.filters = [openmc.MeshFilter(coarse_mesh),
+		                        openmc.EnergyFilter(_energy_groups(config).group_edges)]
+		coarse_tally.scores = ["flux"]
+		tallies_file.append(coarse_tally)
+	else:
+		mesh_lib.add_to_tallies_file(tallies_file, merge = True)
+	material_lib.add_to_tallies_file(tallies_file, merge = True)
+	tallies_file.export_to_xml(_path(config, "tallies.xml"))
+
+	for filename in MODEL_FILES:
+		shutil.copy(os.path.join(config["inputs"], filename), directory)
+	tree = ET.parse(os.path.join(config["inputs"], "settings.xml"))
+	for tag in ("particles", "batches", "inactive"):
+		tree.getroot().find(tag).text = str(config[tag])
+	tree.write(_path(config, "settings.xml"))
+	return directory
+
+
+def _run_files(config):
+	return [_path(config, f) for f in MODEL_FILES + ("settings.xml", "tallies.xml")]
+
+
+def statepoint_stage(config, inputs):
+	"""Run OpenMC"""
+	command = ["openmc"]
+	if config["threads"]:
+		command += ["-s", str(config["threads"])]
+	subprocess.check_call(command, cwd = run_directory(config))
+	return _statepoint_file(config)
+
+
+def arrays_stage(config, inputs):
+	"""Mesh cross sections and Monte Carlo fission rates from the statepoint"""
+	import openmc
+	import mesh_arrays
+	directory = run_directory(config)
+	sp = openmc.StatePoint(inputs["statepoint"])
+	geom, mesh, coarse_mesh = _load_model(config)
+	if config["mesh_xs_mode"] == "material":
+		from openmc import mgxs
+		import geometry_snapshot
+		import mesh_homogenization
+		from point_classifier import PointClassifier
+		material_lib = mgxs.Library.load_from_file("treat_material_lib", directory)
+		material_lib.load_from_statepoint(sp)
+		classifier = PointClassifier(geometry_snapshot.load_geometry(config["summary"]))
+		material_ids, fractions = mesh_homogenization.volume_fractions(classifier, mesh)
+		arrays = mesh_homogenization.homogenize(
+			material_lib, material_ids, fractions,
+			coarse_flux = mesh_homogenization.load_coarse_flux(sp, coarse_mesh.dimension))
+	else:
+		mesh_lib = mesh_arrays.load_mesh_library(sp, mesh, "treat_mesh_lib", directory)
+		arrays = mesh_arrays.get_mesh_arrays(mesh_lib, mesh)
+
+	tally = sp.get_tally(name = "mesh tally")
+	fission = numpy.array(tally.get_values(scores = ["fission"])[:, 0, 0])
+	fission_std = numpy.array(tally.get_values(scores = ["fission"], value = "std_dev")[:, 0, 0])
+	fission[fission == 0] = numpy.nan
+	fission.shape = mesh.dimension
+	fission_std.shape = mesh.dimension
+	fission_std /= numpy.nanmean(fission)
+	fission /= numpy.nanmean(fission)
+
+	filename = _path(config, "mesh_xs.npz")
+	mesh_arrays.save_arrays(filename, arrays, mc_fission_rates = fission,
+	                        mc_fission_std = fission_std,
+	                        lower_left = numpy.asarray(mesh.lower_left, dtype = float),
+	                        upper_right = numpy.asarray(mesh.upper_right, dtype = float),
+	                        keff = numpy.asarray(sp.k_combined, dtype = float))
+	return filename
+
+
+def _load_arrays(filename):
+	import mesh_arrays
+	arrays = mesh_arrays.load_arrays(filename)
+	extra = {key: arrays.pop(key) for key in ("mc_fission_rates", "mc_fission_std",
+	                                          "lower_left", "upper_right", "keff")}
+	return arrays, extra
+
+
+def diffusion_stage(config, inputs):
+	"""Quick diffusion eigenvalue of the mesh arrays"""
+	from diffusion import DiffusionSolver
+	arrays, extra = _load_arrays(inputs["arrays"])
+	nx, ny = arrays["total"].shape[:2]
+	width = extra["upper_right"] - extra["lower_left"]
+	result = DiffusionSolver(arrays, width[0]/nx, width[1]/ny).solve()
+	return {"keff": result.keff, "iterations": result.iterations,
+	        "bias_pcm": (result.keff - extra["keff"][0])*1E5}
+
+
+def moc_stage(config, inputs):
+	"""Solve the checkerboard in OpenMOC and save both sets of fission rates"""
+	import openmoc
+	import openmoc.process
+	import moc_builder
+	arrays, extra = _load_arrays(inputs["arrays"])
+	num_groups = arrays["total"].shape[-1]
+	dimension = extra["mc_fission_rates"].shape
+	materials = moc_builder.build_materials(arrays, num_groups)
+	geom = moc_builder.build_geometry(materials, extra["lower_left"], extra["upper_right"])
+	if config["cmfd"]:
+		cmfd = openmoc.Cmfd()
+		cmfd.setSORRelaxationFactor(1.5)
+		cmfd.setLatticeStructure(dimension[0], dimension[1])
+		cmfd.setKNearest(3)
+		geom.setCmfd(cmfd)
+	track_generator = openmoc.TrackGenerator(geom, num_azim = config["num_azim"],
+	                                         azim_spacing = config["azim_spacing"])
+	track_generator.generateTracks()
+	solver = openmoc.CPUSolver(track_generator)
+	solver.computeEigenvalue()
+
+	moc_mesh = openmoc.process.Mesh()
+	moc_mesh.dimension = numpy.array(dimension)
+	moc_mesh.lower_left = extra["lower_left"]
+	moc_mesh.upper_right = extra["upper_right"]
+	moc_mesh.width = (moc_mesh.upper_right - moc_mesh.lower_left)/moc_mesh.dimension
+	moc_rates = numpy.array(moc_mesh.tally_fission_rates(solver))
+	moc_rates.shape = dimension
+	moc_rates = numpy.fliplr(moc_rates)
+
+	files = {"moc": _path(config, "moc_fission_rates"),
+	         "mc": _path(config, "montecarlo_fission_rates"),
+	         "mc_std": _path(config, "montecarlo_fission_uncertainties")}
+	numpy.savetxt(files["moc"], moc_rates)
+	numpy.savetxt(files["mc"], extra["mc_fission_rates"])
+	numpy.savetxt(files["mc_std"], extra["mc_fission_std"])
+	return dict(files, keff = solver.getKeff(), bias_pcm = (solver.getKeff() - extra["keff"][0])*1E5)
+
+
+def _moc_outputs(config):
+	return [_path(config, f) for f in ("moc_fission_rates", "montecarlo_fission_rates",
+	                                   "montecarlo_fission_uncertainties")]
+
+
+def plots_stage(config, inputs):
+	"""Render the MC vs. MOC comparison maps"""
+	import batch_plots
+	moc = inputs["moc"]
+	jobs = batch_plots.comparison_jobs(numpy.loadtxt(moc["mc"]), numpy.loadtxt(moc["moc"]),
+	                                   directory = config["plot_directory"])
+	return batch_plots.render_all(jobs)
+
+
+STAGES = [
+	Stage("summary", summary_stage, files = lambda c: [c["summary"]]),
+	Stage("libraries", libraries_stage, requires = ["summary"],
+	      config_keys = ["mesh_divisions", "groups", "mgxs_types", "mesh_xs_mode", "prune_nuclides"],
+	      outputs = _library_outputs),
+	Stage("tallies", tallies_stage, requires = ["libraries"],
+	      files = lambda c: [os.path.join(c["inputs"], f) for f in MODEL_FILES + ("settings.xml",)],
+	      config_keys = ["particles", "batches", "inactive", "mesh_xs_mode"],
+	      outputs = _run_files),
+	Stage("statepoint", statepoint_stage, requires = ["tallies"], files = _run_files,
+	      config_keys = ["threads"], outputs = lambda c: [_statepoint_file(c)]),
+	Stage("arrays", arrays_stage, requires = ["statepoint", "libraries"],
+	      config_keys = ["mesh_xs_mode"], outputs = lambda c: [_path(c, "mesh_xs.npz")]),
+	Stage("diffusion", diffusion_stage, requires = ["arrays"]),
+	Stage("moc", moc_stage, requires = ["arrays"],
+	      config_keys = ["num_azim", "azim_spacing", "cmfd"], outputs = _moc_outputs),
+	Stage("plots", plots_stage, requires = ["moc"], config_keys = ["plot_directory"]),
+]
+
+
+def make_pipeline():
+	return Pipeline(STAGES)
+
+
+if __name__ == "__main__":
+	import sys
+	results, report = make_pipeline().run(CONFIG, targets = sys.argv[1:] or None)
+	if "diffusion" in results:
+		print("Diffusion keff: {keff:1.6f} ({bias_pcm:.0f} pcm)".format(**results["diffusion"]))
+	if "moc" in results:
+		print("OpenMOC keff:   {keff:1.6f} ({bias_pcm:.0f} pcm)".format(**results["moc"]))
@@ -0,0 +1,218 @@
+# Warm start
+#
+# Start the OpenMOC eigenvalue solve from the Monte Carlo solution rather
+# than from a flat flux. The MC fission rate mesh tally gives the spatial
+# shape; each mesh cell's spectrum is its infinite-medium spectrum from
+# the mesh cross sections (or the MC flux itself, when it was tallied).
+# Every flat source region takes the flux of the mesh cell holding its
+# centroid.
+
+import time
+import warnings
+import numpy
+from mesh_arrays import mesh_grids, cell_map
+from scatter_storage import BandedScatter
+
+# NumPy dtype of OpenMOC's FP_PRECISION; None to ask the build (see flux_dtype())
+FLUX_DTYPE = None
+
+# Flux arrays handed to solvers, by id(solver). OpenMOC keeps the pointer
+# to the array given to setFluxes(), so it must outlive the solve.
+_flux_buffers = {}
+
+
+def infinite_spectra(arrays):
+	"""Infinite-medium flux spectrum of every mesh cell: (nx, ny, G)
+
+	Solves (diag(total) - scatter^T) phi = chi in each cell, with the
+	core-average chi in the cells that have none, and normalizes each
+	spectrum to sum to 1.
+
+	"""
+	total = numpy.asarray(arrays["total"], dtype = float)
+	scatter = arrays["nu-scatter"]
+	if isinstance(scatter, BandedScatter):
+		scatter = scatter.to_dense()
+	nx, ny, G = total.shape
+	chi = numpy.asarray(arrays["chi"], dtype = float).reshape(-1, G)
+	has_chi = chi.sum(axis = 1) > 0
+	chi[~has_chi] = chi[has_chi].mean(axis = 0) if has_chi.any() else 1.0/G
+
+	# Removal operator of each cell, with the outgoing group in the rows
+	A = -numpy.swapaxes(numpy.asarray(scatter, dtype = float).reshape(-1, G, G), 1, 2)
+	A[:, numpy.arange(G), numpy.arange(G)] += total.reshape(-1, G)
+	# Void or near-void cells would be singular; give them the source shape
+	singular = numpy.abs(numpy.linalg.det(A)) < 1E-300
+	A[singular] = numpy.eye(G)
+	spectra = numpy.linalg.solve(A, chi[:, :, None])[:, :, 0]
+	spectra = numpy.clip(spectra, 0, None)
+	norm = spectra.sum(axis = 1, keepdims = True)
+	norm[norm <= 0] = 1.0
+	return (spectra/norm).reshape(nx, ny, G)
+
+
+def rates_on_mesh(rates, rates_mesh, mesh):
+	"""Sum a (nx, ny) rate map from `rates_mesh` onto the cells of `mesh`"""
+	rates = numpy.nan_to_num(numpy.asarray(rates, dtype = float).reshape(
+		rates_mesh.dimension[:2]))
+	if list(rates_mesh.dimension[:2]) == list(mesh.dimension[:2]):
+		return rates
+	x_index, y_index = cell_map(rates_mesh, mesh)
+	summed = numpy.zeros(mesh.dimension[:2])
+	numpy.add.at(summed, (x_index[:, None], y_index[None, :]), rates)
+	return summed
+
+
+def initial_flux(arrays, fission_rates, flux = None):
+	"""Guess the scalar flux on the mesh from the MC fission rates
+
+	Parameters
+	----------
+	arrays : dict of numpy.ndarray
+		Mesh cross sections, as from mesh_arrays.get_mesh_arrays()
+	fission_rates : numpy.ndarray
+		(nx, ny) MC fission rates on the same mesh; any normalization
+	flux : numpy.ndarray, optional
+		(nx, ny, G) MC flux (mesh_arrays.mesh_flux()), used for the
+		spectrum instead of the infinite-medium spectra
+
+	Returns
+	-------
+	numpy.ndarray
+		(nx, ny, G), scaled so that its fission rates match the MC ones in
+		the fueled cells. Cells without fission get the mean amplitude of
+		the fueled cells.
+
+	"""
+	if flux is not None:
+		norm = flux.sum(axis = 2, keepdims = True)
+		norm[norm <= 0] = 1.0
+		spectra = flux/norm
+	else:
+		spectra = infinite_spectra(arrays)
+	fission = arrays["fission"] if "fission" in arrays else arrays["nu-fission"]
+	rates = numpy.nan_to_num(numpy.asarray(fission_rates, dtype = float))
+	per_unit = (fission*spectra).sum(axis = 2)
+	fueled = (per_unit > 0) & (rates > 0)
+	amplitude = numpy.zeros(rates.shape)
+	amplitude[fueled] = rates[fueled]/per_unit[fueled]
+	amplitude[~fueled] = amplitude[fueled].mean() if fueled.any() else 1.0
+	return amplitude[:, :, None]*spectra
+
+
+def fsr_mesh_cells(geometry, mesh, flip_y = True):
+	"""Mesh cell (i, j) of the centroid of every flat source region
+
+	The centroids are only known once the tracks have been generated.
+	OpenMOC lattices list their rows from the top, so the geometries of
+	moc_builder.py hold row j of the arrays at the mirror image of mesh
+	row j (hence the fliplr of the MOC fission rates in
+	build_moc_checkerboard.py); flip_y mirrors the centroids to match.
+
+	"""
+	num_fsrs = geometry.getNumFSRs()
+	points = numpy.empty((num_fsrs, 2))
+	for fsr in range(num_fsrs):
+		centroid = geometry.getFSRCentroid(fsr)
+		points[fsr] = centroid.getX(), centroid.getY()
+	if flip_y:
+		y_grid = mesh_grids(mesh)[1]
+		points[:, 1] = y_grid[0] + y_grid[-1] - points[:, 1]
+	index = []
+	for axis, grid in enumerate(mesh_grids(mesh)):
+		index.append(numpy.clip(numpy.searchsorted(grid, points[:, axis]) - 1, 0, len(grid) - 2))
+	return tuple(index)
+
+
+def flux_dtype():
+	"""NumPy dtype of the fluxes of the OpenMOC build: float32 or float64
+
+	setFluxes() converts an array of any other dtype to a temporary copy,
+	whose pointer the solver would keep. FLUX_DTYPE overrides the build's
+	answer.
+
+	"""
+	if FLUX_DTYPE is not None:
+		return numpy.dtype(FLUX_DTYPE)
+	import openmoc
+	if hasattr(openmoc, "get_fp_precision"):
+		precision = openmoc.get_fp_precision()
+	else:
+		precision = getattr(openmoc, "FP_PRECISION", "double")
+	if str(precision).lower() in ("single", "float", "float32"):
+		return numpy.dtype(numpy.float32)
+	return numpy.dtype(numpy.float64)
+
+
+def set_fluxes(solver, fluxes):
+	"""Give an OpenMOC solver the scalar fluxes to start its next solve from
+
+	Parameters
+	----------
+	solver : openmoc.Solver
+		With its track generator's tracks already generated
+	fluxes : numpy.ndarray
+		(number of FSRs, G) or flat FSR-major scalar fluxes
+
+	Returns
+	-------
+	bool
+		False, with a warning, if the build cannot restart from given
+		fluxes (it would flatten them), in which case none are set
+
+	The solver is put in restart mode, so that computeEigenvalue() keeps
+	the fluxes instead of flattening them, and the flux buffer is kept
+	alive for as long as the solver uses it.
+
+	"""
+	if not hasattr(solver, "setRestartStatus"):
+		warnings.warn("This OpenMOC build has no Solver.setRestartStatus(); "
+		              "the solve starts from a flat flux")
+		return False
+	buffer = numpy.ascontiguousarray(fluxes, dtype = flux_dtype()).ravel()
+	_flux_buffers[id(solver)] = buffer
+	solver.setFluxes(buffer)
+	solver.setRestartStatus(True)
+	return True
+
+
+def set_initial_flux(solver, geometry, mesh, cell_flux):
+	"""Hand a mesh flux guess to an OpenMOC solver
+
+	Parameters
+	----------
+	solver : openmoc.Solver
+		With its track generator's tracks already generated
+	geometry : openmoc.Geometry
+	mesh : openmc.Mesh, Treat_Mesh or Rectilinear_Treat_Mesh
+		Mesh of `cell_flux`, covering the geometry
+	cell_flux : numpy.ndarray
+		(nx, ny, G), e.g. from initial_flux()
+
+	Returns
+	-------
+	bool
+		See set_fluxes()
+
+	"""
+	i, j = fsr_mesh_cells(geometry, mesh)
+	fluxes = numpy.asarray(cell_flux[i, j], dtype = float)
+	return set_fluxes(solver, fluxes/fluxes.mean())
+
+
+def compute_eigenvalue(solver, label = "", **kwargs):
+	"""Run solver.computeEigenvalue() and report the iterations it took
+
+	Returns
+	-------
+	dict
+		keff, iterations and wall time in seconds
+
+	"""
+	start = time.perf_counter()
+	solver.computeEigenvalue(**kwargs)
+	result = {"keff": solver.getKeff(), "iterations": solver.getNumIterations(),
+	          "seconds": time.perf_counter() - start}
+	print("{}keff = {:1.6f} after {} iterations ({:.1f} s)".format(
+		label + ": " if label else "", result["keff"], result["iterations"], result["seconds"]))
+	return result
@@ -0,0 +1,205 @@
+# XML geometry
+#
+# Read geometry.xml and materials.xml directly into a GeometrySnapshot,
+# without an OpenMC run (summary.h5) or even an import of openmc.
+# The files are streamed with iterparse, and each element is discarded
+# as soon as its row of the tables has been recorded.
+
+import os
+import numpy
+import xml.etree.ElementTree as ET
+from geometry_snapshot import GeometrySnapshot, COEFFICIENT_NAMES, MAX_COEFFICIENTS, \
+	_material_arrays
+
+
+def _attribute_or_child(element, name, default = None):
+	"""OpenMC accepts most values either as attributes or as subelements"""
+	value = element.get(name)
+	if value is None:
+		child = element.find(name)
+		if child is not None:
+			value = child.text
+	return default if value is None else value.strip()
+
+
+def _iter_elements(filename, tags):
+	"""Yield the completed elements of `filename` whose tag is in `tags`
+
+	Elements are cleared once the caller is done with them, which keeps
+	memory bounded by the largest single element.
+
+	"""
+	context = ET.iterparse(filename, events = ("start", "end"))
+	depth = 0
+	for event, element in context:
+		if event == "start":
+			depth += 1
+			continue
+		depth -= 1
+		if element.tag in tags and depth == 1:
+			yield element
+			element.clear()
+
+
+def read_geometry_tables(filename):
+	"""Stream geometry.xml into the surface, cell and lattice arrays
+
+	Parameters
+	----------
+	filename : str
+		Path to geometry.xml
+
+	Returns
+	-------
+	arrays : dict of numpy.ndarray
+		The geometry keys of GeometrySnapshot
+
+	"""
+	surface_ids = []
+	surface_types = []
+	surface_boundaries = []
+	surface_coefficients = []
+	surface_names = []
+	cells = []
+	lattices = {}
+
+	for element in _iter_elements(filename, ("surface", "cell", "lattice")):
+		if element.tag == "surface":
+			stype = _attribute_or_child(element, "type")
+			coeffs = [float(c) for c in _attribute_or_child(element, "coeffs").split()]
+			names = COEFFICIENT_NAMES.get(stype, tuple("c{}".format(i) for i in range(len(coeffs))))
+			assert len(names) == len(coeffs), \
+				"Surface {} of type {} has {} coefficients".format(element.get("id"), stype, len(coeffs))
+			row = numpy.full(MAX_COEFFICIENTS, numpy.nan)
+			row[:len(coeffs)] = coeffs
+			surface_ids.append(int(_attribute_or_child(element, "id")))
+			surface_types.append(stype)
+			surface_boundaries.append(_attribute_or_child(element, "boundary", "transmission"))
+			surface_coefficients.append(row)
+			surface_names.append(" ".join(names))
+
+		elif element.tag == "cell":
+			material = _attribute_or_child(element, "material")
+			fill = _attribute_or_child(element, "fill")
+			if fill is not None:
+				fill_type, fill_id = "universe", int(fill)
+			elif material is None or material == "void":
+				fill_type, fill_id = "void", -1
+			else:
+				fill_type, fill_id = "material", int(material.split()[0])
+			region = " ".join(_attribute_or_child(element, "region", "").split())
+			cells.append((int(_attribute_or_child(element, "id")),
+			              _attribute_or_child(element, "name", ""),
+			              int(_attribute_or_child(element, "universe", "0")),
+			              fill_type, fill_id, region))
+
+		elif element.tag == "lattice":
+			lid = int(_attribute_or_child(element, "id"))
+			dimension = [int(d) for d in _attribute_or_child(element, "dimension").split()]
+			universes = numpy.array(_attribute_or_child(element, "universes").split(), dtype = int)
+			lattices[lid] = {"pitch": numpy.array(
+				                 _attribute_or_child(element, "pitch").split(), dtype = float),
+			                 "lower_left": numpy.array(
+				                 _attribute_or_child(element, "lower_left").split(), dtype = float),
+			                 "universes": universes.reshape(dimension[::-1]),
+			                 "outer": numpy.array(int(_attribute_or_child(element, "outer", "-1")))}
+
+	arrays = {}
+	arrays["surface_ids"] = numpy.array(surface_ids, dtype = int)
+	arrays["surface_types"] = numpy.array(surface_types, dtype = str)
+	arrays["surface_boundaries"] = numpy.array(surface_boundaries, dtype = str)
+	arrays["surface_coefficients"] = numpy.array(surface_coefficients).reshape(-1, MAX_COEFFICIENTS)
+	arrays["surface_coefficient_names"] = numpy.array(surface_names, dtype = str)
+
+	# Fills may name lattices defined further down the file
+	cells = [(cid, name, universe, "lattice" if ftype == "universe" and fid in lattices else ftype,
+	          fid, region) for cid, name, universe, ftype, fid, region in cells]
+	cids, names, universes, fill_types, fills, regions = zip(*cells) if cells else ((),)*6
+	arrays["cell_ids"] = numpy.array(cids, dtype = int)
+	arrays["cell_names"] = numpy.array(names, dtype = str)
+	arrays["cell_universes"] = numpy.array(universes, dtype = int)
+	arrays["cell_fill_types"] = numpy.array(fill_types, dtype = str)
+	arrays["cell_fills"] = numpy.array(fills, dtype = int)
+	arrays["cell_regions"] = numpy.array(regions, dtype = str)
+
+	arrays["lattice_ids"] = numpy.array(sorted(lattices), dtype = int)
+	for lid, lattice in lattices.items():
+		for key, value in lattice.items():
+			arrays["lattice_{}_{}".format(lid, key)] = value
+	return arrays
+
+
+class _XMLMaterial(object):
+	def __init__(self, material_id, name, density, density_units):
+		self.id = material_id
+		self.name = name
+		self.density = density
+		self.density_units = density_units
+
+
+def read_material_tables(filename):
+	"""Stream materials.xml into the material and nuclide arrays
+
+	Parameters
+	----------
+	filename : str
+		Path to materials.xml
+
+	Returns
+	-------
+	arrays : dict of numpy.ndarray
+		The material keys of GeometrySnapshot
+
+	"""
+	materials = []
+	rows = []
+	for element in _iter_elements(filename, ("material",)):
+		density = element.find("density")
+		units = None if density is None else density.get("units")
+		value = None if density is None else density.get("value")
+		materials.append(_XMLMaterial(int(element.get("id")), element.get("name", ""),
+		                              None if value is None else float(value), units))
+		i = len(materials) - 1
+		for nuclide in element.iter("nuclide"):
+			if nuclide.get("ao") is not None:
+				rows.append((i, nuclide.get("name"), float(nuclide.get("ao")), "ao"))
+			else:
+				rows.append((i, nuclide.get("name"), float(nuclide.get("wo")), "wo"))
+	return _material_arrays(materials, rows)
+
+
+def read_model(geometry_xml = "treat2d/geometry.xml", materials_xml = "treat2d/materials.xml"):
+	"""Build a GeometrySnapshot straight from the XML input files
+
+	Parameters
+	----------
+	geometry_xml : str, optional
+		Path to geometry.xml [Default: "treat2d/geometry.xml"]
+	materials_xml : str, optional
+		Path to materials.xml, or None to skip the materials
+		[Default: "treat2d/materials.xml"]
+
+	Returns
+	-------
+	GeometrySnapshot
+
+	"""
+	arrays = read_geometry_tables(geometry_xml)
+	if materials_xml is not None and os.path.exists(materials_xml):
+		arrays.update(read_material_tables(materials_xml))
+	else:
+		arrays.update(_material_arrays([], []))
+	return GeometrySnapshot(arrays)
+
+
+if __name__ == "__main__":
+	from time import time
+	import area_calculator
+	t0 = time()
+	geom = read_model()
+	print("Read {} surfaces, {} cells, and {} materials in {:.3f} s".format(
+		len(geom.surface_ids), len(geom.cell_ids), len(geom.material_ids), time() - t0))
+	print("\nFuel Cell:")
+	area_calculator.fuel_cell_by_material(geom, True)
+	print("\nReflector Cell:")
+	area_calculator.reflector_cell_by_material(geom, True)